@@ -5,29 +5,220 @@
 import os
 from google.cloud import secretmanager
 from google.cloud import firestore
+from google.cloud import storage
+from google.cloud.firestore_v1.vector import Vector
 from firebase_admin import initialize_app
-from firebase_functions import https_fn, firestore_fn
-from firebase_functions.options import set_global_options
-import requests
-from googleapiclient.discovery import build
+from firebase_functions import https_fn, firestore_fn, scheduler_fn
+from firebase_functions.options import MemoryOption, set_global_options
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 from google.oauth2.credentials import Credentials
 from googleapiclient.errors import HttpError
+from google.api_core import exceptions as google_exceptions
+import asyncio
+import base64
 import logging
 import json
+import re
+import threading
 import time
+import hashlib
+import tempfile
+import random
+from collections import OrderedDict
 from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Generator
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Generator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from openai import (
+    APIConnectionError,
+    AuthenticationError,
+    BadRequestError,
+    InternalServerError,
+    AsyncOpenAI,
+    OpenAI,
+    RateLimitError,
+)
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Constants for embedding configuration
-EMBEDDING_DIMENSIONALITY = 1536
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Sent as the API's `dimensions` parameter (text-embedding-3 models return a shortened,
+# re-normalized vector). Changing it invalidates every stored embedding, so the
+# backfill re-embeds all videos.
+EMBEDDING_DIMENSIONALITY = int(os.environ.get("EMBEDDING_DIMENSIONALITY", "1536"))
+
+# Matryoshka prefix length: text-embedding-3 vectors keep most of their quality when
+# truncated to their leading dimensions and re-normalized. Search and clustering run
+# on these prefixes first and refine the best candidates at full dimension.
+EMBEDDING_PREFIX_DIMENSIONALITY = 256
+
+# Multi-input embedding request packing. The API accepts up to 2048 inputs and
+# 300k tokens per request, and 8191 tokens per input.
+EMBEDDING_BATCH_MAX_ITEMS = 256
+EMBEDDING_BATCH_MAX_TOKENS = 100_000
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+# Estimated-token cap on each embedding input (title and channel are kept whole; the
+# cleaned description is cut to fit)
+EMBEDDING_TEXT_TOKEN_BUDGET = min(
+    int(os.environ.get("EMBEDDING_TEXT_TOKEN_BUDGET", "512")),
+    EMBEDDING_MAX_INPUT_TOKENS,
+)
+
+# Adaptive (AIMD) concurrency for embedding requests, per instance: the limit starts at
+# OPENAI_CONCURRENCY_INITIAL, grows while responses are healthy and faster than the
+# latency target, and halves on 429s, server errors and slow responses
+OPENAI_CONCURRENCY_INITIAL = 4
+OPENAI_CONCURRENCY_MIN = 1
+OPENAI_CONCURRENCY_MAX = 32
+OPENAI_LATENCY_TARGET_SEC = 15.0
+# Pause after a 429 that didn't say how long to wait
+OPENAI_DEFAULT_RETRY_AFTER_SEC = 10.0
+# Delay before requeued embeddings that hit a 5xx or connection error are tried again
+OPENAI_TRANSIENT_RETRY_AFTER_SEC = 30.0
+
+# Async embedding backfill: work items processed at once per worker (each holds
+# EMBEDDING_BACKFILL_BATCH_SIZE videos), the ceiling of its adaptive limit on embedding
+# requests in flight, and concurrent batched writes
+EMBEDDING_ASYNC_CONCURRENT_ITEMS = 50
+EMBEDDING_ASYNC_MAX_IN_FLIGHT = 200
+EMBEDDING_ASYNC_MAX_IN_FLIGHT_WRITES = 20
+
+# Videos fetched per trigger_video_embeddings invocation
+EMBEDDING_BACKFILL_BATCH_SIZE = 100
+
+# How embeddings are stored in the 'embedding' field: "float32" packs them into a
+# little-endian float32 blob (smallest, decodes without per-element Python floats),
+# "vector" uses Firestore's native Vector value (needed for find_nearest queries)
+EMBEDDING_STORAGE_FORMAT = "float32"
+
+# Counter shards under each user's embeddingProgress/current/shards. Status transitions
+# increment a random shard so concurrent updates don't contend on one doc; readers sum
+# the shards with an aggregation query.
+EMBEDDING_PROGRESS_SHARDS = 10
+
+# Point-in-time reads (read_time) are only allowed within the past hour; older progress
+# updates read current data instead
+EMBEDDING_PROGRESS_READ_TIME_MAX_AGE = timedelta(minutes=55)
+
+# retry_failed_embeddings embeds up to this many failed videos before returning;
+# larger retries return a job handle and run in process_embedding_retry_job
+EMBEDDING_RETRY_INLINE_MAX = 100
+
+# Retry markers older than this belong to a job that died before finishing (jobs run in
+# one 540s function); the sweep marks those videos failed again so they can be retried
+EMBEDDING_RETRY_MARKER_TTL = timedelta(minutes=30)
+
+# Embeddings cached by the hash of their input text: entries kept in memory per
+# instance, in front of the persistent /embeddingCache collection
+EMBEDDING_CONTENT_CACHE_SIZE = 2048
+
+# Semantic search: cached query embeddings, cached per-user embedding matrices (and
+# how long one is reused before the user's likes are reloaded), and result limits
+SEARCH_QUERY_CACHE_SIZE = 512
+SEARCH_INDEX_CACHE_SIZE = 32
+SEARCH_INDEX_TTL_SEC = 300
+SEARCH_DEFAULT_TOP_K = 20
+SEARCH_MAX_TOP_K = 100
+# Coarse-to-fine search: the prefix scan keeps this many candidates per requested
+# result, which are then rescored with the full embeddings
+SEARCH_RESCORE_FACTOR = 8
+
+# Smart Shelves clustering: range of shelf counts tried by automatic k selection,
+# mini-batch k-means settings, the sample used to score candidate k values, and how
+# many representative videos each shelf keeps
+SHELVES_MIN_K = 3
+SHELVES_MAX_K = 24
+SHELVES_CANDIDATE_KS = 6
+SHELVES_BATCH_SIZE = 1024
+SHELVES_MAX_ITER = 150
+SHELVES_SCORE_SAMPLE_SIZE = 5000
+SHELVES_REPRESENTATIVE_VIDEOS = 12
+# Lloyd iterations at full dimension refining the clusters found on the prefixes
+SHELVES_REFINE_ITER = 3
+
+# Per-user embedding matrix snapshots (.npy matrix + ID index). Stored in this Cloud
+# Storage bucket and opened memory-mapped from EMBEDDING_SNAPSHOT_CACHE_DIR. Deployed
+# functions without a bucket keep no snapshots (their /tmp is memory-backed); only the
+# emulator and local runs fall back to a local-disk store.
+EMBEDDING_SNAPSHOT_BUCKET = os.environ.get("EMBEDDING_SNAPSHOT_BUCKET")
+EMBEDDING_SNAPSHOT_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), "zensort-embedding-snapshots"
+)
+
+# OpenAI API key cache lifetime, and how long before expiry a background refresh starts
+OPENAI_API_KEY_TTL_SEC = 3600
+OPENAI_API_KEY_REFRESH_AHEAD_SEC = 300
+
+# How often the shared Firestore client is probed before being handed out
+FIRESTORE_HEALTH_CHECK_INTERVAL_SEC = 300
+
+# Chunked write engine: writes per committed batch (Firestore caps a batch at 500),
+# chunks committed in parallel, 500/50/5 ramp-up starting rate and per-chunk retries
+FIRESTORE_WRITE_CHUNK_SIZE = 400
+FIRESTORE_WRITE_MAX_IN_FLIGHT = 8
+FIRESTORE_WRITE_INITIAL_OPS_PER_SEC = 500
+FIRESTORE_WRITE_MAX_RETRIES = 5
+
+# Incremental syncs stop paging at the stored watermark; a full reconciliation
+# (which is what detects unlikes) runs at least this often
+SYNC_FULL_RECONCILIATION_INTERVAL = timedelta(days=7)
+
+# Number of liked-video pages the streaming sync processes concurrently
+# (existence check + videos.list lookup + staged write per page)
+SYNC_PIPELINE_MAX_IN_FLIGHT_PAGES = 4
+
+# videos.list batches fetched concurrently by fetch_video_details, and the
+# per-instance request rate kept under YouTube Data API per-second limits
+YOUTUBE_DETAIL_MAX_IN_FLIGHT = 4
+YOUTUBE_REQUESTS_PER_SECOND = 10
+
+# Multiplex videos.list calls into multipart batch HTTP requests (one round trip
+# for up to YOUTUBE_BATCH_HTTP_MAX_CALLS calls)
+YOUTUBE_USE_BATCH_HTTP = False
+YOUTUBE_BATCH_HTTP_MAX_CALLS = 10
+
+# Item fields read by _parse_liked_video_item and _parse_video_item. Requests are
+# projected to these (plus the paging fields) with the fields= parameter, so keep
+# them in step with the parsers.
+YOUTUBE_PLAYLIST_ITEM_FIELDS = (
+    "snippet/title",
+    "snippet/publishedAt",
+    "snippet/resourceId/videoId",
+)
+YOUTUBE_VIDEO_ITEM_FIELDS = (
+    "id",
+    "snippet/title",
+    "snippet/description",
+    "snippet/channelTitle",
+    "snippet/publishedAt",
+    "snippet/thumbnails/default/url",
+)
+
+# Embedding backfill queue, and how long one worker invocation keeps leasing items
+EMBEDDING_BACKFILL_QUEUE = "embedding-backfill"
+EMBEDDING_MIGRATION_QUEUE = "embedding-migration"
+EMBEDDING_RECOUNT_QUEUE = "embedding-progress-recount"
+EMBEDDING_BACKFILL_WORKER_BUDGET_SEC = 420
+
+# Work queues: how long a leased item stays invisible to other workers, how many
+# deliveries an item gets before it is dead-lettered, the redelivery backoff, and how
+# long finished items are kept before Firestore's TTL policy on expireAt deletes them.
+# A lease has to outlast the worker holding it: an item leased at the end of the
+# worker budget can run until the 540s function timeout.
+WORK_QUEUE_VISIBILITY_TIMEOUT_SEC = EMBEDDING_BACKFILL_WORKER_BUDGET_SEC + 540
+WORK_QUEUE_MAX_ATTEMPTS = 5
+WORK_QUEUE_RETRY_BACKOFF_SEC = 30
+WORK_QUEUE_FINISHED_TTL = timedelta(days=7)
 
 # For cost control, you can set the maximum number of containers that can be
 # running at the same time. This helps mitigate the impact of unexpected
@@ -37,7 +228,88 @@ EMBEDDING_DIMENSIONALITY = 1536
 set_global_options(max_instances=10)
 
 
-def _get_openai_api_key() -> str:
+def _fields_projection(item_fields: tuple[str, ...], *response_fields: str) -> str:
+    """
+    Build a YouTube Data API fields= projection, e.g. "etag,items(id,snippet/title)".
+    The response ETag is always kept so conditional requests keep working.
+    """
+    return ",".join(("etag", *response_fields, f"items({','.join(item_fields)})"))
+
+
+YOUTUBE_PLAYLIST_PAGE_PROJECTION = _fields_projection(
+    YOUTUBE_PLAYLIST_ITEM_FIELDS, "nextPageToken", "pageInfo/totalResults"
+)
+YOUTUBE_VIDEOS_PROJECTION = _fields_projection(YOUTUBE_VIDEO_ITEM_FIELDS)
+
+
+class _SecretCache:
+    """
+    Per-instance cache for a secret value.
+    The value is reused for `ttl_sec`. Once it is within `refresh_ahead_sec` of expiring,
+    callers keep getting the cached value while a single background thread refreshes it,
+    so only the very first call (or a call after a failed refresh expired) waits on the loader.
+    """
+
+    def __init__(self, loader, ttl_sec: float, refresh_ahead_sec: float):
+        self._loader = loader
+        self.ttl_sec = ttl_sec
+        self.refresh_ahead_sec = refresh_ahead_sec
+        self._value = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            now = time.monotonic()
+            if self._value is not None and now < self._expires_at:
+                if (
+                    now >= self._expires_at - self.refresh_ahead_sec
+                    and not self._refreshing
+                ):
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, daemon=True).start()
+                return self._value
+
+            # Missing or expired: load synchronously while holding the lock
+            self._store(self._loader())
+            return self._value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+            self._expires_at = 0.0
+
+    def _store(self, value: str) -> None:
+        self._value = value
+        self._expires_at = time.monotonic() + self.ttl_sec
+
+    def _refresh(self) -> None:
+        try:
+            value = self._loader()
+            with self._lock:
+                self._store(value)
+        except Exception as e:
+            logger.warning(f"Background secret refresh failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+_secret_manager_client = None
+_secret_manager_client_lock = threading.Lock()
+
+
+def _get_secret_manager_client() -> secretmanager.SecretManagerServiceClient:
+    """Return the instance-wide Secret Manager client, creating it on first use."""
+    global _secret_manager_client
+    with _secret_manager_client_lock:
+        if _secret_manager_client is None:
+            _secret_manager_client = secretmanager.SecretManagerServiceClient()
+        return _secret_manager_client
+
+
+def _fetch_openai_api_key() -> str:
     """
     Securely retrieve the OpenAI API key from Google Cloud Secret Manager.
     """
@@ -53,8 +325,7 @@ def _get_openai_api_key() -> str:
         if not project_id:
             raise ValueError("GCP_PROJECT environment variable is not set.")
 
-        # Create the Secret Manager client
-        client = secretmanager.SecretManagerServiceClient()
+        client = _get_secret_manager_client()
 
         # Build the resource name
         secret_id = "openai-api-key"
@@ -72,6 +343,903 @@ def _get_openai_api_key() -> str:
         raise ValueError(f"Failed to retrieve OpenAI API key: {str(e)}")
 
 
+_openai_api_key_cache = _SecretCache(
+    _fetch_openai_api_key,
+    ttl_sec=OPENAI_API_KEY_TTL_SEC,
+    refresh_ahead_sec=OPENAI_API_KEY_REFRESH_AHEAD_SEC,
+)
+
+
+def _get_openai_api_key() -> str:
+    """Return the OpenAI API key, served from the per-instance TTL cache."""
+    return _openai_api_key_cache.get()
+
+
+_openai_client = None
+_openai_client_key = None
+_openai_client_lock = threading.Lock()
+
+
+def _get_openai_client() -> OpenAI:
+    """
+    Return the instance-wide OpenAI client.
+    The client (and its pooled HTTP connections) is reused across invocations and only
+    rebuilt when the cached API key changes.
+    """
+    global _openai_client, _openai_client_key
+    api_key = _get_openai_api_key()
+    with _openai_client_lock:
+        if _openai_client is None or _openai_client_key != api_key:
+            _openai_client = OpenAI(api_key=api_key)
+            _openai_client_key = api_key
+        return _openai_client
+
+
+class FirestoreClientRegistry:
+    """
+    Process-wide registry for a single, lazily created Firestore client.
+    All functions on an instance share one client (and its gRPC channel); the client is
+    thread-safe, so it can serve concurrent requests. Every
+    FIRESTORE_HEALTH_CHECK_INTERVAL_SEC the client is probed with a cheap read and
+    recreated if the probe fails.
+    """
+
+    def __init__(
+        self, health_check_interval_sec: float = FIRESTORE_HEALTH_CHECK_INTERVAL_SEC
+    ):
+        self.health_check_interval_sec = health_check_interval_sec
+        self._client = None
+        self._last_health_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> firestore.Client:
+        with self._lock:
+            if self._client is None:
+                logger.info("Creating shared Firestore client")
+                self._client = firestore.Client()
+                self._last_health_check = time.monotonic()
+                return self._client
+
+            if (
+                time.monotonic() - self._last_health_check
+                < self.health_check_interval_sec
+            ):
+                return self._client
+            # Claim the check so concurrent callers keep using the current client meanwhile
+            self._last_health_check = time.monotonic()
+            client = self._client
+
+        if self.check_health(client):
+            return client
+        return self.get()
+
+    def check_health(self, client: firestore.Client) -> bool:
+        """Probe the client with a single document read; reset the registry on failure."""
+        try:
+            client.collection("_health").document("ping").get(timeout=10)
+            return True
+        except Exception as e:
+            logger.warning(
+                f"Firestore client health check failed, reconnecting: {type(e).__name__}: {str(e)}"
+            )
+            self.reset(client)
+            return False
+
+    def reset(self, client: firestore.Client | None = None) -> None:
+        """
+        Drop the shared client so the next get() creates a new one.
+        If `client` is given, only reset when it is still the registered client.
+        In-flight calls on the old client are left to finish on its own channel.
+        """
+        with self._lock:
+            if client is None or self._client is client:
+                self._client = None
+
+
+_firestore_registry = FirestoreClientRegistry()
+
+
+def _get_firestore_client() -> firestore.Client:
+    """Return the instance-wide shared Firestore client."""
+    return _firestore_registry.get()
+
+
+class _TokenBucket:
+    """
+    Thread-safe token bucket limiter.
+    Tokens refill continuously at `rate` per second up to `capacity`; acquire() blocks
+    until enough tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last_refill) * self.rate
+                )
+                self._last_refill = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_seconds = (tokens - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class _AimdLimit:
+    """
+    AIMD concurrency limit arithmetic, shared by the thread and asyncio limiters (which
+    add the waiting and locking). Each healthy response adds 1/limit (about one more
+    slot per full window of requests); a failure or a response slower than
+    latency_target_sec multiplies the limit by decrease_factor. Failures of requests
+    that started before the last decrease don't decrease it again, so a burst of
+    in-flight 429s counts once.
+    """
+
+    def __init__(
+        self,
+        initial: float,
+        min_limit: float,
+        max_limit: float,
+        latency_target_sec: float,
+        decrease_factor: float = 0.5,
+        clock=time.monotonic,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target_sec = latency_target_sec
+        self.decrease_factor = decrease_factor
+        self.clock = clock
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+
+    def _pause_remaining(self) -> float:
+        return self._paused_until - self.clock()
+
+    def _has_free_slot(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def _apply_success(self, started_at: float) -> None:
+        if self.clock() - started_at > self.latency_target_sec:
+            self._decrease(started_at)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _apply_failure(self, started_at: float, retry_after_sec: float | None) -> None:
+        self._decrease(started_at)
+        if retry_after_sec:
+            self._paused_until = max(self._paused_until, self.clock() + retry_after_sec)
+
+    def _decrease(self, started_at: float) -> None:
+        if started_at < self._last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self._last_decrease = self.clock()
+        logger.info(f"Reduced OpenAI concurrency limit to {self.limit:.1f}")
+
+
+class _AdaptiveConcurrencyLimiter(_AimdLimit):
+    """
+    Thread-safe AIMD concurrency limit. slot() blocks until fewer than `limit` requests
+    are in flight and any Retry-After pause has passed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Generator[float, None, None]:
+        """Hold one concurrency slot; yields the request's start time for record_*()."""
+        with self._condition:
+            while True:
+                pause = self._pause_remaining()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif not self._has_free_slot():
+                    self._condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+        try:
+            yield self.clock()
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record_success(self, started_at: float) -> None:
+        with self._condition:
+            self._apply_success(started_at)
+            self._condition.notify_all()
+
+    def record_failure(
+        self, started_at: float, retry_after_sec: float | None = None
+    ) -> None:
+        with self._condition:
+            self._apply_failure(started_at, retry_after_sec)
+
+
+class _AsyncAdaptiveConcurrencyLimiter(_AimdLimit):
+    """
+    The asyncio counterpart of _AdaptiveConcurrencyLimiter: `async with slot()` waits
+    (without blocking the event loop) until fewer than `limit` requests are in flight
+    and any Retry-After pause has passed. Use it from a single event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """Hold one concurrency slot; yields the request's start time for record_*()."""
+        async with self._condition:
+            while True:
+                pause = self._pause_remaining()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif not self._has_free_slot():
+                    await self._condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+        try:
+            yield self.clock()
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    async def record_success(self, started_at: float) -> None:
+        async with self._condition:
+            self._apply_success(started_at)
+            self._condition.notify_all()
+
+    async def record_failure(
+        self, started_at: float, retry_after_sec: float | None = None
+    ) -> None:
+        async with self._condition:
+            self._apply_failure(started_at, retry_after_sec)
+
+
+_openai_concurrency = _AdaptiveConcurrencyLimiter(
+    OPENAI_CONCURRENCY_INITIAL,
+    OPENAI_CONCURRENCY_MIN,
+    OPENAI_CONCURRENCY_MAX,
+    OPENAI_LATENCY_TARGET_SEC,
+)
+# The async backfill's limit, used on the backfill event loop only
+_openai_async_concurrency = _AsyncAdaptiveConcurrencyLimiter(
+    OPENAI_CONCURRENCY_INITIAL,
+    OPENAI_CONCURRENCY_MIN,
+    EMBEDDING_ASYNC_MAX_IN_FLIGHT,
+    OPENAI_LATENCY_TARGET_SEC,
+)
+
+
+# Errors worth retrying a chunk commit for; anything else fails the chunk immediately
+_TRANSIENT_FIRESTORE_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+)
+
+
+class FirestoreWriteError(Exception):
+    """Raised when one or more write chunks could not be committed after retries."""
+
+    def __init__(self, failed_chunks: int, total_chunks: int, errors: list[str]):
+        self.failed_chunks = failed_chunks
+        self.total_chunks = total_chunks
+        self.errors = errors
+        super().__init__(
+            f"{failed_chunks} of {total_chunks} write chunks failed: {errors[:3]}"
+        )
+
+
+class FirestoreWriteEngine:
+    """
+    Chunked, parallel batched-write engine with BulkWriter-style flow control.
+
+    Writes are queued with set()/update()/delete(); writes queued inside a group() block
+    always land in the same chunk, so they stay atomic with each other. commit() splits
+    the queue into chunks of at most `chunk_size` writes, commits up to `max_in_flight`
+    chunks in parallel under a 500/50/5 ramp-up throttle (start at 500 ops/s, +50% every
+    5 minutes), and retries each chunk on its own with exponential backoff on transient
+    errors. `progress_callback(completed_chunks, total_chunks, written_ops)` is called
+    after every chunk. After commit(), `commit_times` maps each written document
+    reference to the commit time of its chunk.
+    """
+
+    def __init__(
+        self,
+        db: firestore.Client,
+        chunk_size: int = FIRESTORE_WRITE_CHUNK_SIZE,
+        max_in_flight: int = FIRESTORE_WRITE_MAX_IN_FLIGHT,
+        initial_ops_per_sec: float = FIRESTORE_WRITE_INITIAL_OPS_PER_SEC,
+        max_retries: int = FIRESTORE_WRITE_MAX_RETRIES,
+        progress_callback=None,
+    ):
+        self.db = db
+        self.chunk_size = min(chunk_size, 500)
+        self.max_in_flight = max_in_flight
+        self.initial_ops_per_sec = initial_ops_per_sec
+        self.max_retries = max_retries
+        self.progress_callback = progress_callback
+        self.commit_times = {}
+        self._groups = []
+        self._open_group = None
+
+    def __len__(self) -> int:
+        queued = sum(len(group) for group in self._groups)
+        return queued + (len(self._open_group) if self._open_group else 0)
+
+    def set(self, ref, data: dict, merge: bool = False) -> None:
+        self._add(("set", ref, data, merge))
+
+    def update(self, ref, data: dict) -> None:
+        self._add(("update", ref, data, False))
+
+    def delete(self, ref) -> None:
+        self._add(("delete", ref, None, False))
+
+    @contextmanager
+    def group(self):
+        """Keep every write queued inside this block in the same chunk."""
+        self._open_group = []
+        try:
+            yield
+        finally:
+            group, self._open_group = self._open_group, None
+            if group:
+                if len(group) > self.chunk_size:
+                    raise ValueError(
+                        f"Write group of {len(group)} exceeds chunk size {self.chunk_size}"
+                    )
+                self._groups.append(group)
+
+    def _add(self, operation: tuple) -> None:
+        if self._open_group is not None:
+            self._open_group.append(operation)
+        else:
+            self._groups.append([operation])
+
+    def _build_chunks(self) -> list[list[tuple]]:
+        chunks = []
+        current_chunk = []
+        for group in self._groups:
+            if current_chunk and len(current_chunk) + len(group) > self.chunk_size:
+                chunks.append(current_chunk)
+                current_chunk = []
+            current_chunk.extend(group)
+        if current_chunk:
+            chunks.append(current_chunk)
+        return chunks
+
+    def _commit_chunk(
+        self, chunk: list[tuple], limiter: _TokenBucket, started_at: float
+    ) -> None:
+        # 500/50/5 rule: raise the allowed rate by 50% for every 5 minutes of writing
+        ramp_steps = int((time.monotonic() - started_at) // 300)
+        limiter.rate = self.initial_ops_per_sec * (1.5**ramp_steps)
+        limiter.acquire(len(chunk))
+
+        for attempt in range(self.max_retries + 1):
+            batch = self.db.batch()
+            for method, ref, data, merge in chunk:
+                if method == "set":
+                    batch.set(ref, data, merge=merge)
+                elif method == "update":
+                    batch.update(ref, data)
+                else:
+                    batch.delete(ref)
+            try:
+                batch.commit()
+                commit_time = getattr(batch, "commit_time", None)
+                for _, ref, _, _ in chunk:
+                    self.commit_times[ref] = commit_time
+                return
+            except _TRANSIENT_FIRESTORE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                backoff_seconds = min(2**attempt * 0.5, 30)
+                logger.warning(
+                    f"Transient error committing chunk of {len(chunk)} writes "
+                    f"(attempt {attempt + 1}), retrying in {backoff_seconds}s: {str(e)}"
+                )
+                time.sleep(backoff_seconds)
+
+    def commit(self) -> int:
+        """
+        Commit every queued write. Returns the number of writes committed.
+        Raises FirestoreWriteError if any chunk still fails after its retries; the other
+        chunks are committed regardless.
+        """
+        chunks = self._build_chunks()
+        self._groups = []
+        if not chunks:
+            return 0
+
+        total_chunks = len(chunks)
+        limiter = _TokenBucket(
+            self.initial_ops_per_sec,
+            capacity=max(self.initial_ops_per_sec, self.chunk_size),
+        )
+        started_at = time.monotonic()
+        progress_lock = threading.Lock()
+        completed_chunks = 0
+        written_ops = 0
+        errors = []
+
+        def run_chunk(chunk: list[tuple]) -> None:
+            nonlocal completed_chunks, written_ops
+            try:
+                self._commit_chunk(chunk, limiter, started_at)
+            except Exception as e:
+                logger.error(
+                    f"Failed to commit chunk of {len(chunk)} writes: {type(e).__name__}: {str(e)}"
+                )
+                with progress_lock:
+                    errors.append(f"{type(e).__name__}: {str(e)}")
+                return
+
+            with progress_lock:
+                completed_chunks += 1
+                written_ops += len(chunk)
+                if self.progress_callback:
+                    try:
+                        self.progress_callback(
+                            completed_chunks, total_chunks, written_ops
+                        )
+                    except Exception as callback_error:
+                        logger.warning(
+                            f"Write progress callback failed: {callback_error}"
+                        )
+
+        logger.info(
+            f"Committing {sum(len(chunk) for chunk in chunks)} writes in {total_chunks} chunks "
+            f"with up to {self.max_in_flight} in flight"
+        )
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(self.max_in_flight, total_chunks))
+        ) as executor:
+            list(executor.map(run_chunk, chunks))
+
+        if errors:
+            raise FirestoreWriteError(len(errors), total_chunks, errors)
+        return written_ops
+
+
+@dataclass
+class WorkItem:
+    item_id: str
+    payload: dict
+    attempts: int
+    lease_id: str
+
+
+class WorkItemDeferred(Exception):
+    """
+    Raised by a work queue handler to put its item back for delay_sec without using up
+    one of its attempts (e.g. when an upstream API is rate limiting).
+    """
+
+    def __init__(self, delay_sec: float, reason: str):
+        self.delay_sec = delay_sec
+        super().__init__(reason)
+
+
+class InMemoryWorkQueue:
+    """
+    In-process work queue with the same lease/complete/fail semantics as
+    FirestoreWorkQueue, for tests and offline runs. `clock` returns seconds.
+    """
+
+    def __init__(
+        self,
+        visibility_timeout_sec: float = WORK_QUEUE_VISIBILITY_TIMEOUT_SEC,
+        max_attempts: int = WORK_QUEUE_MAX_ATTEMPTS,
+        retry_backoff_sec: float = WORK_QUEUE_RETRY_BACKOFF_SEC,
+        clock=time.monotonic,
+    ):
+        self.visibility_timeout_sec = visibility_timeout_sec
+        self.max_attempts = max_attempts
+        self.retry_backoff_sec = retry_backoff_sec
+        self.clock = clock
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, payloads: dict[str, dict], delay_sec: float = 0) -> int:
+        """
+        Add items keyed by item ID, visible after delay_sec. Done or dead items with the
+        same ID are re-armed with the new payload; pending items are left alone.
+        """
+        added = 0
+        with self._lock:
+            for item_id, payload in payloads.items():
+                item = self._items.get(item_id)
+                if item is not None and item["status"] == "pending":
+                    continue
+                self._items[item_id] = {
+                    "status": "pending",
+                    "payload": payload,
+                    "attempts": 0,
+                    "visibleAt": self.clock() + delay_sec,
+                    "leaseId": None,
+                }
+                added += 1
+        return added
+
+    def lease(self, max_items: int = 1) -> list[WorkItem]:
+        """Lease up to max_items visible items, hiding them for the visibility timeout."""
+        leased = []
+        with self._lock:
+            now = self.clock()
+            visible = sorted(
+                (
+                    (item["visibleAt"], item_id)
+                    for item_id, item in self._items.items()
+                    if item["status"] == "pending" and item["visibleAt"] <= now
+                )
+            )
+            for _, item_id in visible[:max_items]:
+                item = self._items[item_id]
+                item["attempts"] += 1
+                item["visibleAt"] = now + self.visibility_timeout_sec
+                item["leaseId"] = f"{item_id}:{item['attempts']}"
+                leased.append(
+                    WorkItem(
+                        item_id, item["payload"], item["attempts"], item["leaseId"]
+                    )
+                )
+        return leased
+
+    def complete(self, work_item: WorkItem) -> bool:
+        """Mark a leased item done. Returns False if the lease was lost to another worker."""
+        with self._lock:
+            item = self._items.get(work_item.item_id)
+            if not item or item["leaseId"] != work_item.lease_id:
+                return False
+            item["status"] = "done"
+            return True
+
+    def fail(self, work_item: WorkItem, error: str) -> bool:
+        """
+        Release a leased item for redelivery after the retry backoff, or dead-letter it
+        once it has used max_attempts. Returns False if the lease was lost.
+        """
+        with self._lock:
+            item = self._items.get(work_item.item_id)
+            if not item or item["leaseId"] != work_item.lease_id:
+                return False
+            item["error"] = error
+            if item["attempts"] >= self.max_attempts:
+                item["status"] = "dead"
+            else:
+                item["visibleAt"] = self.clock() + self.retry_backoff_sec
+            return True
+
+    def defer(self, work_item: WorkItem, delay_sec: float) -> bool:
+        """
+        Release a leased item for redelivery after delay_sec, giving back the attempt it
+        used. Returns False if the lease was lost.
+        """
+        with self._lock:
+            item = self._items.get(work_item.item_id)
+            if not item or item["leaseId"] != work_item.lease_id:
+                return False
+            item["attempts"] -= 1
+            item["visibleAt"] = self.clock() + delay_sec
+            return True
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            counts = {"pending": 0, "done": 0, "dead": 0}
+            for item in self._items.values():
+                counts[item["status"]] += 1
+            return counts
+
+
+class FirestoreWorkQueue:
+    """
+    Durable work queue stored under /workQueues/{name}/items. Items stay "pending" until
+    completed or dead-lettered; a lease hides an item by moving its visibleAt forward, so
+    an item whose worker dies becomes visible again once the visibility timeout passes.
+    Leases are claimed in transactions, so any number of workers can lease in parallel.
+    The queue document keeps total/done/dead counts for completion tracking. Finished
+    items get an expireAt, and the TTL policy on it deletes them after
+    WORK_QUEUE_FINISHED_TTL.
+    """
+
+    def __init__(
+        self,
+        db: firestore.Client,
+        name: str,
+        visibility_timeout_sec: float = WORK_QUEUE_VISIBILITY_TIMEOUT_SEC,
+        max_attempts: int = WORK_QUEUE_MAX_ATTEMPTS,
+        retry_backoff_sec: float = WORK_QUEUE_RETRY_BACKOFF_SEC,
+    ):
+        self.db = db
+        self.name = name
+        self.visibility_timeout_sec = visibility_timeout_sec
+        self.max_attempts = max_attempts
+        self.retry_backoff_sec = retry_backoff_sec
+        self.queue_ref = db.collection("workQueues").document(name)
+        self.items_ref = self.queue_ref.collection("items")
+
+    def enqueue(self, payloads: dict[str, dict], delay_sec: float = 0) -> int:
+        """
+        Add items keyed by item ID, visible after delay_sec. Done or dead items with the
+        same ID are re-armed with the new payload; pending items are left alone.
+        """
+        if not payloads:
+            return 0
+        item_refs = [self.items_ref.document(item_id) for item_id in payloads]
+        existing_statuses = {
+            doc.id: doc.get("status")
+            for doc in self.db.get_all(item_refs, field_paths=["status"])
+            if doc.exists
+        }
+
+        now = datetime.now(timezone.utc)
+        writer = FirestoreWriteEngine(self.db)
+        added = 0
+        # Re-armed items leave the done/dead counts instead of adding to the total
+        rearmed = {"done": 0, "dead": 0}
+        for item_id, payload in payloads.items():
+            status = existing_statuses.get(item_id)
+            if status == "pending":
+                continue
+            if status in rearmed:
+                rearmed[status] += 1
+            writer.set(
+                self.items_ref.document(item_id),
+                {
+                    "status": "pending",
+                    "payload": payload,
+                    "attempts": 0,
+                    "visibleAt": now + timedelta(seconds=delay_sec),
+                    "leaseId": None,
+                    "createdAt": now,
+                },
+            )
+            added += 1
+        writer.commit()
+        counter_deltas = {
+            "total": added - sum(rearmed.values()),
+            **{status: -count for status, count in rearmed.items()},
+        }
+        counter_deltas = {
+            field: firestore.Increment(delta)
+            for field, delta in counter_deltas.items()
+            if delta
+        }
+        if counter_deltas:
+            self.queue_ref.set(counter_deltas, merge=True)
+        return added
+
+    def lease(self, max_items: int = 1) -> list[WorkItem]:
+        """Lease up to max_items visible items, hiding them for the visibility timeout."""
+        now = datetime.now(timezone.utc)
+        candidates = (
+            self.items_ref.where("status", "==", "pending")
+            .where("visibleAt", "<=", now)
+            .order_by("visibleAt")
+            .limit(max_items)
+            .get()
+        )
+
+        leased = []
+        for candidate in candidates:
+            work_item = self._claim(candidate.reference)
+            if work_item:
+                leased.append(work_item)
+        return leased
+
+    def _claim(self, item_ref: firestore.DocumentReference) -> WorkItem | None:
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = item_ref.get(transaction=transaction)
+            now = datetime.now(timezone.utc)
+            if (
+                not snapshot.exists
+                or snapshot.get("status") != "pending"
+                or snapshot.get("visibleAt") > now
+            ):
+                # Another worker got there first
+                return None
+            attempts = snapshot.get("attempts") + 1
+            lease_id = f"{snapshot.id}:{attempts}:{time.time_ns()}"
+            transaction.update(
+                item_ref,
+                {
+                    "attempts": attempts,
+                    "leaseId": lease_id,
+                    "visibleAt": now + timedelta(seconds=self.visibility_timeout_sec),
+                    "leasedAt": now,
+                },
+            )
+            return WorkItem(snapshot.id, snapshot.get("payload"), attempts, lease_id)
+
+        return claim(self.db.transaction())
+
+    def _finish(self, work_item: WorkItem, fields_for) -> bool:
+        item_ref = self.items_ref.document(work_item.item_id)
+
+        @firestore.transactional
+        def finish(transaction):
+            snapshot = item_ref.get(transaction=transaction)
+            if not snapshot.exists or snapshot.get("leaseId") != work_item.lease_id:
+                return None
+            fields = fields_for(snapshot)
+            transaction.update(item_ref, fields)
+            return fields["status"]
+
+        status = finish(self.db.transaction())
+        if status in ("done", "dead"):
+            self.queue_ref.set({status: firestore.Increment(1)}, merge=True)
+        return status is not None
+
+    def complete(self, work_item: WorkItem) -> bool:
+        """Mark a leased item done. Returns False if the lease was lost to another worker."""
+        return self._finish(
+            work_item,
+            lambda snapshot: {
+                "status": "done",
+                "completedAt": datetime.now(timezone.utc),
+                "expireAt": datetime.now(timezone.utc) + WORK_QUEUE_FINISHED_TTL,
+            },
+        )
+
+    def fail(self, work_item: WorkItem, error: str) -> bool:
+        """
+        Release a leased item for redelivery after the retry backoff, or dead-letter it
+        once it has used max_attempts. Returns False if the lease was lost.
+        """
+
+        def fields_for(snapshot):
+            if snapshot.get("attempts") >= self.max_attempts:
+                return {
+                    "status": "dead",
+                    "error": error,
+                    "expireAt": datetime.now(timezone.utc) + WORK_QUEUE_FINISHED_TTL,
+                }
+            return {
+                "status": "pending",
+                "error": error,
+                "visibleAt": datetime.now(timezone.utc)
+                + timedelta(seconds=self.retry_backoff_sec),
+            }
+
+        return self._finish(work_item, fields_for)
+
+    def defer(self, work_item: WorkItem, delay_sec: float) -> bool:
+        """
+        Release a leased item for redelivery after delay_sec, giving back the attempt it
+        used. Returns False if the lease was lost.
+        """
+        return self._finish(
+            work_item,
+            lambda snapshot: {
+                "status": "pending",
+                "attempts": snapshot.get("attempts") - 1,
+                "visibleAt": datetime.now(timezone.utc) + timedelta(seconds=delay_sec),
+            },
+        )
+
+    def stats(self) -> dict[str, int]:
+        queue_data = self.queue_ref.get().to_dict() or {}
+        done = queue_data.get("done", 0)
+        dead = queue_data.get("dead", 0)
+        return {
+            "pending": queue_data.get("total", 0) - done - dead,
+            "done": done,
+            "dead": dead,
+        }
+
+
+def _settle_work_item(
+    queue: InMemoryWorkQueue | FirestoreWorkQueue,
+    work_item: WorkItem,
+    error: Exception | None,
+    counts: dict[str, int],
+) -> None:
+    """Complete, fail or defer a leased item according to its handler's outcome."""
+    if isinstance(error, WorkItemDeferred):
+        logger.info(
+            f"Work item {work_item.item_id} deferred for {error.delay_sec:.0f}s: {error}"
+        )
+        queue.defer(work_item, error.delay_sec)
+        counts["deferred"] += 1
+    elif error is not None:
+        logger.error(
+            f"Work item {work_item.item_id} failed on attempt {work_item.attempts}: {error}"
+        )
+        queue.fail(work_item, str(error))
+        counts["failed"] += 1
+    elif queue.complete(work_item):
+        counts["completed"] += 1
+
+
+def drain_work_queue(
+    queue: InMemoryWorkQueue | FirestoreWorkQueue,
+    handler,
+    budget_sec: float,
+    lease_size: int = 1,
+) -> dict[str, int]:
+    """
+    Worker loop: lease items and run handler(payload) on each until the queue has no
+    visible items or the time budget is spent. Items whose handler raises are failed
+    (retried or dead-lettered by the queue), except for WorkItemDeferred, which puts the
+    item back without using an attempt. Returns completed/failed/deferred counts.
+    """
+    deadline = time.monotonic() + budget_sec
+    counts = {"completed": 0, "failed": 0, "deferred": 0}
+    while time.monotonic() < deadline:
+        work_items = queue.lease(lease_size)
+        if not work_items:
+            break
+        for work_item in work_items:
+            error = None
+            try:
+                handler(work_item.payload)
+            except Exception as e:
+                error = e
+            _settle_work_item(queue, work_item, error, counts)
+    return counts
+
+
+async def drain_work_queue_async(
+    queue: InMemoryWorkQueue | FirestoreWorkQueue,
+    handler,
+    budget_sec: float,
+    concurrency: int,
+) -> dict[str, int]:
+    """
+    Asyncio worker loop: keeps up to `concurrency` leased items running the coroutine
+    handler(payload) at once, leasing more as they finish, until the time budget is
+    spent or the queue has no visible items and nothing is running (items can come due
+    while others run, so an empty lease doesn't stop leasing); items already running
+    are awaited.
+    Outcomes are settled as in drain_work_queue. The queue's blocking calls run in
+    worker threads.
+    """
+    deadline = time.monotonic() + budget_sec
+    counts = {"completed": 0, "failed": 0, "deferred": 0}
+    running = {}
+    while True:
+        if time.monotonic() < deadline and len(running) < concurrency:
+            work_items = await asyncio.to_thread(
+                queue.lease, concurrency - len(running)
+            )
+            for work_item in work_items:
+                running[asyncio.create_task(handler(work_item.payload))] = work_item
+        if not running:
+            break
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            await asyncio.to_thread(
+                _settle_work_item, queue, running.pop(task), task.exception(), counts
+            )
+    return counts
+
+
 initialize_app()
 
 
@@ -151,7 +1319,7 @@ def add_to_waitlist(req: https_fn.CallableRequest) -> dict:
 
     try:
         # 2. Check if the email already exists in the 'waitlist' collection
-        db = firestore.Client()
+        db = _get_firestore_client()
         waitlist_collection = db.collection("waitlist")
         existing_entries = (
             waitlist_collection.where("email", "==", email).limit(1).get()
@@ -196,6 +1364,63 @@ class LikedVideoRelation:
     syncedAt: datetime
 
 
+class YouTubeServiceFactory:
+    """
+    Per-instance pool of YouTube Data API services.
+    The bundled static discovery document is parsed once, and each service keeps its
+    Credentials and connection-pooled httplib2 transport between calls; only the access
+    token is swapped in when a service is leased. googleapiclient services are not
+    thread-safe, so a leased service is used by one thread at a time.
+    """
+
+    def __init__(self, max_idle_services: int = 16):
+        self.max_idle_services = max_idle_services
+        self._discovery_document = None
+        self._idle_services = []
+        self._lock = threading.Lock()
+
+    def _get_discovery_document(self) -> dict:
+        with self._lock:
+            if self._discovery_document is None:
+                self._discovery_document = json.loads(get_static_doc("youtube", "v3"))
+            return self._discovery_document
+
+    def _build_service(self, access_token: str):
+        credentials = Credentials(
+            token=access_token,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id="unused",
+            client_secret="unused",
+            scopes=["https://www.googleapis.com/auth/youtube.readonly"],
+        )
+        http = AuthorizedHttp(credentials, http=httplib2.Http())
+        service = build_from_document(self._get_discovery_document(), http=http)
+        return service, credentials
+
+    @contextmanager
+    def lease(self, access_token: str) -> Iterator:
+        """Lease a YouTube service authorized with the given access token."""
+        with self._lock:
+            pooled = self._idle_services.pop() if self._idle_services else None
+
+        if pooled is None:
+            pooled = self._build_service(access_token)
+        service, credentials = pooled
+        credentials.token = access_token
+
+        try:
+            yield service
+        finally:
+            # Don't leave a user's token sitting on an idle service
+            credentials.token = None
+            with self._lock:
+                if len(self._idle_services) < self.max_idle_services:
+                    self._idle_services.append(pooled)
+
+
+_youtube_service_factory = YouTubeServiceFactory()
+
+
 @https_fn.on_call()
 def get_liked_videos_total(req: https_fn.CallableRequest) -> dict:
     """
@@ -212,22 +1437,16 @@ def get_liked_videos_total(req: https_fn.CallableRequest) -> dict:
         )
 
     try:
-        # Create OAuth2 credentials from the access token
-        credentials = Credentials(
-            token=access_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id="unused",
-            client_secret="unused",
-            scopes=["https://www.googleapis.com/auth/youtube.readonly"],
-        )
-
-        # Build the YouTube service
-        youtube = build("youtube", "v3", credentials=credentials)
-
-        # Use playlistItems.list with the special "Liked Videos" playlist ID 'LL'
-        # to get accurate total count including private/deleted videos
-        request = youtube.playlistItems().list(playlistId="LL", part="id", maxResults=1)
-        response = request.execute()
+        with _youtube_service_factory.lease(access_token) as youtube:
+            # Use playlistItems.list with the special "Liked Videos" playlist ID 'LL'
+            # to get accurate total count including private/deleted videos
+            request = youtube.playlistItems().list(
+                playlistId="LL",
+                part="id",
+                maxResults=1,
+                fields="pageInfo/totalResults",
+            )
+            response = request.execute()
 
         return {"total": response["pageInfo"]["totalResults"]}
 
@@ -251,109 +1470,235 @@ def get_liked_videos_total(req: https_fn.CallableRequest) -> dict:
         )
 
 
-def fetch_liked_video_items(access_token: str) -> list[dict]:
+def _youtube_auth_error(e: HttpError) -> https_fn.HttpsError | None:
     """
-    Fetch all items from the user's special "Liked Videos" playlist using the correct API endpoint.
-    This function uses the playlistItems.list endpoint with playlistId 'LL' to get ALL liked videos
-    (including private, deleted, and legacy videos) with their correct likedAt timestamps.
+    Map 401/403 YouTube API errors onto the HttpsError codes returned to the client.
+    Returns None for any other status so callers can apply their own handling.
+    """
+    if e.resp.status == 401:
+        return https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
+            message="Invalid or expired YouTube access token.",
+        )
+    if e.resp.status == 403:
+        error_content = json.loads(e.content) if e.content else {}
+        error_info = error_content.get("error", {})
+        return https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.PERMISSION_DENIED,
+            message=f"YouTube API access denied: {error_info.get('message', 'Permission denied')}",
+        )
+    return None
 
-    Returns a list of dictionaries with 'videoId', 'likedAt', and 'title' keys.
-    The title field contains the actual video title or status labels like "Private video", "Deleted video".
+
+class YouTubeEtagCache:
+    """
+    Per-user cache of liked-playlist pages keyed by page token, stored with their ETags
+    in /users/{userId}/youtubeEtags. Each entry is read the first time its page is
+    requested, and the request is sent with If-None-Match; a 304 Not Modified reuses the
+    cached response instead of downloading it again.
+    New or changed responses are kept in memory and written back by flush().
+    Safe to share between the sync's worker threads.
     """
-    try:
-        logger.info("=== Starting fetch_liked_video_items ===")
 
-        # Create OAuth2 credentials from the access token
-        credentials = Credentials(
-            token=access_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id="unused",
-            client_secret="unused",
-            scopes=["https://www.googleapis.com/auth/youtube.readonly"],
+    def __init__(self, db: firestore.Client, user_id: str):
+        self.db = db
+        self.collection = (
+            db.collection("users").document(user_id).collection("youtubeEtags")
+        )
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._loaded_keys = set()
+        self._dirty_keys = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def playlist_page_key(page_token: str | None) -> str:
+        return f"playlist_{page_token or 'first'}"
+
+    def load(self, key: str) -> None:
+        """Read the cached entry for `key`, unless it was already read."""
+        with self._lock:
+            if key in self._loaded_keys:
+                return
+        doc = self.collection.document(key).get()
+        with self._lock:
+            if doc.exists:
+                self._entries.setdefault(key, doc.to_dict())
+            self._loaded_keys.add(key)
+
+    def prepare(self, request, key: str) -> None:
+        """Make the request conditional if a cached response exists for `key`."""
+        self.load(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry.get("etag"):
+            request.headers["If-None-Match"] = entry["etag"]
+
+    def resolve(
+        self, key: str, kind: str, response: dict | None, error: Exception | None
+    ) -> dict:
+        """
+        Turn a request outcome into a response: 304 errors return the cached response,
+        fresh responses are cached, and any other error is re-raised.
+        """
+        if error is not None:
+            if isinstance(error, HttpError) and error.resp.status == 304:
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        self.hits += 1
+                        return entry["payload"]
+            raise error
+
+        with self._lock:
+            self.misses += 1
+            if response.get("etag"):
+                self._entries[key] = {
+                    "kind": kind,
+                    "etag": response["etag"],
+                    "payload": response,
+                    "updatedAt": datetime.now(timezone.utc),
+                }
+                self._dirty_keys.add(key)
+        return response
+
+    def execute(self, request, key: str, kind: str) -> dict:
+        """Execute a request conditionally against the cached ETag for `key`."""
+        self.prepare(request, key)
+        try:
+            response = request.execute()
+        except HttpError as e:
+            return self.resolve(key, kind, None, e)
+        return self.resolve(key, kind, response, None)
+
+    def flush(self) -> None:
+        """Write new or changed cache entries back to Firestore."""
+        with self._lock:
+            dirty_entries = {key: self._entries[key] for key in self._dirty_keys}
+            self._dirty_keys = set()
+        if not dirty_entries:
+            return
+
+        writer = FirestoreWriteEngine(self.db)
+        for key, entry in dirty_entries.items():
+            writer.set(self.collection.document(key), entry)
+        try:
+            writer.commit()
+        except FirestoreWriteError as e:
+            # The cache is an optimization; a failed write only costs a full download next sync
+            logger.warning(f"ETag cache: failed to persist entries: {e}")
+            return
+        logger.info(
+            f"ETag cache: {self.hits} not-modified hits, {self.misses} full responses, "
+            f"{len(dirty_entries)} entries written"
         )
 
-        # Build the YouTube service
-        youtube = build("youtube", "v3", credentials=credentials)
 
-        video_items = []
-        next_page_token = None
-        page_count = 0
+@dataclass
+class LikedVideoPage:
+    items: list[dict]
+    total_results: int
+    next_page_token: str | None = None
 
-        while True:
-            page_count += 1
-            logger.info(f"Fetching page {page_count} of liked video items")
 
-            # Use playlistItems.list with the special "Liked Videos" playlist ID 'LL'
-            request = youtube.playlistItems().list(
-                playlistId="LL",  # Special playlist ID for "Liked Videos"
-                part="snippet",
-                maxResults=50,
-                pageToken=next_page_token,
-            )
+def _parse_liked_video_item(item: dict) -> dict | None:
+    """
+    Convert a playlistItems.list item into a liked-item dict with 'videoId', 'likedAt' and 'title'.
+    Returns None for items without a video ID.
+    """
+    snippet = item.get("snippet", {})
+    video_id = snippet.get("resourceId", {}).get("videoId")
 
-            response = request.execute()
+    # YouTube API provides the actual title here, including "Private video", "Deleted video", etc.
+    title = snippet.get("title", "")
 
-            # Extract video items with videoId, likedAt timestamp, and title
-            for item in response.get("items", []):
-                snippet = item.get("snippet", {})
-                video_id = snippet.get("resourceId", {}).get("videoId")
+    # The likedAt timestamp is the snippet.publishedAt from the playlist item
+    liked_at_str = snippet.get("publishedAt", "")
+    try:
+        liked_at = datetime.fromisoformat(liked_at_str.replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning(
+            f"Invalid likedAt timestamp for video {video_id}: {liked_at_str}"
+        )
+        liked_at = datetime.now(timezone.utc)
 
-                # YouTube API provides the actual title here, including "Private video", "Deleted video", etc.
-                title = snippet.get("title", "")
+    if not video_id:
+        return None
+    return {"videoId": video_id, "likedAt": liked_at, "title": title}
 
-                # The likedAt timestamp is the snippet.publishedAt from the playlist item
-                liked_at_str = snippet.get("publishedAt", "")
-                try:
-                    liked_at = datetime.fromisoformat(
-                        liked_at_str.replace("Z", "+00:00")
-                    )
-                except ValueError:
-                    logger.warning(
-                        f"Invalid likedAt timestamp for video {video_id}: {liked_at_str}"
-                    )
-                    liked_at = datetime.now(timezone.utc)
 
-                if video_id:
-                    video_items.append(
-                        {"videoId": video_id, "likedAt": liked_at, "title": title}
+def iter_liked_video_pages(
+    access_token: str, etag_cache: YouTubeEtagCache | None = None
+) -> Generator[LikedVideoPage, None, None]:
+    """
+    Page through the user's special "Liked Videos" playlist, yielding each page as soon as it arrives.
+    Used by fetch_liked_video_items and by the streaming sync pipeline so that downstream stages
+    can start work on a page while the next one is still being fetched.
+    With an etag_cache, pages are requested with If-None-Match and unchanged pages are
+    served from the cache.
+    """
+    try:
+        with _youtube_service_factory.lease(access_token) as youtube:
+            next_page_token = None
+            page_count = 0
+
+            while True:
+                page_count += 1
+                logger.info(f"Fetching page {page_count} of liked video items")
+
+                # Use playlistItems.list with the special "Liked Videos" playlist ID 'LL'
+                request = youtube.playlistItems().list(
+                    playlistId="LL",  # Special playlist ID for "Liked Videos"
+                    part="snippet",
+                    maxResults=50,
+                    pageToken=next_page_token,
+                    fields=YOUTUBE_PLAYLIST_PAGE_PROJECTION,
+                )
+
+                if etag_cache:
+                    response = etag_cache.execute(
+                        request,
+                        YouTubeEtagCache.playlist_page_key(next_page_token),
+                        "playlistPage",
                     )
+                else:
+                    response = request.execute()
 
-            logger.info(
-                f"Page {page_count}: Retrieved {len(response.get('items', []))} video items"
-            )
+                # Extract video items with videoId, likedAt timestamp, and title
+                page_items = []
+                for item in response.get("items", []):
+                    video_item = _parse_liked_video_item(item)
+                    if video_item:
+                        page_items.append(video_item)
 
-            # Check for next page
-            next_page_token = response.get("nextPageToken")
-            if not next_page_token:
                 logger.info(
-                    f"Completed fetching all video items. Total: {len(video_items)}"
+                    f"Page {page_count}: Retrieved {len(response.get('items', []))} video items"
+                )
+
+                next_page_token = response.get("nextPageToken")
+                yield LikedVideoPage(
+                    items=page_items,
+                    total_results=response.get("pageInfo", {}).get("totalResults", 0),
+                    next_page_token=next_page_token,
                 )
-                break
 
-        return video_items
+                # Check for next page
+                if not next_page_token:
+                    break
 
     except HttpError as e:
         logger.error(
             f"YouTube API HttpError: {e.resp.status if hasattr(e, 'resp') else 'unknown'}"
         )
 
-        if e.resp.status == 401:
-            raise https_fn.HttpsError(
-                code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
-                message="Invalid or expired YouTube access token.",
-            )
-        elif e.resp.status == 403:
-            error_content = json.loads(e.content) if e.content else {}
-            error_info = error_content.get("error", {})
-            raise https_fn.HttpsError(
-                code=https_fn.FunctionsErrorCode.PERMISSION_DENIED,
-                message=f"YouTube API access denied: {error_info.get('message', 'Permission denied')}",
-            )
-        else:
-            raise https_fn.HttpsError(
-                code=https_fn.FunctionsErrorCode.INTERNAL,
-                message=f"YouTube API error: HTTP {e.resp.status}",
-            )
+        auth_error = _youtube_auth_error(e)
+        if auth_error:
+            raise auth_error
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INTERNAL,
+            message=f"YouTube API error: HTTP {e.resp.status}",
+        )
     except Exception as e:
         logger.error(
             f"Unexpected error in fetch_liked_video_items: {type(e).__name__}: {str(e)}"
@@ -364,118 +1709,256 @@ def fetch_liked_video_items(access_token: str) -> list[dict]:
         )
 
 
-def fetch_video_details(access_token: str, video_ids: list[str]) -> list[Video]:
+def fetch_liked_video_items(access_token: str) -> list[dict]:
     """
-    Fetch detailed metadata for specified video IDs from YouTube API.
-    Implements proper batching to handle more than 50 videos by making multiple
-    paginated calls to the videos.list endpoint.
-    Returns a list of Video objects with full metadata.
+    Fetch all items from the user's special "Liked Videos" playlist using the correct API endpoint.
+    This function uses the playlistItems.list endpoint with playlistId 'LL' to get ALL liked videos
+    (including private, deleted, and legacy videos) with their correct likedAt timestamps.
+
+    Returns a list of dictionaries with 'videoId', 'likedAt', and 'title' keys.
+    The title field contains the actual video title or status labels like "Private video", "Deleted video".
     """
-    if not video_ids:
-        return []
+    logger.info("=== Starting fetch_liked_video_items ===")
 
-    try:
-        logger.info(f"=== Starting fetch_video_details for {len(video_ids)} videos ===")
+    video_items = []
+    for page in iter_liked_video_pages(access_token):
+        video_items.extend(page.items)
 
-        credentials = Credentials(
-            token=access_token,
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id="unused",
-            client_secret="unused",
-            scopes=["https://www.googleapis.com/auth/youtube.readonly"],
+    logger.info(f"Completed fetching all video items. Total: {len(video_items)}")
+    return video_items
+
+
+# Shared by all requests on this instance so concurrent syncs stay under YouTube's per-second limits
+_youtube_rate_limiter = _TokenBucket(YOUTUBE_REQUESTS_PER_SECOND)
+
+
+def _parse_video_item(item: dict) -> Video:
+    """Convert a videos.list item into a Video object."""
+    snippet = item.get("snippet", {})
+
+    # Parse publishedAt timestamp safely
+    published_at_str = snippet.get("publishedAt", "")
+    try:
+        published_at = datetime.fromisoformat(published_at_str.replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning(
+            f"Invalid publishedAt format for video {item['id']}: {published_at_str}"
         )
+        published_at = datetime.now(timezone.utc)
+
+    return Video(
+        videoId=item["id"],
+        title=snippet.get("title", ""),
+        description=snippet.get("description", ""),
+        thumbnailUrl=snippet.get("thumbnails", {}).get("default", {}).get("url", ""),
+        channelTitle=snippet.get("channelTitle", ""),
+        publishedAt=published_at,
+        platform="YouTube",
+        addedToZensortAt=datetime.now(timezone.utc),
+    )
 
-        youtube = build("youtube", "v3", credentials=credentials)
 
-        all_videos = []  # Master list to aggregate all results
-        batch_size = 50  # YouTube API limit for videos.list endpoint
+def _fetch_video_details_batch(
+    youtube,
+    batch_ids: list[str],
+    batch_number: int,
+    total_batches: int,
+) -> list[Video]:
+    """
+    Fetch one videos.list batch (at most 50 IDs).
+    Raises UNAUTHENTICATED on 401; any other error skips the batch and returns an empty list.
+    """
+    logger.info(
+        f"Processing batch {batch_number}/{total_batches}: {len(batch_ids)} video IDs"
+    )
+    logger.info(
+        f"Batch {batch_number} IDs: {batch_ids[:5]}{'...' if len(batch_ids) > 5 else ''}"
+    )
 
-        # Process video_ids in chunks of 50
-        total_batches = (len(video_ids) + batch_size - 1) // batch_size
-        logger.info(
-            f"Processing {len(video_ids)} video IDs in {total_batches} batches of {batch_size}"
+    try:
+        _youtube_rate_limiter.acquire()
+        request = youtube.videos().list(
+            part="id,snippet",
+            id=",".join(batch_ids),
+            fields=YOUTUBE_VIDEOS_PROJECTION,
         )
+        response = request.execute()
 
-        for batch_index in range(0, len(video_ids), batch_size):
-            # Get the current batch of video IDs
-            batch_ids = video_ids[batch_index : batch_index + batch_size]
-            current_batch_number = (batch_index // batch_size) + 1
+        batch_videos = [_parse_video_item(item) for item in response.get("items", [])]
+        logger.info(
+            f"Batch {batch_number}: Successfully fetched {len(batch_videos)} video details"
+        )
+        return batch_videos
 
-            logger.info(
-                f"Processing batch {current_batch_number}/{total_batches}: {len(batch_ids)} video IDs"
-            )
-            logger.info(
-                f"Batch {current_batch_number} IDs: {batch_ids[:5]}{'...' if len(batch_ids) > 5 else ''}"
+    except HttpError as e:
+        logger.error(
+            f"YouTube API error for batch {batch_number}: HTTP {e.resp.status}"
+        )
+        # Continue with next batch instead of failing completely
+        if e.resp.status == 401:
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
+                message="Invalid or expired YouTube access token.",
             )
+        logger.warning(f"Skipping batch {batch_number} due to API error: {e}")
+        return []
 
-            # Make API request for this batch
-            try:
-                request = youtube.videos().list(
-                    part="id,snippet", id=",".join(batch_ids)
-                )
-                response = request.execute()
+    except Exception as e:
+        logger.error(
+            f"Unexpected error processing batch {batch_number}: {type(e).__name__}: {str(e)}"
+        )
+        # Continue with next batch
+        return []
 
-                batch_videos = []  # Videos from this batch
 
-                # Process each item in the response
-                for item in response.get("items", []):
-                    snippet = item.get("snippet", {})
+def _fetch_video_details_multiplexed(
+    youtube,
+    numbered_batches: list[tuple[int, list[str]]],
+    total_batches: int,
+) -> list[Video]:
+    """
+    Fetch several videos.list batches in a single multipart batch HTTP request.
+    Sub-request errors follow the usual handling: 401 and 403 abort the fetch with the
+    matching HttpsError, any other error skips just that batch.
+    """
+    batch_numbers = [batch_number for batch_number, _ in numbered_batches]
+    logger.info(
+        f"Multiplexing batches {batch_numbers[0]}-{batch_numbers[-1]}/{total_batches} "
+        f"into one batch HTTP request"
+    )
 
-                    # Parse publishedAt timestamp safely
-                    published_at_str = snippet.get("publishedAt", "")
-                    try:
-                        published_at = datetime.fromisoformat(
-                            published_at_str.replace("Z", "+00:00")
-                        )
-                    except ValueError:
-                        logger.warning(
-                            f"Invalid publishedAt format for video {item['id']}: {published_at_str}"
-                        )
-                        published_at = datetime.now(timezone.utc)
-
-                    video = Video(
-                        videoId=item["id"],
-                        title=snippet.get("title", ""),
-                        description=snippet.get("description", ""),
-                        thumbnailUrl=snippet.get("thumbnails", {})
-                        .get("default", {})
-                        .get("url", ""),
-                        channelTitle=snippet.get("channelTitle", ""),
-                        publishedAt=published_at,
-                        platform="YouTube",
-                        addedToZensortAt=datetime.now(timezone.utc),
-                    )
-                    batch_videos.append(video)
+    responses = {}
+    errors = {}
 
-                # Add this batch's results to the master list
-                all_videos.extend(batch_videos)
-                logger.info(
-                    f"Batch {current_batch_number}: Successfully fetched {len(batch_videos)} video details"
-                )
-                logger.info(f"Total videos fetched so far: {len(all_videos)}")
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            responses[request_id] = response
+
+    batch_request = youtube.new_batch_http_request(callback=on_response)
+    for batch_number, batch_ids in numbered_batches:
+        request = youtube.videos().list(
+            part="id,snippet",
+            id=",".join(batch_ids),
+            fields=YOUTUBE_VIDEOS_PROJECTION,
+        )
+        batch_request.add(request, request_id=str(batch_number))
+
+    try:
+        # Quota and per-second limits count each sub-request, not the HTTP round trip
+        _youtube_rate_limiter.acquire(len(numbered_batches))
+        batch_request.execute()
+    except HttpError as e:
+        logger.error(f"YouTube batch HTTP request failed: HTTP {e.resp.status}")
+        auth_error = _youtube_auth_error(e)
+        if auth_error:
+            raise auth_error
+        logger.warning(f"Skipping batches {batch_numbers} due to API error: {e}")
+        return []
 
-            except HttpError as e:
+    videos = []
+    for batch_number, batch_ids in numbered_batches:
+        request_id = str(batch_number)
+        if request_id in errors:
+            error = errors[request_id]
+            if isinstance(error, HttpError):
                 logger.error(
-                    f"YouTube API error for batch {current_batch_number}: HTTP {e.resp.status}"
+                    f"YouTube API error for batch {batch_number}: HTTP {error.resp.status}"
                 )
-                # Continue with next batch instead of failing completely
-                if e.resp.status == 401:
-                    raise https_fn.HttpsError(
-                        code=https_fn.FunctionsErrorCode.UNAUTHENTICATED,
-                        message="Invalid or expired YouTube access token.",
-                    )
-                else:
-                    logger.warning(
-                        f"Skipping batch {current_batch_number} due to API error: {e}"
-                    )
-                    continue
+                auth_error = _youtube_auth_error(error)
+                if auth_error:
+                    raise auth_error
+            logger.warning(f"Skipping batch {batch_number} due to API error: {error}")
+            continue
 
-            except Exception as e:
-                logger.error(
-                    f"Unexpected error processing batch {current_batch_number}: {type(e).__name__}: {str(e)}"
+        batch_videos = [
+            _parse_video_item(item)
+            for item in responses.get(request_id, {}).get("items", [])
+        ]
+        logger.info(
+            f"Batch {batch_number}: Successfully fetched {len(batch_videos)} video details"
+        )
+        videos.extend(batch_videos)
+
+    return videos
+
+
+def fetch_video_details(
+    access_token: str,
+    video_ids: list[str],
+    max_in_flight: int = YOUTUBE_DETAIL_MAX_IN_FLIGHT,
+    use_batch_http: bool = YOUTUBE_USE_BATCH_HTTP,
+) -> list[Video]:
+    """
+    Fetch detailed metadata for specified video IDs from YouTube API.
+    Splits the IDs into 50-ID videos.list batches and fetches up to `max_in_flight`
+    batches concurrently, throttled by the shared token-bucket rate limiter.
+    With use_batch_http, up to YOUTUBE_BATCH_HTTP_MAX_CALLS batches share one multipart
+    batch HTTP request, and each in-flight unit is such a request.
+    Returns a list of Video objects with full metadata, in the order of `video_ids`.
+    """
+    if not video_ids:
+        return []
+
+    try:
+        logger.info(f"=== Starting fetch_video_details for {len(video_ids)} videos ===")
+
+        batch_size = 50  # YouTube API limit for videos.list endpoint
+        batches = [
+            video_ids[batch_index : batch_index + batch_size]
+            for batch_index in range(0, len(video_ids), batch_size)
+        ]
+        total_batches = len(batches)
+        logger.info(
+            f"Processing {len(video_ids)} video IDs in {total_batches} batches of {batch_size} "
+            f"with up to {max_in_flight} in flight"
+        )
+
+        # Each work unit is one HTTP round trip: a single batch, or a group of
+        # batches multiplexed into one batch HTTP request
+        numbered_batches = list(enumerate(batches, 1))
+        unit_size = YOUTUBE_BATCH_HTTP_MAX_CALLS if use_batch_http else 1
+        work_units = [
+            numbered_batches[unit_index : unit_index + unit_size]
+            for unit_index in range(0, total_batches, unit_size)
+        ]
+
+        # Each worker leases its own pooled service, since services are not thread-safe
+        def fetch_unit(unit: list[tuple[int, list[str]]]) -> list[Video]:
+            with _youtube_service_factory.lease(access_token) as youtube:
+                if use_batch_http:
+                    return _fetch_video_details_multiplexed(
+                        youtube, unit, total_batches
+                    )
+                batch_number, batch_ids = unit[0]
+                return _fetch_video_details_batch(
+                    youtube, batch_ids, batch_number, total_batches
                 )
-                # Continue with next batch
-                continue
+
+        if max_in_flight <= 1 or len(work_units) == 1:
+            batch_results = [fetch_unit(unit) for unit in work_units]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(max_in_flight, len(work_units))
+            ) as executor:
+                futures = [executor.submit(fetch_unit, unit) for unit in work_units]
+                try:
+                    batch_results = [future.result() for future in futures]
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+        # Return results in input order regardless of completion order
+        videos_by_id = {
+            video.videoId: video
+            for batch_videos in batch_results
+            for video in batch_videos
+        }
+        all_videos = [
+            videos_by_id[video_id] for video_id in video_ids if video_id in videos_by_id
+        ]
 
         logger.info(
             f"=== Completed fetch_video_details: {len(all_videos)} videos fetched out of {len(video_ids)} requested ==="
@@ -528,14 +2011,15 @@ def get_existing_video_ids(video_ids: list[str]) -> set[str]:
         return set()
 
     try:
-        db = firestore.Client()
+        db = _get_firestore_client()
         videos_collection = db.collection("videos")
 
         # Create document references for all video IDs
         doc_refs = [videos_collection.document(video_id) for video_id in video_ids]
 
-        # Use get_all() to fetch all documents in a single batch operation
-        docs = db.get_all(doc_refs)
+        # Use get_all() to fetch all documents in a single batch operation.
+        # The empty field mask returns existence only, never the embedding vector.
+        docs = db.get_all(doc_refs, field_paths=[])
 
         # Extract video IDs from existing documents
         existing_ids = set()
@@ -553,6 +2037,374 @@ def get_existing_video_ids(video_ids: list[str]) -> set[str]:
         return set()  # Fail safe - assume none exist to avoid data loss
 
 
+def _build_placeholder_video(
+    video_id: str, playlist_title: str, liked_at: datetime
+) -> Video:
+    """
+    Create a placeholder Video for a liked item that videos.list returned no details for.
+    Uses the playlist API title ("Private video", "Deleted video", etc.) when available.
+    """
+    placeholder_title = playlist_title if playlist_title else "Private video"
+
+    # Set appropriate description based on the title
+    if placeholder_title == "Private video":
+        placeholder_description = "This video is private and cannot be accessed."
+    elif placeholder_title == "Deleted video":
+        placeholder_description = (
+            "This video has been deleted and is no longer available."
+        )
+    else:
+        placeholder_description = f"This video ({placeholder_title}) is not accessible."
+
+    return Video(
+        videoId=video_id,
+        title=placeholder_title,
+        description=placeholder_description,
+        thumbnailUrl="",
+        channelTitle="Unknown Channel",
+        publishedAt=liked_at,  # Use likedAt as publishedAt for placeholders
+        platform="YouTube",
+        addedToZensortAt=datetime.now(timezone.utc),
+    )
+
+
+def _merge_liked_items_with_details(
+    video_items: list[dict], existing_video_ids: set[str], video_details: list[Video]
+) -> tuple[list[Video], int]:
+    """
+    Merge liked items with fetched video details, creating placeholders for private/deleted videos.
+    Existing videos are skipped. Returns the new videos to store and the number of placeholders created.
+    """
+    video_details_map = {video.videoId: video for video in video_details}
+
+    videos_to_store = []
+    placeholder_count = 0
+
+    for video_item in video_items:
+        video_id = video_item["videoId"]
+
+        # Skip existing videos - they don't need processing in videos collection
+        if video_id in existing_video_ids:
+            logger.debug(f"Skipping existing video {video_id}")
+            continue
+
+        if video_id in video_details_map:
+            # New video with actual details from videos.list API
+            video = video_details_map[video_id]
+            videos_to_store.append(video)
+            logger.debug(f"Storing new video {video_id}: {video.title}")
+        else:
+            # New video without details - create placeholder using playlist API title
+            placeholder_video = _build_placeholder_video(
+                video_id, video_item["title"], video_item["likedAt"]
+            )
+            videos_to_store.append(placeholder_video)
+            logger.info(
+                f"Creating new placeholder for video {video_id}: '{placeholder_video.title}'"
+            )
+            placeholder_count += 1
+
+    return videos_to_store, placeholder_count
+
+
+def _video_to_firestore_data(video: Video) -> dict:
+    """Build the /videos document data for a Video, including its category when applicable."""
+    video_data = {
+        "platform": video.platform,
+        "videoId": video.videoId,
+        "title": video.title,
+        "description": video.description,
+        "channelTitle": video.channelTitle,
+        "thumbnailUrl": video.thumbnailUrl,
+        "publishedAt": video.publishedAt,
+        "addedToZensortAt": video.addedToZensortAt,
+    }
+
+    # Only add category field if it's not None (to avoid unnecessary null fields)
+    category = get_video_category(video.title, video.channelTitle)
+    if category is not None:
+        video_data["category"] = category
+
+    return video_data
+
+
+def _process_liked_page(
+    db: firestore.Client,
+    access_token: str,
+    page_items: list[dict],
+    sync_job_ref: firestore.DocumentReference,
+) -> tuple[list[Video], set[str], int]:
+    """
+    Streaming sync stage for a single playlist page: existence check, videos.list lookup
+    for new videos only, and a staged write of the new /videos documents.
+    Returns the stored videos, the IDs that already existed and the placeholder count.
+    """
+    page_video_ids = [item["videoId"] for item in page_items]
+    existing_video_ids = get_existing_video_ids(page_video_ids)
+
+    new_video_ids = [
+        vid_id for vid_id in page_video_ids if vid_id not in existing_video_ids
+    ]
+    video_details = []
+    if new_video_ids:
+        video_details = fetch_video_details(access_token, new_video_ids)
+
+    videos_to_store, placeholder_count = _merge_liked_items_with_details(
+        page_items, existing_video_ids, video_details
+    )
+
+    # Staged write: a page holds at most 50 videos, well within the 500-write batch limit
+    if videos_to_store:
+        batch = db.batch()
+        for video in videos_to_store:
+            batch.set(
+                db.collection("videos").document(video.videoId),
+                _video_to_firestore_data(video),
+            )
+        batch.commit()
+
+    sync_job_ref.update({"syncedCount": firestore.Increment(len(page_items))})
+
+    return videos_to_store, existing_video_ids, placeholder_count
+
+
+def _stream_liked_video_sync(
+    db: firestore.Client,
+    access_token: str,
+    sync_job_ref: firestore.DocumentReference,
+    etag_cache: YouTubeEtagCache | None = None,
+) -> tuple[list[dict], list[Video], set[str], int, int]:
+    """
+    Pipelined version of Steps A-C of the sync: each playlist page is handed to a worker
+    as soon as it arrives, so existence checks, videos.list lookups and /videos writes for
+    earlier pages overlap with paging through the rest of the playlist.
+
+    Returns all liked items (in playlist order), the new videos that were written,
+    the IDs that already existed, the number of placeholders created and the
+    playlist's reported totalResults.
+    """
+    all_video_items = []
+    futures = []
+    playlist_total = 0
+
+    with ThreadPoolExecutor(max_workers=SYNC_PIPELINE_MAX_IN_FLIGHT_PAGES) as executor:
+        pages = iter_liked_video_pages(access_token, etag_cache)
+        for page_number, page in enumerate(pages, 1):
+            if page_number == 1:
+                # The first page already tells us the playlist size
+                playlist_total = page.total_results
+                sync_job_ref.update({"totalCount": page.total_results})
+                logger.info(f"Updated sync job with total count: {page.total_results}")
+
+            all_video_items.extend(page.items)
+            if page.items:
+                futures.append(
+                    executor.submit(
+                        _process_liked_page,
+                        db,
+                        access_token,
+                        page.items,
+                        sync_job_ref,
+                    )
+                )
+
+        videos_to_store = []
+        existing_video_ids = set()
+        placeholder_count = 0
+        for future in futures:
+            page_videos, page_existing_ids, page_placeholders = future.result()
+            videos_to_store.extend(page_videos)
+            existing_video_ids |= page_existing_ids
+            placeholder_count += page_placeholders
+
+    logger.info(
+        f"Streaming sync processed {len(futures)} pages: {len(all_video_items)} liked items, "
+        f"{len(videos_to_store)} new videos written, {len(existing_video_ids)} existing"
+    )
+    return (
+        all_video_items,
+        videos_to_store,
+        existing_video_ids,
+        placeholder_count,
+        playlist_total,
+    )
+
+
+def _build_sync_watermark(video_items: list[dict]) -> dict | None:
+    """The LL playlist is newest-first, so the first liked item marks how far a sync got."""
+    if not video_items:
+        return None
+    return {
+        "likedAt": video_items[0]["likedAt"],
+        "videoId": video_items[0]["videoId"],
+    }
+
+
+def _liker_ref(
+    db: firestore.Client, video_id: str, user_id: str
+) -> firestore.DocumentReference:
+    """
+    Reference to the /videos/{videoId}/likers/{userId} reverse-index document, which
+    records that the user currently likes the video. Maintained by the sync next to
+    likedVideos so per-video fan-out only visits the users who liked it.
+    """
+    return (
+        db.collection("videos")
+        .document(video_id)
+        .collection("likers")
+        .document(user_id)
+    )
+
+
+def _full_reconciliation_reason(previous_job_data: dict) -> str | None:
+    """
+    Return why an incremental sync can't be used (no watermark yet, the likers index
+    hasn't been backfilled, or the scheduled full reconciliation is due), or None if it can.
+    """
+    if not previous_job_data.get("watermark") or "likedCount" not in previous_job_data:
+        return "no_watermark"
+    if not previous_job_data.get("likersIndexed"):
+        return "likers_index_backfill"
+    last_full_sync_at = previous_job_data.get("lastFullSyncAt")
+    if (
+        not last_full_sync_at
+        or datetime.now(timezone.utc) - last_full_sync_at
+        >= SYNC_FULL_RECONCILIATION_INTERVAL
+    ):
+        return "scheduled"
+    return None
+
+
+def _run_incremental_sync(
+    db: firestore.Client,
+    access_token: str,
+    user_id: str,
+    sync_job_ref: firestore.DocumentReference,
+    previous_job_data: dict,
+    etag_cache: YouTubeEtagCache | None = None,
+) -> dict | None:
+    """
+    Watermark-based incremental sync: page through the newest-first LL playlist only
+    until the stored watermark is reached, then store the new likes.
+    Unlikes can't be seen this way, so if the playlist's totalResults disagrees with the
+    stored like count plus the new likes, nothing is written and None is returned so the
+    caller can fall back to a full reconciliation.
+    """
+    watermark = previous_job_data["watermark"]
+    stored_liked_count = previous_job_data["likedCount"]
+
+    new_items = []
+    total_results = None
+    pages_fetched = 0
+    reached_watermark = False
+
+    for page in iter_liked_video_pages(access_token, etag_cache):
+        pages_fetched += 1
+        if total_results is None:
+            total_results = page.total_results
+
+        for item in page.items:
+            if (
+                item["videoId"] == watermark["videoId"]
+                or item["likedAt"] < watermark["likedAt"]
+            ):
+                reached_watermark = True
+                break
+            new_items.append(item)
+
+        if reached_watermark:
+            break
+
+    logger.info(
+        f"Incremental sync fetched {pages_fetched} pages, found {len(new_items)} new likes "
+        f"(playlist total {total_results}, stored {stored_liked_count})"
+    )
+
+    if total_results != stored_liked_count + len(new_items):
+        logger.info(
+            "Playlist count disagrees with stored count, full reconciliation needed"
+        )
+        return None
+
+    sync_job_ref.update({"totalCount": total_results})
+
+    videos_to_store = []
+    existing_video_ids = set()
+    placeholder_count = 0
+    if new_items:
+        new_item_ids = [item["videoId"] for item in new_items]
+        existing_video_ids = get_existing_video_ids(new_item_ids)
+        missing_ids = [
+            vid_id for vid_id in new_item_ids if vid_id not in existing_video_ids
+        ]
+        video_details = (
+            fetch_video_details(access_token, missing_ids) if missing_ids else []
+        )
+        videos_to_store, placeholder_count = _merge_liked_items_with_details(
+            new_items, existing_video_ids, video_details
+        )
+
+        sync_timestamp = datetime.now(timezone.utc)
+        writer = FirestoreWriteEngine(db)
+        for video in videos_to_store:
+            writer.set(
+                db.collection("videos").document(video.videoId),
+                _video_to_firestore_data(video),
+            )
+        for item in new_items:
+            with writer.group():
+                writer.set(
+                    db.collection("users")
+                    .document(user_id)
+                    .collection("likedVideos")
+                    .document(item["videoId"]),
+                    {"likedAt": item["likedAt"], "syncedAt": sync_timestamp},
+                    merge=True,
+                )
+                writer.set(
+                    _liker_ref(db, item["videoId"], user_id),
+                    {"likedAt": item["likedAt"]},
+                )
+        writer.commit()
+        new_video_ids = [item["videoId"] for item in new_items]
+        _apply_like_changes_to_progress(
+            db, user_id, new_video_ids, [], writer.commit_times
+        )
+        _record_like_changes_in_snapshot(db, user_id, new_video_ids, [])
+
+    sync_job_ref.update(
+        {
+            "status": "completed",
+            "syncedCount": total_results,
+            "completedAt": datetime.now(timezone.utc),
+            "watermark": _build_sync_watermark(new_items) or watermark,
+            "likedCount": total_results,
+        }
+    )
+
+    private_legacy_count = sum(
+        1 for video in videos_to_store if is_private_legacy_video(video.title)
+    )
+    return {
+        "synced": len(new_items),
+        "public_videos": len(videos_to_store) - private_legacy_count,
+        "private_legacy_videos": private_legacy_count,
+        "total_liked_videos": total_results,
+        "videos_processed": len(videos_to_store),
+        "videos_stored_new": len(videos_to_store),
+        "videos_skipped_existing": len(existing_video_ids),
+        "placeholders_created": placeholder_count,
+        "newly_liked": len(new_items),
+        "still_liked": stored_liked_count,
+        "newly_unliked": 0,
+        "differential_sync_enabled": True,
+        "performance_optimized": True,
+        "incremental": True,
+        "pages_fetched": pages_fetched,
+        "etag_hits": etag_cache.hits if etag_cache else 0,
+    }
+
+
 @https_fn.on_call(timeout_sec=540)  # 9 minutes timeout for large syncs
 def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
     """
@@ -573,12 +2425,31 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
     - Detects when users unlike videos on YouTube and moves them to unlikedVideos subcollection
     - Preserves historical data for unliked videos (originalLikedAt, unlikedAt, reason)
     - Maintains complete data integrity with proper placeholder handling
+    - Maintains the /videos/{videoId}/likers reverse index used for per-video progress fan-out
+
+    Streaming mode (streaming=True in the request data) pipelines Steps A-C: each playlist
+    page is checked, looked up and written to /videos as soon as it arrives instead of
+    waiting for the whole playlist to be fetched first.
 
-    Expects: access_token and user_id in the request data.
+    Incremental mode (incremental=True) stops paging once it reaches the watermark (newest
+    likedAt and video ID) stored on the sync job by the previous sync. A full reconciliation
+    still runs when no watermark exists, when the last one is older than
+    SYNC_FULL_RECONCILIATION_INTERVAL, or when the playlist totalResults count disagrees
+    with the stored like count.
+
+    ETag mode (use_etags=True) sends playlist page and video detail requests with
+    If-None-Match, reusing responses cached under /users/{userId}/youtubeEtags when
+    YouTube answers 304 Not Modified.
+
+    Expects: access_token and user_id in the request data, optionally streaming, incremental
+    and use_etags.
     Returns: dict with comprehensive sync statistics including differential sync counts.
     """
     access_token = req.data.get("access_token")
     user_id = req.data.get("user_id")
+    streaming = bool(req.data.get("streaming", False))
+    incremental = bool(req.data.get("incremental", False))
+    use_etags = bool(req.data.get("use_etags", False))
 
     if not access_token:
         raise https_fn.HttpsError(
@@ -592,13 +2463,14 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
             message="The function must be called with a valid 'user_id'.",
         )
 
-    db = firestore.Client()
+    db = _get_firestore_client()
     sync_job_ref = (
         db.collection("users")
         .document(user_id)
         .collection("syncJobs")
         .document("youtube_liked_videos")
     )
+    etag_cache = YouTubeEtagCache(db, user_id) if use_etags else None
 
     try:
         logger.info(f"Starting efficient sync for user {user_id}")
@@ -607,6 +2479,9 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
         logger.info("Step 0: Creating sync job document for progress tracking")
         sync_start_time = datetime.now(timezone.utc)
 
+        # Carry the incremental-sync watermark over from the previous sync
+        previous_job_data = sync_job_ref.get().to_dict() or {}
+
         # We'll update the total count once we know it
         initial_sync_job_data = {
             "status": "in_progress",
@@ -614,121 +2489,117 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
             "syncedCount": 0,
             "startedAt": sync_start_time,
         }
+        for field in ("watermark", "likedCount", "lastFullSyncAt", "likersIndexed"):
+            if field in previous_job_data:
+                initial_sync_job_data[field] = previous_job_data[field]
         sync_job_ref.set(initial_sync_job_data)
         logger.info("Sync job document created with initial state")
 
-        # Step A: Fetch All Items - Get complete list with correct likedAt timestamps
-        logger.info("Step A: Fetching all liked video items from playlist")
-        all_video_items = fetch_liked_video_items(access_token)
-        logger.info(f"Found {len(all_video_items)} total liked videos")
-
-        # Update sync job with total count
-        sync_job_ref.update({"totalCount": len(all_video_items)})
-        logger.info(f"Updated sync job with total count: {len(all_video_items)}")
-
-        if not all_video_items:
-            # Complete sync job for empty result
-            sync_job_ref.update(
-                {"status": "completed", "completedAt": datetime.now(timezone.utc)}
+        full_reconciliation_reason = "requested"
+        if incremental:
+            full_reconciliation_reason = _full_reconciliation_reason(previous_job_data)
+            if full_reconciliation_reason is None:
+                logger.info("Running watermark-based incremental sync")
+                incremental_result = _run_incremental_sync(
+                    db,
+                    access_token,
+                    user_id,
+                    sync_job_ref,
+                    previous_job_data,
+                    etag_cache,
+                )
+                if incremental_result is not None:
+                    if etag_cache:
+                        etag_cache.flush()
+                    logger.info(f"Incremental sync completed for user {user_id}")
+                    return incremental_result
+                full_reconciliation_reason = "count_mismatch"
+            logger.info(
+                f"Running full reconciliation (reason: {full_reconciliation_reason})"
             )
-            return {"synced": 0, "public_videos": 0, "private_legacy_videos": 0}
-
-        # Step B: Check Existing Videos First (Performance Optimization)
-        logger.info("Step B: Checking which videos already exist in database")
-
-        # Extract all video IDs from liked items
-        all_video_ids = [item["videoId"] for item in all_video_items]
-        logger.info(f"Total video IDs to process: {len(all_video_ids)}")
-
-        # Check which videos already exist in the root /videos collection FIRST
-        existing_video_ids = get_existing_video_ids(all_video_ids)
-        logger.info(
-            f"Found {len(existing_video_ids)} videos already in public collection"
-        )
-
-        # Only fetch details for NEW videos (major performance optimization)
-        new_video_ids = [
-            vid_id for vid_id in all_video_ids if vid_id not in existing_video_ids
-        ]
-        logger.info(f"Need to fetch details for {len(new_video_ids)} new videos only")
 
-        # Step C: Batch Fetch Details for NEW Videos Only (not all videos)
-        logger.info("Step C: Batch fetching details for new videos only")
-        video_details = []
-        if new_video_ids:
-            video_details = fetch_video_details(access_token, new_video_ids)
+        if streaming:
+            # Steps A-C pipelined: pages flow into existence checks, detail lookups
+            # and staged /videos writes as soon as they arrive
             logger.info(
-                f"Successfully fetched details for {len(video_details)} out of {len(new_video_ids)} new videos"
+                "Steps A-C: Streaming liked video pages through the sync pipeline"
             )
+            (
+                all_video_items,
+                videos_to_store,
+                existing_video_ids,
+                private_legacy_count,
+                playlist_total,
+            ) = _stream_liked_video_sync(db, access_token, sync_job_ref, etag_cache)
+            logger.info(f"Found {len(all_video_items)} total liked videos")
+
+            if not all_video_items:
+                sync_job_ref.update(
+                    {"status": "completed", "completedAt": datetime.now(timezone.utc)}
+                )
+                return {"synced": 0, "public_videos": 0, "private_legacy_videos": 0}
+        else:
+            # Step A: Fetch All Items - Get complete list with correct likedAt timestamps
+            logger.info("Step A: Fetching all liked video items from playlist")
+            all_video_items = []
+            playlist_total = None
+            for page in iter_liked_video_pages(access_token, etag_cache):
+                if playlist_total is None:
+                    playlist_total = page.total_results
+                all_video_items.extend(page.items)
+            logger.info(f"Found {len(all_video_items)} total liked videos")
+
+            # Update sync job with total count
+            sync_job_ref.update({"totalCount": len(all_video_items)})
+            logger.info(f"Updated sync job with total count: {len(all_video_items)}")
+
+            if not all_video_items:
+                # Complete sync job for empty result
+                sync_job_ref.update(
+                    {"status": "completed", "completedAt": datetime.now(timezone.utc)}
+                )
+                return {"synced": 0, "public_videos": 0, "private_legacy_videos": 0}
 
-            # Update progress after fetching video details
-            sync_job_ref.update({"syncedCount": len(video_details)})
-            logger.info(f"Updated sync progress: {len(video_details)} videos processed")
-
-        # Create lookup map from video details keyed by videoId
-        video_details_map = {video.videoId: video for video in video_details}
-        logger.info(f"Created lookup map with {len(video_details_map)} video details")
-
-        # Merge liked items with video details, creating placeholders for private/deleted videos
-        videos_to_store = []  # Only new videos need to be stored
-        private_legacy_count = 0
+            # Step B: Check Existing Videos First (Performance Optimization)
+            logger.info("Step B: Checking which videos already exist in database")
 
-        for video_item in all_video_items:
-            video_id = video_item["videoId"]
-            liked_at = video_item["likedAt"]
-            playlist_title = video_item[
-                "title"
-            ]  # Title from playlist API (includes "Private video", "Deleted video", etc.)
-
-            # Skip existing videos - they don't need processing in videos collection
-            if video_id in existing_video_ids:
-                logger.debug(f"Skipping existing video {video_id}")
-                continue
+            # Extract all video IDs from liked items
+            all_video_ids = [item["videoId"] for item in all_video_items]
+            logger.info(f"Total video IDs to process: {len(all_video_ids)}")
 
-            # Process only NEW videos
-            if video_id in video_details_map:
-                # New video with actual details from videos.list API
-                video = video_details_map[video_id]
-                videos_to_store.append(video)
-                logger.debug(f"Storing new video {video_id}: {video.title}")
-            else:
-                # New video without details - create placeholder using playlist API title
-                # YouTube API provides accurate titles like "Private video", "Deleted video", etc.
-                placeholder_title = (
-                    playlist_title if playlist_title else "Private video"
-                )
+            # Check which videos already exist in the root /videos collection FIRST
+            existing_video_ids = get_existing_video_ids(all_video_ids)
+            logger.info(
+                f"Found {len(existing_video_ids)} videos already in public collection"
+            )
 
-                # Set appropriate description based on the title
-                if placeholder_title == "Private video":
-                    placeholder_description = (
-                        "This video is private and cannot be accessed."
-                    )
-                elif placeholder_title == "Deleted video":
-                    placeholder_description = (
-                        "This video has been deleted and is no longer available."
-                    )
-                else:
-                    placeholder_description = (
-                        f"This video ({placeholder_title}) is not accessible."
-                    )
+            # Only fetch details for NEW videos (major performance optimization)
+            new_video_ids = [
+                vid_id for vid_id in all_video_ids if vid_id not in existing_video_ids
+            ]
+            logger.info(
+                f"Need to fetch details for {len(new_video_ids)} new videos only"
+            )
 
-                # Create placeholder with the actual title from YouTube API
-                placeholder_video = Video(
-                    videoId=video_id,
-                    title=placeholder_title,
-                    description=placeholder_description,
-                    thumbnailUrl="",
-                    channelTitle="Unknown Channel",
-                    publishedAt=liked_at,  # Use likedAt as publishedAt for placeholders
-                    platform="YouTube",
-                    addedToZensortAt=datetime.now(timezone.utc),
+            # Step C: Batch Fetch Details for NEW Videos Only (not all videos)
+            logger.info("Step C: Batch fetching details for new videos only")
+            video_details = []
+            if new_video_ids:
+                video_details = fetch_video_details(access_token, new_video_ids)
+                logger.info(
+                    f"Successfully fetched details for {len(video_details)} out of {len(new_video_ids)} new videos"
                 )
 
-                videos_to_store.append(placeholder_video)
+                # Update progress after fetching video details
+                sync_job_ref.update({"syncedCount": len(video_details)})
                 logger.info(
-                    f"Creating new placeholder for video {video_id}: '{placeholder_title}'"
+                    f"Updated sync progress: {len(video_details)} videos processed"
                 )
-                private_legacy_count += 1
+
+            # Merge liked items with video details, creating placeholders for private/deleted videos
+            videos_to_store, private_legacy_count = _merge_liked_items_with_details(
+                all_video_items, existing_video_ids, video_details
+            )
 
         # Categorize NEW videos into public and private/legacy
         public_videos = []
@@ -785,34 +2656,36 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
 
         # Step E: Differential Batch Write with Category Fields and Unlike Handling
         logger.info("Step E: Executing differential batch write with unlike handling")
-        batch = db.batch()
 
-        sync_timestamp = datetime.now(timezone.utc)
+        def report_write_progress(completed_chunks, total_chunks, written_ops):
+            sync_job_ref.update(
+                {
+                    "writeProgress": {
+                        "completedChunks": completed_chunks,
+                        "totalChunks": total_chunks,
+                        "writtenOps": written_ops,
+                    }
+                }
+            )
 
-        # Add new videos (public + placeholders) to the root /videos collection
-        for video in videos_to_store:
-            video_doc_ref = db.collection("videos").document(video.videoId)
-            category = get_video_category(video.title, video.channelTitle)
-
-            video_data = {
-                "platform": video.platform,
-                "videoId": video.videoId,
-                "title": video.title,
-                "description": video.description,
-                "channelTitle": video.channelTitle,
-                "thumbnailUrl": video.thumbnailUrl,
-                "publishedAt": video.publishedAt,
-                "addedToZensortAt": video.addedToZensortAt,
-            }
+        # Chunked, parallel writer: the sync can exceed Firestore's 500-write batch limit
+        batch = FirestoreWriteEngine(db, progress_callback=report_write_progress)
 
-            # Only add category field if it's not None (to avoid unnecessary null fields)
-            if category is not None:
-                video_data["category"] = category
+        sync_timestamp = datetime.now(timezone.utc)
 
-            batch.set(video_doc_ref, video_data)
+        # Add new videos (public + placeholders) to the root /videos collection.
+        # In streaming mode they were already written page by page.
+        if not streaming:
+            for video in videos_to_store:
+                video_doc_ref = db.collection("videos").document(video.videoId)
+                batch.set(video_doc_ref, _video_to_firestore_data(video))
 
         # Note: Existing videos are skipped for performance - no updates needed
 
+        # The likers reverse index only needs newly liked videos, except on the first
+        # sync after it was introduced, which backfills every still-liked video too
+        backfill_likers = not previous_job_data.get("likersIndexed")
+
         # Add currently liked videos (newly liked + still liked) to user's liked videos subcollection
         # Using the correct likedAt timestamps from Step A
         for video_item in all_video_items:
@@ -826,47 +2699,70 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
                     .collection("likedVideos")
                     .document(video_id)
                 )
-                batch.set(
-                    liked_video_doc_ref,
-                    {
-                        "likedAt": video_item[
-                            "likedAt"
-                        ],  # Correct timestamp from playlist API
-                        "syncedAt": sync_timestamp,
-                    },
-                )
+                with batch.group():
+                    # Merged, so fields other writers keep on the like (the shelfId
+                    # from generate_smart_shelves) survive the sync
+                    batch.set(
+                        liked_video_doc_ref,
+                        {
+                            "likedAt": video_item[
+                                "likedAt"
+                            ],  # Correct timestamp from playlist API
+                            "syncedAt": sync_timestamp,
+                        },
+                        merge=True,
+                    )
+                    if video_id in newly_liked or backfill_likers:
+                        batch.set(
+                            _liker_ref(db, video_id, user_id),
+                            {"likedAt": video_item["likedAt"]},
+                        )
 
         # Handle newly unliked videos - move to unlikedVideos subcollection
+        moved_unliked_ids = []
         for unliked_video_id in newly_unliked:
             # Use cached liked data (no individual Firestore reads needed)
             original_data = existing_liked_data.get(unliked_video_id)
 
-            if original_data:
-                # Add to unlikedVideos subcollection with historical data
+            if original_data and "likedAt" not in original_data:
+                # Only a shelf assignment, merged in after the video was unliked
+                batch.delete(
+                    db.collection("users")
+                    .document(user_id)
+                    .collection("likedVideos")
+                    .document(unliked_video_id)
+                )
+            elif original_data:
                 unliked_video_doc_ref = (
                     db.collection("users")
                     .document(user_id)
                     .collection("unlikedVideos")
                     .document(unliked_video_id)
                 )
-                batch.set(
-                    unliked_video_doc_ref,
-                    {
-                        "originalLikedAt": original_data["likedAt"],
-                        "unlikedAt": sync_timestamp,
-                        "syncedAt": sync_timestamp,
-                        "reason": "user_unliked",
-                    },
-                )
-
-                # Remove from likedVideos subcollection
                 original_liked_doc_ref = (
                     db.collection("users")
                     .document(user_id)
                     .collection("likedVideos")
                     .document(unliked_video_id)
                 )
-                batch.delete(original_liked_doc_ref)
+
+                # Keep the move atomic: both writes are committed in the same chunk
+                with batch.group():
+                    # Add to unlikedVideos subcollection with historical data
+                    batch.set(
+                        unliked_video_doc_ref,
+                        {
+                            "originalLikedAt": original_data["likedAt"],
+                            "unlikedAt": sync_timestamp,
+                            "syncedAt": sync_timestamp,
+                            "reason": "user_unliked",
+                        },
+                    )
+
+                    # Remove from likedVideos subcollection and the likers index
+                    batch.delete(original_liked_doc_ref)
+                    batch.delete(_liker_ref(db, unliked_video_id, user_id))
+                moved_unliked_ids.append(unliked_video_id)
 
                 logger.info(
                     f"Moving unliked video {unliked_video_id} to unlikedVideos collection"
@@ -876,7 +2772,7 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
                     f"No original data found for unliked video {unliked_video_id}"
                 )
 
-        # Execute the atomic batch write
+        # Execute the chunked batch write
         total_public_videos = len(public_videos)
         total_private_legacy = len(private_legacy_video_ids)
         total_user_relations = len(all_video_items)
@@ -890,6 +2786,14 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
         )
         batch.commit()
 
+        # Move the like/unlike changes into the user's embedding progress counters
+        _apply_like_changes_to_progress(
+            db, user_id, list(newly_liked), moved_unliked_ids, batch.commit_times
+        )
+        _record_like_changes_in_snapshot(
+            db, user_id, list(newly_liked), moved_unliked_ids
+        )
+
         # Step F: Update Sync Job Completion Status
         logger.info("Step F: Updating sync job completion status")
         sync_job_ref.update(
@@ -897,9 +2801,18 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
                 "status": "completed",
                 "syncedCount": len(all_video_items),
                 "completedAt": datetime.now(timezone.utc),
+                # Watermark for the next incremental sync
+                "watermark": _build_sync_watermark(all_video_items),
+                # Playlist totalResults, compared against by the next incremental sync
+                "likedCount": playlist_total,
+                "lastFullSyncAt": sync_start_time,
+                "likersIndexed": True,
             }
         )
 
+        if etag_cache:
+            etag_cache.flush()
+
         logger.info(f"Sync completed successfully for user {user_id}")
 
         return {
@@ -917,6 +2830,10 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
             "newly_unliked": len(newly_unliked),
             "differential_sync_enabled": True,
             "performance_optimized": True,
+            "streaming": streaming,
+            "incremental": False,
+            "full_reconciliation_reason": full_reconciliation_reason,
+            "etag_hits": etag_cache.hits if etag_cache else 0,
         }
 
     except Exception as e:
@@ -942,46 +2859,324 @@ def sync_youtube_liked_videos(req: https_fn.CallableRequest) -> dict:
         )
 
 
-def update_embedding_progress(user_id):
-    db = firestore.Client()
-    # Get all videoIds liked by this user
-    # Using .get() instead of .stream() for better performance when processing all documents
-    liked_videos_ref = (
-        db.collection("users").document(user_id).collection("likedVideos")
-    )
-    liked_video_docs = liked_videos_ref.get()
-    video_ids = [doc.id for doc in liked_video_docs]
-    total = len(video_ids)
-    completed = 0
-    failed = 0
-    for video_id in video_ids:
-        video_doc = db.collection("videos").document(video_id).get()
-        if not video_doc.exists:
-            continue
-        status = video_doc.get("embedding_status")
-        if status == "complete":
-            completed += 1
-        elif status == "failed":
-            failed += 1
-    pending = total - completed - failed
-    progress_ref = (
+def _embedding_progress_ref(
+    db: firestore.Client, user_id: str
+) -> firestore.DocumentReference:
+    return (
         db.collection("users")
         .document(user_id)
         .collection("embeddingProgress")
         .document("current")
     )
+
+
+def _embedding_progress_bucket(video_data: dict | None) -> str:
+    """
+    Progress counter a video counts towards: "completed", "failed" or "pending".
+    Missing videos and any in-between status (e.g. "processing") count as pending.
+    """
+    status = (video_data or {}).get("embedding_status")
+    if status == "complete":
+        return "completed"
+    if status == "failed":
+        return "failed"
+    return "pending"
+
+
+def _write_embedding_progress(
+    progress_ref: firestore.DocumentReference, total: int, completed: int, failed: int
+) -> None:
     progress_ref.set(
         {
             "total": total,
             "completed": completed,
             "failed": failed,
-            "pending": pending,
+            "pending": total - completed - failed,
             "last_updated": datetime.now(timezone.utc),
         },
         merge=True,
     )
 
 
+def _increment_embedding_progress(
+    db: firestore.Client, user_id: str, deltas: dict[str, int]
+) -> None:
+    """
+    Apply counter deltas ("total", "completed", "failed") to one random shard of the
+    user's embedding progress. This is a single blind write: nothing is read, so
+    concurrent updates never contend or overwrite each other.
+    """
+    shard_ref = (
+        _embedding_progress_ref(db, user_id)
+        .collection("shards")
+        .document(str(random.randrange(EMBEDDING_PROGRESS_SHARDS)))
+    )
+    shard_ref.set(
+        {field: firestore.Increment(delta) for field, delta in deltas.items()},
+        merge=True,
+    )
+
+
+def read_embedding_progress(db: firestore.Client, user_id: str) -> dict:
+    """
+    Current embedding progress of a user, summed over the counter shards with a single
+    aggregation query.
+    """
+    shards_ref = _embedding_progress_ref(db, user_id).collection("shards")
+    aggregation = (
+        shards_ref.sum("total", alias="total")
+        .sum("completed", alias="completed")
+        .sum("failed", alias="failed")
+    )
+    sums = {"total": 0, "completed": 0, "failed": 0}
+    for results in aggregation.get():
+        for result in results:
+            sums[result.alias] = int(result.value or 0)
+    sums["pending"] = sums["total"] - sums["completed"] - sums["failed"]
+    return sums
+
+
+def _progress_read_time(commit_time: datetime | None) -> datetime | None:
+    """
+    The read_time to read a document as of `commit_time`, truncated to the microsecond
+    precision Firestore accepts. None when there is no commit time or it is too old.
+    """
+    if not isinstance(commit_time, datetime):
+        return None
+    if datetime.now(timezone.utc) - commit_time > EMBEDDING_PROGRESS_READ_TIME_MAX_AGE:
+        return None
+    # Commit times are DatetimeWithNanoseconds, and the client sends their nanoseconds
+    # along; build a plain datetime so the read time is at microsecond precision
+    return datetime(
+        commit_time.year,
+        commit_time.month,
+        commit_time.day,
+        commit_time.hour,
+        commit_time.minute,
+        commit_time.second,
+        commit_time.microsecond,
+        tzinfo=commit_time.tzinfo,
+    )
+
+
+def _apply_like_changes_to_progress(
+    db: firestore.Client,
+    user_id: str,
+    liked_ids: list[str],
+    unliked_ids: list[str],
+    commit_times: dict | None = None,
+) -> None:
+    """
+    Update a user's embedding progress counters for videos the sync just liked or unliked,
+    reading only the embedding_status of those videos.
+
+    `commit_times` (FirestoreWriteEngine.commit_times) gives the time each likers entry
+    was written or deleted. Statuses are read as of that time: status transitions read
+    the likers index as of the transition, so every (user, video) pair is counted either
+    here or in _apply_embedding_status_transition, never both. Users whose progress was
+    never counted get a full recount instead, which seeds their shards.
+    """
+    if not liked_ids and not unliked_ids:
+        return
+
+    if not _embedding_progress_ref(db, user_id).get(field_paths=["total"]).exists:
+        update_embedding_progress(user_id)
+        return
+
+    commit_times = commit_times or {}
+    deltas = {"total": len(liked_ids) - len(unliked_ids), "completed": 0, "failed": 0}
+    for video_ids, sign in ((liked_ids, 1), (unliked_ids, -1)):
+        # Likers entries committed together share a read time, so this is one batched
+        # read per write chunk
+        ids_by_read_time = {}
+        for vid in video_ids:
+            read_time = _progress_read_time(
+                commit_times.get(_liker_ref(db, vid, user_id))
+            )
+            ids_by_read_time.setdefault(read_time, []).append(vid)
+        for read_time, ids in ids_by_read_time.items():
+            video_refs = [db.collection("videos").document(vid) for vid in ids]
+            read_options = {"read_time": read_time} if read_time else {}
+            for video_doc in db.get_all(
+                video_refs, field_paths=["embedding_status"], **read_options
+            ):
+                bucket = _embedding_progress_bucket(
+                    video_doc.to_dict() if video_doc.exists else None
+                )
+                if bucket != "pending":
+                    deltas[bucket] += sign
+    _increment_embedding_progress(db, user_id, deltas)
+
+
+def update_embedding_progress(user_id):
+    """
+    Recount a user's embedding progress from likedVideos and /videos, resetting the
+    counter shards to the recounted totals. Normal updates go through
+    _increment_embedding_progress; this corrects any drift and seeds new users.
+    embeddingProgress/current keeps the counts of the latest recount.
+
+    The shards are read, recounted and reset in one transaction: its reads lock the
+    shards, so an Increment that lands meanwhile waits for the reset and applies on top
+    of it instead of being overwritten.
+    """
+    db = _get_firestore_client()
+    progress_ref = _embedding_progress_ref(db, user_id)
+    shards_ref = progress_ref.collection("shards")
+    shard_refs = [
+        shards_ref.document(str(shard)) for shard in range(EMBEDDING_PROGRESS_SHARDS)
+    ]
+
+    @firestore.transactional
+    def recount(transaction):
+        list(db.get_all(shard_refs, transaction=transaction))
+        # Get all videoIds liked by this user
+        liked_videos_ref = (
+            db.collection("users").document(user_id).collection("likedVideos")
+        )
+        video_ids = [doc.id for doc in liked_videos_ref.get(transaction=transaction)]
+        total = len(video_ids)
+        completed = 0
+        failed = 0
+        if video_ids:
+            # Batched read of just the status field, not the embedding vectors
+            video_refs = [db.collection("videos").document(vid) for vid in video_ids]
+            for video_doc in db.get_all(
+                video_refs, field_paths=["embedding_status"], transaction=transaction
+            ):
+                if not video_doc.exists:
+                    continue
+                bucket = _embedding_progress_bucket(video_doc.to_dict())
+                if bucket == "completed":
+                    completed += 1
+                elif bucket == "failed":
+                    failed += 1
+
+        for shard, shard_ref in enumerate(shard_refs):
+            counts = (total, completed, failed) if shard == 0 else (0, 0, 0)
+            transaction.set(
+                shard_ref, dict(zip(("total", "completed", "failed"), counts))
+            )
+        return total, completed, failed
+
+    total, completed, failed = recount(db.transaction())
+    _write_embedding_progress(progress_ref, total, completed, failed)
+
+
+def _get_embedding_recount_queue(db: firestore.Client) -> FirestoreWorkQueue:
+    return FirestoreWorkQueue(db, EMBEDDING_RECOUNT_QUEUE)
+
+
+def _run_embedding_recount_worker(
+    budget_sec: float = EMBEDDING_BACKFILL_WORKER_BUDGET_SEC,
+) -> dict[str, int]:
+    counts = drain_work_queue(
+        _get_embedding_recount_queue(_get_firestore_client()),
+        lambda payload: update_embedding_progress(payload["userId"]),
+        budget_sec=budget_sec,
+    )
+    logger.info(
+        f"Recount worker finished: {counts['completed']} users recounted, "
+        f"{counts['failed']} failed"
+    )
+    return counts
+
+
+def _enqueue_embedding_recounts(db: firestore.Client, run_date: str) -> int:
+    """
+    Put one recount item per user on the recount queue, listing only the user IDs.
+    Item IDs carry run_date, so every run adds new items (which start workers) instead
+    of re-arming the previous run's. Returns the number of items added.
+    """
+    queue = _get_embedding_recount_queue(db)
+    enqueued = 0
+    payloads = {}
+    for user_doc in db.collection("users").select([]).stream():
+        payloads[f"{run_date}-{user_doc.id}"] = {"userId": user_doc.id}
+        if len(payloads) == FIRESTORE_WRITE_CHUNK_SIZE:
+            enqueued += queue.enqueue(payloads)
+            payloads = {}
+    return enqueued + queue.enqueue(payloads)
+
+
+@scheduler_fn.on_schedule(schedule="every 24 hours", timeout_sec=540)
+def recount_embedding_progress(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Daily full recount of every user's embedding progress, correcting any drift in the
+    incremental counters (e.g. from retried trigger deliveries). Each user is one item
+    on the recount queue, recounted by process_embedding_recount_item workers.
+    """
+    enqueued = _enqueue_embedding_recounts(
+        _get_firestore_client(), datetime.now(timezone.utc).strftime("%Y%m%d")
+    )
+    logger.info(f"Queued embedding progress recounts for {enqueued} users")
+
+
+@firestore_fn.on_document_created(
+    document="workQueues/embedding-progress-recount/items/{itemId}",
+    timeout_sec=540,
+)
+def process_embedding_recount_item(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot],
+) -> None:
+    """Embedding progress recount worker started by each enqueued item."""
+    _run_embedding_recount_worker()
+
+
+@https_fn.on_call()
+def get_embedding_progress(req: https_fn.CallableRequest) -> dict:
+    """
+    Return a user's embedding progress (total, completed, failed, pending), summed over
+    the counter shards.
+    """
+    user_id = req.data.get("user_id")
+    if not user_id:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message="The function must be called with a valid 'user_id'.",
+        )
+    return read_embedding_progress(_get_firestore_client(), user_id)
+
+
+def _apply_embedding_status_transition(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]],
+) -> None:
+    """
+    Move the video between its likers' progress counters when a write changes its
+    embedding status bucket (e.g. pending -> complete, failed -> pending).
+    Every status write to /videos fires create_video_embedding, so this sees each
+    transition, whichever function made it. Likers are read as of the transition, so
+    users who like the video afterwards are counted by the sync instead.
+    """
+    before = event.data.before if event.data else None
+    after = event.data.after if event.data else None
+    old_bucket = _embedding_progress_bucket(
+        before.to_dict() if before is not None and before.exists else None
+    )
+    new_bucket = _embedding_progress_bucket(
+        after.to_dict() if after is not None and after.exists else None
+    )
+    if old_bucket == new_bucket:
+        return
+
+    deltas = {}
+    if old_bucket != "pending":
+        deltas[old_bucket] = -1
+    if new_bucket != "pending":
+        deltas[new_bucket] = 1
+    # Embedding snapshots gain the video once it's embedded, and lose it otherwise
+    snapshot_op = None
+    if new_bucket == "completed":
+        snapshot_op = "upsert"
+    elif old_bucket == "completed":
+        snapshot_op = "remove"
+    _update_progress_for_all_users(
+        event.params["videoId"],
+        deltas,
+        snapshot_op,
+        read_time=_progress_read_time(getattr(after, "update_time", None)),
+    )
+
+
 @firestore_fn.on_document_written(document="videos/{videoId}")
 def create_video_embedding(
     event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]],
@@ -991,6 +3186,15 @@ def create_video_embedding(
     Triggered by onWrite on /videos/{videoId} documents.
     """
     video_data = None  # Ensure video_data is always defined
+    try:
+        # Progress counters follow the status change this write made (if any). The
+        # status updates below fire this trigger again and are counted there.
+        _apply_embedding_status_transition(event)
+    except Exception as e:
+        logger.error(
+            f"Failed to update embedding progress for video {event.params['videoId']}: {str(e)}"
+        )
+
     try:
         logger.info(f"Processing embedding for video: {event.params['videoId']}")
 
@@ -1009,6 +3213,13 @@ def create_video_embedding(
             )
             return
 
+        # Skip videos reset by a retry job; the job embeds them in packed batches
+        if "embedding_retry_job_id" in video_data:
+            logger.info(
+                f"Video {event.params['videoId']} is queued in retry job {video_data['embedding_retry_job_id']}, skipping"
+            )
+            return
+
         # Idempotency check: Skip if embedding is already complete
         embedding_status = video_data.get("embedding_status")
         if embedding_status == "complete":
@@ -1034,21 +3245,31 @@ def create_video_embedding(
             _update_embedding_status(
                 event.params["videoId"], "failed", error="No text content"
             )
-            # Update progress for all users who have liked this video
-            _update_progress_for_all_users(event.params["videoId"])
             return
 
         # Combine text fields for embedding
         combined_text = _prepare_embedding_text(title, description, channel_title)
         logger.info(f"Prepared text for embedding (length: {len(combined_text)})")
 
+        # An unchanged text never needs embedding again: the stored vector of the same
+        # text at the current dimensionality is still valid, whatever the status says
+        text_hash = _embedding_text_hash(combined_text)
+        if (
+            video_data.get("embedding_text_hash") == text_hash
+            and video_data.get("embedding_dim") == EMBEDDING_DIMENSIONALITY
+        ):
+            logger.info(
+                f"Video {event.params['videoId']} text is unchanged since its last embedding"
+            )
+            _update_embedding_status(event.params["videoId"], "complete")
+            return
+
         # Update status to processing
         _update_embedding_status(event.params["videoId"], "processing")
 
-        # Initialize OpenAI client once
+        # Reuse the instance-wide OpenAI client (cached key, pooled connections)
         try:
-            api_key = _get_openai_api_key()
-            openai_client = OpenAI(api_key=api_key)
+            openai_client = _get_openai_client()
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI client: {str(e)}")
             _update_embedding_status(
@@ -1056,26 +3277,37 @@ def create_video_embedding(
                 "failed",
                 error=f"OpenAI client initialization failed: {str(e)}",
             )
-            _update_progress_for_all_users(event.params["videoId"])
             return
 
-        # Generate embedding using the pre-initialized client
+        # Generate embedding using the pre-initialized client (or the content cache)
         try:
-            embedding_vector = _generate_embedding(openai_client, combined_text)
+            embedding_vector = _generate_embeddings_batch(
+                openai_client, [(event.params["videoId"], combined_text)]
+            )[event.params["videoId"]]
+            if isinstance(embedding_vector, Exception):
+                raise embedding_vector
+        except EmbeddingRetryableError as e:
+            # Stays "processing" until the backfill queue embeds it
+            _defer_retryable_embeddings(
+                _get_firestore_client(), [event.params["videoId"]], e.retry_after_sec
+            )
+            return
         except Exception as e:
             logger.error(
                 f"Error generating embedding for video {event.params['videoId']}: {str(e)}"
             )
             _update_embedding_status(event.params["videoId"], "failed", error=str(e))
-            _update_progress_for_all_users(event.params["videoId"])
             return
 
         # Update document with embedding and mark as complete
-        db = firestore.Client()
+        db = _get_firestore_client()
         video_ref = db.collection("videos").document(event.params["videoId"])
         video_ref.update(
             {
-                "embedding": embedding_vector,
+                "embedding": encode_embedding(embedding_vector),
+                "embedding_dim": len(embedding_vector),
+                "embedding_text_hash": text_hash,
+                "embedding_token_count": _estimate_token_count(combined_text),
                 "embedding_status": "complete",
                 "embedding_generated_at": datetime.now(timezone.utc),
             }
@@ -1085,269 +3317,425 @@ def create_video_embedding(
             f"Successfully generated embedding for video {event.params['videoId']}"
         )
 
-        # Update progress for all users who have liked this video
-        _update_progress_for_all_users(event.params["videoId"])
-
     except Exception as e:
         logger.error(
             f"Error processing embedding for video {event.params['videoId']}: {str(e)}"
         )
         _update_embedding_status(event.params["videoId"], "failed", error=str(e))
-        _update_progress_for_all_users(event.params["videoId"])
 
 
-def _update_progress_for_all_users(video_id):
-    """For a given video_id, update embedding progress for all users who have liked it."""
-    db = firestore.Client()
-    # Query all users who have liked this video
-    users_ref = db.collection("users")
-    user_docs = users_ref.stream()
-    for user_doc in user_docs:
-        liked_video_ref = (
-            users_ref.document(user_doc.id).collection("likedVideos").document(video_id)
-        )
-        if liked_video_ref.get().exists:
-            update_embedding_progress(user_doc.id)
-
-
-@https_fn.on_request(timeout_sec=300)
-def trigger_video_embeddings(req: https_fn.Request) -> https_fn.Response:
+def _update_progress_for_all_users(
+    video_id,
+    deltas: dict[str, int],
+    snapshot_op: str | None = None,
+    read_time: datetime | None = None,
+):
     """
-    Efficient batch processing function to generate embeddings for videos without valid embeddings.
-    Processes batches of 25 videos per invocation to prevent timeouts.
-    Handles all scenarios: new videos, failed embeddings, or invalid embedding dimensions.
+    For a given video_id, apply counter deltas to the progress of all users who have
+    liked it (as of `read_time`, if given), and queue snapshot_op ("upsert"/"remove")
+    on the embedding snapshots of those who have one.
     """
-    try:
-        # Initialize OpenAI client once at the start to avoid repeated Secret Manager calls
-        try:
-            api_key = _get_openai_api_key()
-            openai_client = OpenAI(api_key=api_key)
-            logger.info("Successfully initialized OpenAI client")
-        except Exception as e:
-            logger.error(f"Failed to initialize OpenAI client: {str(e)}")
-            return https_fn.Response(
-                json.dumps(
-                    {
-                        "success": False,
-                        "error": f"Failed to initialize OpenAI client: {str(e)}",
-                    }
-                ),
-                status=500,
-                headers={"Content-Type": "application/json"},
-            )
+    db = _get_firestore_client()
+    # The likers reverse index lists exactly the users who like this video
+    likers_ref = db.collection("videos").document(video_id).collection("likers")
+    liker_docs = (
+        likers_ref.stream(read_time=read_time) if read_time else likers_ref.stream()
+    )
+    liker_ids = [liker_doc.id for liker_doc in liker_docs]
+    for liker_id in liker_ids:
+        _increment_embedding_progress(db, liker_id, deltas)
+    if snapshot_op and liker_ids:
+        # Users without a snapshot get a full scan on their first load anyway
+        for liker_id in _users_with_embedding_snapshots(db, liker_ids):
+            _record_snapshot_deltas(db, liker_id, {video_id: snapshot_op})
 
-        # Simple security check - require a secret parameter
-        # In production, this should use proper authentication
-        secret = req.args.get("secret")
-        if secret != "zensort-embedding-backfill-2024":
-            return https_fn.Response("Unauthorized", status=401)
 
-        # Get pagination cursor for resuming from previous batch
-        start_after_id = req.args.get("start_after")
-        batch_number = int(req.args.get("batch", "1"))
+def _get_embedding_backfill_queue(db: firestore.Client) -> FirestoreWorkQueue:
+    return FirestoreWorkQueue(db, EMBEDDING_BACKFILL_QUEUE)
 
-        logger.info(f"Starting embedding backfill process - Batch #{batch_number}")
-        if start_after_id:
-            logger.info(f"Resuming from video ID: {start_after_id}")
 
-        db = firestore.Client()
-        videos_collection = db.collection("videos")
+def _backfill_item_id(video_ids: list[str]) -> str:
+    """
+    Work item ID of a backfill chunk, derived from the video IDs it holds, so the same
+    chunk always maps to the same item and a changed chunk to a new one.
+    """
+    return hashlib.sha256("\n".join(video_ids).encode("utf-8")).hexdigest()
 
-        # Build query with cursor support for pagination
-        # Process 25 videos per batch to prevent timeouts (reduced from 50)
-        videos_query = videos_collection.order_by("__name__").limit(25)
 
-        # Resume from where previous batch left off
-        if start_after_id:
-            start_after_doc = videos_collection.document(start_after_id).get()
-            if start_after_doc.exists:
-                videos_query = videos_query.start_after(start_after_doc)
+def _defer_retryable_embeddings(
+    db: firestore.Client, video_ids: list[str], delay_sec: float
+) -> None:
+    """
+    Hand videos whose embedding hit a rate limit or transient API error to the
+    embedding backfill queue, visible once delay_sec has passed, instead of marking
+    them failed.
+    """
+    for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        chunk = video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+        _get_embedding_backfill_queue(db).enqueue(
+            {f"deferred-{time.time_ns()}-{chunk[0]}": {"videoIds": chunk}},
+            delay_sec=delay_sec,
+        )
+    logger.info(f"Requeued {len(video_ids)} videos for embedding in {delay_sec:.0f}s")
 
-        videos_batch = videos_query.get()
 
-        logger.info(f"Retrieved {len(videos_batch)} videos for processing")
+# Fields read for each backfill candidate: everything but the embedding vector itself
+_BACKFILL_CANDIDATE_FIELDS = [
+    "title",
+    "description",
+    "channelTitle",
+    "embedding_status",
+    "embedding_dim",
+    "embedding_text_hash",
+]
 
-        # Collect videos that need embeddings
-        videos_to_process = []
-        video_texts = []
-        skipped_count = 0
-        last_doc_id = None
 
-        for video_doc in videos_batch:
-            last_doc_id = video_doc.id  # Track last processed document for pagination
-            video_data = video_doc.to_dict()
+def _record_legacy_embedding_dims(
+    db: firestore.Client, video_data_by_id: dict[str, dict]
+) -> None:
+    """
+    Completed videos from before 'embedding_dim' existed have their vector read once to
+    check it, and get 'embedding_dim' written back (and set in video_data_by_id) so
+    later reads never need it.
+    """
+    legacy_ids = [
+        video_id
+        for video_id, video_data in video_data_by_id.items()
+        if video_data.get("embedding_status") == "complete"
+        and "embedding_dim" not in video_data
+    ]
+    if not legacy_ids:
+        return
+    firestore_batch = db.batch()
+    legacy_refs = [db.collection("videos").document(vid) for vid in legacy_ids]
+    for video_doc in db.get_all(legacy_refs, field_paths=["embedding"]):
+        embedding = (video_doc.to_dict() or {}).get("embedding")
+        if isinstance(embedding, (list, Vector, bytes)) and embedding:
+            embedding_dim = _embedding_length(embedding)
+            video_data_by_id[video_doc.id]["embedding_dim"] = embedding_dim
+            firestore_batch.update(
+                video_doc.reference, {"embedding_dim": embedding_dim}
+            )
+    firestore_batch.commit()
+    logger.info(f"Recorded embedding_dim for {len(legacy_ids)} legacy videos")
 
-            # Skip if video already has a valid, complete embedding
-            if _has_valid_embedding(video_data):
-                skipped_count += 1
-                continue
 
-            # Extract text fields for embedding
-            title = video_data.get("title", "").strip()
-            description = video_data.get("description", "").strip()
-            channel_title = video_data.get("channelTitle", "").strip()
+def _select_videos_to_embed(
+    video_data_by_id: dict[str, dict],
+) -> tuple[list[tuple[str, str]], int]:
+    """
+    The (video_id, text) pairs of the backfill candidates that need embedding: those
+    without a valid embedding of their current text, and with some text to embed.
+    Returns them with the number of candidates skipped.
+    """
+    items = []
+    skipped = 0
+    for video_id, video_data in video_data_by_id.items():
 
-            if not title and not description and not channel_title:
-                logger.warning(f"No text content found for video {video_doc.id}")
-                skipped_count += 1
-                continue
+        # Extract text fields for embedding
+        title = video_data.get("title", "").strip()
+        description = video_data.get("description", "").strip()
+        channel_title = video_data.get("channelTitle", "").strip()
+        combined_text = _prepare_embedding_text(title, description, channel_title)
 
-            # Combine text fields for embedding
-            combined_text = _prepare_embedding_text(title, description, channel_title)
+        # Skip if video already has a valid, complete embedding of its current text
+        # (embeddings from before text hashes were stored are assumed current)
+        stored_hash = video_data.get("embedding_text_hash")
+        if _has_valid_embedding(video_data) and stored_hash in (
+            None,
+            _embedding_text_hash(combined_text),
+        ):
+            skipped += 1
+            continue
 
-            videos_to_process.append(
-                {
-                    "id": video_doc.id,
-                    "reference": video_doc.reference,
-                    "text": combined_text,
-                }
-            )
-            video_texts.append(combined_text)
+        if not title and not description and not channel_title:
+            logger.warning(f"No text content found for video {video_id}")
+            skipped += 1
+            continue
 
-        processed_count = len(videos_to_process)
-        failed_count = 0
+        items.append((video_id, combined_text))
+    return items, skipped
+
+
+def _backfill_success_fields(vector, text: str, timestamp: datetime) -> dict:
+    return {
+        "embedding": encode_embedding(vector),
+        "embedding_dim": len(vector),
+        "embedding_text_hash": _embedding_text_hash(text),
+        "embedding_token_count": _estimate_token_count(text),
+        "embedding_status": "complete",
+        "embedding_generated_at": timestamp,
+        "backfill_completed_at": timestamp,
+        # Set when a retry job deferred the video to this queue
+        "embedding_retry_job_id": firestore.DELETE_FIELD,
+        "embedding_retry_marked_at": firestore.DELETE_FIELD,
+    }
+
+
+def _backfill_failure_fields(error: Exception, timestamp: datetime) -> dict:
+    return {
+        "embedding_status": "failed",
+        "embedding_error": str(error),
+        "embedding_updated_at": timestamp,
+        "backfill_completed_at": timestamp,
+        "embedding_retry_job_id": firestore.DELETE_FIELD,
+        "embedding_retry_marked_at": firestore.DELETE_FIELD,
+    }
+
+
+class AsyncEmbeddingBackfill:
+    """
+    Embedding backfill handler on AsyncOpenAI and Firestore's AsyncClient, so one event
+    loop can run many work items at once. Embedding requests take slots from an AIMD
+    limiter (by default the instance-wide _openai_async_concurrency), which waits out
+    any Retry-After and adapts to 429s, 5xx and latency; each request's results are written
+    in async batches as soon as it returns, so vectors don't pile up in memory. Vectors
+    are requested base64-encoded and decoded straight into float32 arrays instead of
+    lists of Python floats.
+    Create it inside the event loop that runs it.
+    """
 
-        if processed_count == 0:
-            logger.info("No videos need embedding processing in this batch")
-            result_message = f"Batch #{batch_number}: No videos needed processing, skipped {skipped_count} already processed"
-        else:
-            logger.info(f"Processing embeddings for {processed_count} videos")
+    def __init__(
+        self,
+        openai_client: AsyncOpenAI,
+        db: firestore.AsyncClient,
+        limiter: _AsyncAdaptiveConcurrencyLimiter | None = None,
+        max_in_flight_writes: int = EMBEDDING_ASYNC_MAX_IN_FLIGHT_WRITES,
+    ):
+        self.openai_client = openai_client
+        self.db = db
+        self.limiter = limiter or _openai_async_concurrency
+        self._writes = asyncio.Semaphore(max_in_flight_writes)
+
+    async def backfill(self, video_ids: list[str]) -> dict[str, int]:
+        """
+        Handler for one work item: embed the listed videos that lack a valid embedding
+        and write the results. Raises if a request fails outright, so the item is
+        retried, and defers the item if any of its videos were rate limited; videos
+        already written are skipped on redelivery.
+        """
+        video_data_by_id = await self._read_candidates(video_ids)
+        items, skipped = _select_videos_to_embed(video_data_by_id)
+        counts = {"processed": 0, "failed": 0, "skipped": skipped}
+        rate_limited = []
+        if not items:
+            return counts
+
+        # Identical texts are embedded (and looked up in the content cache) once
+        video_ids_by_hash = {}
+        texts_by_hash = {}
+        for video_id, text in items:
+            text_hash = _embedding_text_hash(text)
+            video_ids_by_hash.setdefault(text_hash, []).append(video_id)
+            texts_by_hash[text_hash] = text
+        cached = await asyncio.to_thread(
+            _embedding_content_cache.get_many, set(texts_by_hash)
+        )
+        batches = _pack_embedding_batches(
+            [(h, text) for h, text in texts_by_hash.items() if h not in cached]
+        )
 
-            try:
-                # Process embeddings concurrently using ThreadPoolExecutor
-                logger.info(
-                    f"Processing embeddings for {len(videos_to_process)} videos concurrently"
+        async def embed_and_write(batch):
+            results = {}
+            await self._embed_batch(batch, results)
+            for text_hash, _ in batch:
+                results.setdefault(
+                    text_hash, ValueError("Embedding missing from API response")
                 )
-                firestore_batch = db.batch()
-                batch_timestamp = datetime.now(timezone.utc)
-                successful_embeddings = 0
-                failed_count = 0
-
-                # Use ThreadPoolExecutor to process embeddings in parallel
-                with ThreadPoolExecutor(max_workers=10) as executor:
-                    # Submit all embedding generation tasks
-                    future_to_video = {
-                        executor.submit(
-                            _generate_embedding, openai_client, video["text"]
-                        ): video
-                        for video in videos_to_process
-                    }
+            await asyncio.to_thread(
+                _embedding_content_cache.put_many,
+                {h: v for h, v in results.items() if not isinstance(v, Exception)},
+            )
+            await self._write_results(
+                results, video_ids_by_hash, texts_by_hash, counts, rate_limited
+            )
 
-                    logger.info(
-                        f"Submitted {len(future_to_video)} embedding tasks to thread pool"
+        outcomes = await asyncio.gather(
+            self._write_results(
+                cached, video_ids_by_hash, texts_by_hash, counts, rate_limited
+            ),
+            *(embed_and_write(batch) for batch in batches),
+            return_exceptions=True,
+        )
+        logger.info(
+            f"Backfilled {counts['processed']} embeddings, {counts['failed']} failed, "
+            f"{counts['skipped']} skipped, {len(rate_limited)} rate limited "
+            f"({len(cached)} cached texts, {len(batches)} requests)"
+        )
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if errors:
+            raise errors[0]
+        if rate_limited:
+            raise WorkItemDeferred(
+                max(error.retry_after_sec for error in rate_limited),
+                f"{len(rate_limited)} embeddings were rate limited",
+            )
+        return counts
+
+    async def _read_candidates(self, video_ids: list[str]) -> dict[str, dict]:
+        video_refs = [self.db.collection("videos").document(vid) for vid in video_ids]
+        video_data_by_id = {
+            video_doc.id: video_doc.to_dict()
+            async for video_doc in self.db.get_all(
+                video_refs, field_paths=_BACKFILL_CANDIDATE_FIELDS
+            )
+            if video_doc.exists
+        }
+        # Rare (pre-migration documents); done with the blocking client
+        await asyncio.to_thread(
+            _record_legacy_embedding_dims, _get_firestore_client(), video_data_by_id
+        )
+        return video_data_by_id
+
+    async def _embed_batch(self, batch: list[tuple[str, str]], results: dict) -> None:
+        """
+        Embed one packed batch, storing each vector (or a per-input error) in `results`.
+        Like _embed_packed_batch, a 400 is bisected, a 429 yields
+        EmbeddingRateLimitedError and a 5xx or connection error yields
+        EmbeddingRetryableError; any other error propagates.
+        """
+        try:
+            async with self.limiter.slot() as started_at:
+                try:
+                    response = await self.openai_client.embeddings.create(
+                        model=EMBEDDING_MODEL,
+                        input=[text for _, text in batch],
+                        dimensions=EMBEDDING_DIMENSIONALITY,
+                        encoding_format="base64",
+                    )
+                except RateLimitError as e:
+                    await self.limiter.record_failure(
+                        started_at,
+                        _retry_after_sec(e) or OPENAI_DEFAULT_RETRY_AFTER_SEC,
+                    )
+                    raise
+                except (InternalServerError, APIConnectionError):
+                    await self.limiter.record_failure(started_at)
+                    raise
+                await self.limiter.record_success(started_at)
+            for data in response.data:
+                vector = np.frombuffer(base64.b64decode(data.embedding), dtype="<f4")
+                if len(vector) != EMBEDDING_DIMENSIONALITY:
+                    logger.warning(
+                        f"Expected {EMBEDDING_DIMENSIONALITY} dimensions, got {len(vector)}"
                     )
+                results[batch[data.index][0]] = vector
 
-                    # Process results as they complete
-                    for future in as_completed(future_to_video):
-                        video_info = future_to_video[future]
-                        try:
-                            # Get the embedding result
-                            embedding_vector = future.result()
-
-                            # Update Firestore batch with successful result
-                            firestore_batch.update(
-                                video_info["reference"],
-                                {
-                                    "embedding": embedding_vector,
-                                    "embedding_status": "complete",
-                                    "embedding_generated_at": batch_timestamp,
-                                    "backfill_completed_at": batch_timestamp,
-                                },
-                            )
-                            successful_embeddings += 1
-                            logger.debug(
-                                f"Successfully generated embedding for video {video_info['id']}"
-                            )
-
-                        except Exception as e:
-                            logger.error(
-                                f"Failed to generate embedding for video {video_info['id']}: {str(e)}"
-                            )
-                            # Mark video as failed in Firestore batch
-                            firestore_batch.update(
-                                video_info["reference"],
-                                {
-                                    "embedding_status": "failed",
-                                    "embedding_error": str(e),
-                                    "embedding_updated_at": batch_timestamp,
-                                    "backfill_completed_at": batch_timestamp,
-                                },
-                            )
-                            failed_count += 1
-
-                # Commit all updates in a single batch after all futures complete
-                firestore_batch.commit()
-                logger.info(
-                    f"Successfully processed {successful_embeddings} videos with embeddings, {failed_count} failed"
+        except RateLimitError as e:
+            retry_after = _retry_after_sec(e) or OPENAI_DEFAULT_RETRY_AFTER_SEC
+            for key, _ in batch:
+                results[key] = EmbeddingRateLimitedError(
+                    f"Rate limited: {e}", retry_after
                 )
 
-                processed_count = successful_embeddings
-                result_message = f"Batch #{batch_number}: Successfully processed {processed_count} videos, skipped {skipped_count} already processed"
-                if failed_count > 0:
-                    result_message += f", {failed_count} failed"
-
-            except Exception as e:
-                logger.error(f"Error in batch embedding processing: {str(e)}")
-                failed_count = len(videos_to_process)
-                processed_count = 0
-                result_message = f"Batch #{batch_number}: Failed to process {failed_count} videos - {str(e)}"
-
-        # Check if we need to continue processing more videos (adjusted for new batch size)
-        has_more_videos = (
-            len(videos_batch) == 25
-        )  # If we got a full batch, more likely exist
-
-        if failed_count > 0:
-            result_message += f", {failed_count} failed"
-
-        logger.info(result_message)
-
-        # Auto-continuation: If we processed a full batch, trigger next batch
-        if has_more_videos and last_doc_id:
-            next_batch_number = batch_number + 1
-            continuation_url = f"https://us-central1-zensort-dev.cloudfunctions.net/trigger_video_embeddings?secret={secret}&start_after={last_doc_id}&batch={next_batch_number}"
+        except (InternalServerError, APIConnectionError) as e:
+            logger.warning(f"Transient OpenAI error, deferring batch: {e}")
+            for key, _ in batch:
+                results[key] = EmbeddingRetryableError(
+                    f"Transient OpenAI error: {e}", OPENAI_TRANSIENT_RETRY_AFTER_SEC
+                )
 
-            logger.info(
-                f"Full batch processed. Triggering continuation batch #{next_batch_number}"
+        except BadRequestError as e:
+            if len(batch) == 1:
+                logger.error(f"OpenAI rejected embedding input: {e}")
+                results[batch[0][0]] = ValueError(f"Embedding generation failed: {e}")
+                return
+            middle = len(batch) // 2
+            await asyncio.gather(
+                self._embed_batch(batch[:middle], results),
+                self._embed_batch(batch[middle:], results),
             )
 
-            # Trigger next batch asynchronously
-            try:
-                import threading
-
-                def trigger_next_batch():
-                    time.sleep(2)  # Brief delay to avoid overwhelming
-                    response = requests.get(continuation_url, timeout=10)
-                    logger.info(
-                        f"Triggered batch #{next_batch_number}: {response.status_code}"
+        except AuthenticationError:
+            # The key may have been rotated; fetch it again for the next worker
+            _openai_api_key_cache.invalidate()
+            raise
+
+    async def _write_results(
+        self,
+        results: dict,
+        video_ids_by_hash: dict[str, list[str]],
+        texts_by_hash: dict[str, str],
+        counts: dict[str, int],
+        rate_limited: list,
+    ) -> None:
+        """Write the videos of finished texts in async batches of up to FIRESTORE_WRITE_CHUNK_SIZE."""
+        timestamp = datetime.now(timezone.utc)
+        updates = []
+        for text_hash, result in results.items():
+            video_ids = video_ids_by_hash.get(text_hash, [])
+            if isinstance(result, EmbeddingRetryableError):
+                # Left as is; the deferred item embeds them on redelivery
+                rate_limited.extend([result] * len(video_ids))
+                continue
+            for video_id in video_ids:
+                if isinstance(result, Exception):
+                    fields = _backfill_failure_fields(result, timestamp)
+                    counts["failed"] += 1
+                else:
+                    fields = _backfill_success_fields(
+                        result, texts_by_hash[text_hash], timestamp
                     )
+                    counts["processed"] += 1
+                updates.append((video_id, fields))
 
-                # Start continuation in background thread
-                thread = threading.Thread(target=trigger_next_batch)
-                thread.daemon = True
-                thread.start()
+        for start in range(0, len(updates), FIRESTORE_WRITE_CHUNK_SIZE):
+            batch = self.db.batch()
+            for video_id, fields in updates[start : start + FIRESTORE_WRITE_CHUNK_SIZE]:
+                batch.update(self.db.collection("videos").document(video_id), fields)
+            async with self._writes:
+                await batch.commit()
 
-                result_message += f" | Triggered batch #{next_batch_number}"
 
-            except Exception as e:
-                logger.error(f"Failed to trigger continuation: {e}")
-                result_message += f" | Manual continuation needed: {continuation_url}"
+@https_fn.on_request(timeout_sec=300)
+def trigger_video_embeddings(req: https_fn.Request) -> https_fn.Response:
+    """
+    Producer for the embedding backfill. Lists /videos (names only) and enqueues one work
+    item per EMBEDDING_BACKFILL_BATCH_SIZE video IDs on the durable embedding-backfill
+    queue. Creating the items starts process_embedding_backfill_item workers, which lease
+    items in parallel; sweep_embedding_backfill_queue picks up retries and expired leases.
+    Items are keyed by the content of their chunk (_backfill_item_id). Re-running leaves
+    chunks that are still pending alone and re-arms finished ones; when new videos shift
+    the chunk boundaries, the shifted chunks become new items, so every video is in a
+    live item (videos already embedded are skipped by the workers). Handles all scenarios: new videos, failed embeddings, or invalid embedding dimensions.
+    """
+    try:
+        # Simple security check - require a secret parameter
+        # In production, this should use proper authentication
+        secret = req.args.get("secret")
+        if secret != "zensort-embedding-backfill-2024":
+            return https_fn.Response("Unauthorized", status=401)
+
+        db = _get_firestore_client()
+        queue = _get_embedding_backfill_queue(db)
+
+        logger.info("Enqueuing embedding backfill work items")
+        video_ids = [
+            doc.id
+            for doc in db.collection("videos").select([]).order_by("__name__").stream()
+        ]
+        chunks = [
+            video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+            for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE)
+        ]
+        payloads = {_backfill_item_id(chunk): {"videoIds": chunk} for chunk in chunks}
+        enqueued = queue.enqueue(payloads)
 
-        elif not has_more_videos:
-            logger.info("Embedding backfill completed - no more videos to process")
-            result_message += " | Backfill completed"
+        result_message = (
+            f"Enqueued {enqueued} work items for {len(video_ids)} videos "
+            f"({len(payloads) - enqueued} already queued)"
+        )
+        logger.info(result_message)
 
         return https_fn.Response(
             json.dumps(
                 {
                     "success": True,
                     "message": result_message,
-                    "batch_number": batch_number,
-                    "processed_count": processed_count,
-                    "skipped_count": skipped_count,
-                    "failed_count": failed_count,
-                    "has_more_videos": has_more_videos,
-                    "last_doc_id": last_doc_id,
+                    "queue": EMBEDDING_BACKFILL_QUEUE,
+                    "video_count": len(video_ids),
+                    "enqueued_items": enqueued,
+                    "queue_stats": queue.stats(),
                 }
             ),
             status=200,
@@ -1363,73 +3751,731 @@ def trigger_video_embeddings(req: https_fn.Request) -> https_fn.Response:
         )
 
 
-def _is_new_video_creation(
-    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]],
-) -> bool:
-    """Check if this is a new video creation by examining the before/after snapshots."""
-    # If there's no before data, this is a new document creation
-    return event.data.before is None or not event.data.before.exists
+class _BackgroundEventLoop:
+    """
+    One long-lived event loop per instance, run on a daemon thread and started on first
+    use. Async clients (and the async limiter) are bound to the loop they first run on,
+    so keeping a single loop lets them and their connections outlive an invocation
+    instead of being rebuilt by every asyncio.run().
+    """
 
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
 
-def _prepare_embedding_text(title: str, description: str, channel_title: str) -> str:
-    """Combine video fields into embedding-optimized text."""
-    # Create structured text for better embedding quality
-    # Let the API handle truncation automatically (no manual truncation)
-    parts = []
-    if title:
-        parts.append(f"Title: {title}")
-    if channel_title:
-        parts.append(f"Channel: {channel_title}")
-    if description:
-        parts.append(f"Description: {description}")
+    def run(self, coro):
+        """Run `coro` on the background loop and block until it finishes."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="background-event-loop",
+                    daemon=True,
+                ).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
 
-    return " | ".join(parts)
 
+_background_loop = _BackgroundEventLoop()
 
-def _generate_embedding(client: OpenAI, text: str) -> list:
-    """Generate embedding vector using OpenAI's text-embedding-3-small model."""
+# Only touched from _background_loop. The lock serializes client rebuilds across the
+# coroutines on that loop; the use counts tell when a replaced client can be closed.
+_async_openai_client = None
+_async_openai_client_key = None
+_async_openai_client_lock = asyncio.Lock()
+_async_openai_client_uses: dict[int, int] = {}
+_async_firestore_client = None
+
+
+@asynccontextmanager
+async def _async_openai_client_in_use() -> AsyncIterator[AsyncOpenAI]:
+    """
+    Hold the instance-wide AsyncOpenAI client for the duration of the block. The client
+    is rebuilt when the cached API key changes; the one it replaces is closed once the
+    last block still using it exits, never under an in-flight request. Use it on
+    _background_loop.
+    """
+    global _async_openai_client, _async_openai_client_key
+    api_key = await asyncio.to_thread(_get_openai_api_key)
+    async with _async_openai_client_lock:
+        if _async_openai_client is None or _async_openai_client_key != api_key:
+            previous = _async_openai_client
+            # 429s go to the limiter's Retry-After pause and the item's deferral
+            # instead of the client's own blind retries
+            _async_openai_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+            _async_openai_client_key = api_key
+            if previous is not None and not _async_openai_client_uses.get(id(previous)):
+                await previous.close()
+        client = _async_openai_client
+        _async_openai_client_uses[id(client)] = (
+            _async_openai_client_uses.get(id(client), 0) + 1
+        )
     try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small", input=[text]
+        yield client
+    finally:
+        async with _async_openai_client_lock:
+            _async_openai_client_uses[id(client)] -= 1
+            idle = not _async_openai_client_uses[id(client)]
+            if idle:
+                del _async_openai_client_uses[id(client)]
+        if idle and client is not _async_openai_client:
+            await client.close()
+
+
+def _get_async_firestore_client() -> firestore.AsyncClient:
+    """Return the instance-wide Firestore AsyncClient. Call it on _background_loop."""
+    global _async_firestore_client
+    if _async_firestore_client is None:
+        _async_firestore_client = firestore.AsyncClient()
+    return _async_firestore_client
+
+
+async def _drain_embedding_backfill_queue(budget_sec: float) -> dict[str, int]:
+    """Run up to EMBEDDING_ASYNC_CONCURRENT_ITEMS backfill items at once on _background_loop."""
+    queue = _get_embedding_backfill_queue(_get_firestore_client())
+    async with _async_openai_client_in_use() as openai_client:
+        engine = AsyncEmbeddingBackfill(openai_client, _get_async_firestore_client())
+        return await drain_work_queue_async(
+            queue,
+            lambda payload: engine.backfill(payload["videoIds"]),
+            budget_sec=budget_sec,
+            concurrency=EMBEDDING_ASYNC_CONCURRENT_ITEMS,
         )
-        embedding_vector = response.data[0].embedding
-        if len(embedding_vector) != EMBEDDING_DIMENSIONALITY:
-            logger.warning(
-                f"Expected {EMBEDDING_DIMENSIONALITY} dimensions, got {len(embedding_vector)}"
-            )
-        return embedding_vector
-    except Exception as e:
-        logger.error(f"Error generating embedding with OpenAI: {e}")
-        raise ValueError(f"Embedding generation failed: {e}")
 
 
-def _has_valid_embedding(video_data: dict) -> bool:
-    """
-    Check if a video document has a complete, valid embedding vector.
+def _run_embedding_backfill_worker(
+    budget_sec: float = EMBEDDING_BACKFILL_WORKER_BUDGET_SEC,
+) -> dict[str, int]:
+    counts = _background_loop.run(_drain_embedding_backfill_queue(budget_sec))
+    logger.info(
+        f"Backfill worker finished: {counts['completed']} items completed, "
+        f"{counts['failed']} failed, {counts['deferred']} deferred"
+    )
+    return counts
 
-    Returns True only if:
-    - 'embedding' field exists
+
+def _migrate_video_embeddings(video_ids: list[str]) -> int:
+    """
+    Migration handler for one work item: rewrite the listed videos' embeddings in
+    EMBEDDING_STORAGE_FORMAT (recording embedding_dim) if stored any other way.
+    Returns the number of documents rewritten.
+    """
+    db = _get_firestore_client()
+    target_type = bytes if EMBEDDING_STORAGE_FORMAT == "float32" else Vector
+    video_refs = [db.collection("videos").document(vid) for vid in video_ids]
+
+    firestore_batch = db.batch()
+    migrated = 0
+    for video_doc in db.get_all(video_refs, field_paths=["embedding"]):
+        if not video_doc.exists:
+            continue
+        embedding = (video_doc.to_dict() or {}).get("embedding")
+        if not embedding or isinstance(embedding, target_type):
+            continue
+        values = decode_embedding(embedding)
+        # The status is unchanged (complete), so create_video_embedding ignores this write
+        firestore_batch.update(
+            video_doc.reference,
+            {"embedding": encode_embedding(values), "embedding_dim": len(values)},
+        )
+        migrated += 1
+    if migrated:
+        firestore_batch.commit()
+    logger.info(
+        f"Migrated {migrated} of {len(video_ids)} embeddings to {EMBEDDING_STORAGE_FORMAT}"
+    )
+    return migrated
+
+
+def _run_embedding_migration_worker(
+    budget_sec: float = EMBEDDING_BACKFILL_WORKER_BUDGET_SEC,
+) -> dict[str, int]:
+    queue = FirestoreWorkQueue(_get_firestore_client(), EMBEDDING_MIGRATION_QUEUE)
+    counts = drain_work_queue(
+        queue,
+        lambda payload: _migrate_video_embeddings(payload["videoIds"]),
+        budget_sec=budget_sec,
+    )
+    logger.info(
+        f"Migration worker finished: {counts['completed']} items completed, "
+        f"{counts['failed']} failed"
+    )
+    return counts
+
+
+@https_fn.on_request(timeout_sec=300)
+def migrate_embedding_storage(req: https_fn.Request) -> https_fn.Response:
+    """
+    Producer for the embedding storage migration. Enqueues one work item per
+    EMBEDDING_BACKFILL_BATCH_SIZE videos on the embedding-migration queue; workers
+    rewrite list-of-doubles (or other-format) embeddings in EMBEDDING_STORAGE_FORMAT.
+    """
+    try:
+        # Same shared secret as the embedding backfill trigger
+        secret = req.args.get("secret")
+        if secret != "zensort-embedding-backfill-2024":
+            return https_fn.Response("Unauthorized", status=401)
+
+        db = _get_firestore_client()
+        queue = FirestoreWorkQueue(db, EMBEDDING_MIGRATION_QUEUE)
+        video_ids = [
+            doc.id
+            for doc in db.collection("videos").select([]).order_by("__name__").stream()
+        ]
+        enqueued = queue.enqueue(
+            {
+                video_ids[start]: {
+                    "videoIds": video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+                }
+                for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE)
+            }
+        )
+        logger.info(f"Enqueued {enqueued} embedding migration work items")
+
+        return https_fn.Response(
+            json.dumps(
+                {
+                    "success": True,
+                    "queue": EMBEDDING_MIGRATION_QUEUE,
+                    "storage_format": EMBEDDING_STORAGE_FORMAT,
+                    "video_count": len(video_ids),
+                    "enqueued_items": enqueued,
+                    "queue_stats": queue.stats(),
+                }
+            ),
+            status=200,
+            headers={"Content-Type": "application/json"},
+        )
+
+    except Exception as e:
+        logger.error(f"Error in embedding migration: {str(e)}")
+        return https_fn.Response(
+            json.dumps({"success": False, "error": str(e)}),
+            status=500,
+            headers={"Content-Type": "application/json"},
+        )
+
+
+@firestore_fn.on_document_created(
+    document="workQueues/embedding-migration/items/{itemId}", timeout_sec=540
+)
+def process_embedding_migration_item(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot],
+) -> None:
+    """Embedding migration worker started by each enqueued item."""
+    _run_embedding_migration_worker()
+
+
+@firestore_fn.on_document_created(
+    document="workQueues/embedding-backfill/items/{itemId}", timeout_sec=540
+)
+def process_embedding_backfill_item(
+    event: firestore_fn.Event[firestore_fn.DocumentSnapshot],
+) -> None:
+    """
+    Backfill worker started by each enqueued item. It leases whatever items are visible
+    (not necessarily the one that started it) until the queue is empty or its budget is spent.
+    """
+    _run_embedding_backfill_worker()
+
+
+@scheduler_fn.on_schedule(schedule="every 5 minutes", timeout_sec=540)
+def sweep_embedding_backfill_queue(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Backfill, migration and recount worker for items due for retry or whose lease
+    expired.
+    """
+    # Split the budget so every queue gets swept within one function timeout
+    _run_embedding_backfill_worker(EMBEDDING_BACKFILL_WORKER_BUDGET_SEC / 3)
+    _run_embedding_migration_worker(EMBEDDING_BACKFILL_WORKER_BUDGET_SEC / 3)
+    _run_embedding_recount_worker(EMBEDDING_BACKFILL_WORKER_BUDGET_SEC / 3)
+
+
+def _is_new_video_creation(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]],
+) -> bool:
+    """Check if this is a new video creation by examining the before/after snapshots."""
+    # If there's no before data, this is a new document creation
+    return event.data.before is None or not event.data.before.exists
+
+
+# Description boilerplate: links, chapter timestamps at the start of a line, hashtags,
+# and lines that only promote sponsors, merch or the channel's socials
+_URL_PATTERN = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+_CHAPTER_TIMESTAMP_PATTERN = re.compile(
+    r"^[\s(\[]*(?:\d{1,2}:)?\d{1,2}:\d{2}[)\]]?\s*[-–—:|]?\s*"
+)
+_HASHTAG_PATTERN = re.compile(r"#(\w+)")
+_PROMOTION_LINE_PATTERN = re.compile(
+    r"\b(?:sponsor(?:ed)?|promo code|use code|discount code|affiliate|patreon|merch"
+    r"|subscribe|follow (?:me|us)|business inquiries)\b",
+    re.IGNORECASE,
+)
+
+# Pieces a BPE tokenizer rarely merges across: letter runs, digit groups (split in
+# threes, as cl100k does) and single other characters
+_TOKEN_PIECE_PATTERN = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_")
+
+
+def _clean_description(description: str) -> str:
+    """
+    Strip boilerplate from a YouTube description: promotion lines, links (and lines
+    that were little more than a link), chapter timestamps (the chapter titles stay),
+    repeated hashtags (the first use stays, without '#') and repeated lines.
+    """
+    seen_lines = set()
+    seen_hashtags = set()
+
+    def first_hashtag_use(match):
+        key = match.group(1).lower()
+        if key in seen_hashtags:
+            return ""
+        seen_hashtags.add(key)
+        return match.group(1)
+
+    lines = []
+    for line in description.splitlines():
+        if _PROMOTION_LINE_PATTERN.search(line):
+            continue
+        line, link_count = _URL_PATTERN.subn("", line)
+        line = _CHAPTER_TIMESTAMP_PATTERN.sub("", line)
+        if not any(c.isalnum() for c in line):
+            continue
+        if link_count and len(line.split()) <= 3:
+            # "Instagram: <link>" and the like
+            continue
+        line_key = " ".join(_HASHTAG_PATTERN.sub(r"\1", line).lower().split())
+        if line_key in seen_lines:
+            continue
+        seen_lines.add(line_key)
+        line = " ".join(_HASHTAG_PATTERN.sub(first_hashtag_use, line).split())
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def _prepare_embedding_text(
+    title: str,
+    description: str,
+    channel_title: str,
+    token_budget: int = EMBEDDING_TEXT_TOKEN_BUDGET,
+) -> str:
+    """
+    Combine video fields into embedding-optimized text. The description is cleaned of
+    boilerplate and the result is capped at token_budget estimated tokens; the
+    description comes last, so it's what gets cut.
+    """
+    # Create structured text for better embedding quality
+    parts = []
+    if title:
+        parts.append(f"Title: {title}")
+    if channel_title:
+        parts.append(f"Channel: {channel_title}")
+    description = _clean_description(description) if description else ""
+    if description:
+        parts.append(f"Description: {description}")
+
+    return _truncate_to_token_budget(" | ".join(parts), token_budget)
+
+
+def _generate_embedding(client: OpenAI, text: str) -> list:
+    """Generate embedding vector using OpenAI's text-embedding-3-small model."""
+    try:
+        response = _create_embeddings(client, [text])
+        embedding_vector = response.data[0].embedding
+        if len(embedding_vector) != EMBEDDING_DIMENSIONALITY:
+            logger.warning(
+                f"Expected {EMBEDDING_DIMENSIONALITY} dimensions, got {len(embedding_vector)}"
+            )
+        return embedding_vector
+    except Exception as e:
+        logger.error(f"Error generating embedding with OpenAI: {e}")
+        if isinstance(e, AuthenticationError):
+            # The key may have been rotated; fetch it again on the next call
+            _openai_api_key_cache.invalidate()
+        raise ValueError(f"Embedding generation failed: {e}")
+
+
+def _piece_token_count(piece: str) -> int:
+    if piece.isalpha():
+        # ASCII words average well over 6 characters per token; other scripts are
+        # closer to one token per character
+        return (len(piece) + 5) // 6 if piece.isascii() else len(piece)
+    return 1
+
+
+def _estimate_token_count(text: str) -> int:
+    """
+    Fast local token estimate (no tokenizer download) used for input budgets, request
+    packing and the per-video embedding_token_count. Errs high for English text.
+    """
+    return max(
+        1,
+        sum(
+            _piece_token_count(match.group())
+            for match in _TOKEN_PIECE_PATTERN.finditer(text)
+        ),
+    )
+
+
+def _truncate_to_token_budget(text: str, token_budget: int) -> str:
+    """Cut text at the last piece boundary that keeps it within token_budget."""
+    tokens = 0
+    for match in _TOKEN_PIECE_PATTERN.finditer(text):
+        tokens += _piece_token_count(match.group())
+        if tokens > token_budget:
+            return text[: match.start()].rstrip()
+    return text
+
+
+def _pack_embedding_batches(
+    items: list[tuple[str, str]],
+    max_items: int = EMBEDDING_BATCH_MAX_ITEMS,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+) -> list[list[tuple[str, str]]]:
+    """
+    Greedily pack (video_id, text) pairs into request-sized batches that stay within
+    both the item budget and the estimated token budget.
+    """
+    batches = []
+    current_batch = []
+    current_tokens = 0
+
+    for video_id, text in items:
+        tokens = min(_estimate_token_count(text), EMBEDDING_MAX_INPUT_TOKENS)
+        if current_batch and (
+            len(current_batch) >= max_items or current_tokens + tokens > max_tokens
+        ):
+            batches.append(current_batch)
+            current_batch = []
+            current_tokens = 0
+        current_batch.append((video_id, text))
+        current_tokens += tokens
+
+    if current_batch:
+        batches.append(current_batch)
+    return batches
+
+
+class EmbeddingRetryableError(ValueError):
+    """
+    An embedding that failed for a transient reason (5xx, connection error) and should
+    be requeued to run after retry_after_sec rather than marked failed.
+    """
+
+    def __init__(self, message: str, retry_after_sec: float):
+        self.retry_after_sec = retry_after_sec
+        super().__init__(message)
+
+
+class EmbeddingRateLimitedError(EmbeddingRetryableError):
+    """An embedding the API declined because of rate limits; retry after retry_after_sec."""
+
+
+def _retry_after_sec(error: Exception) -> float | None:
+    """The Retry-After (or retry-after-ms) an OpenAI error response asked for, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _create_embeddings(client: OpenAI, inputs: list[str]):
+    """
+    One embeddings request within the adaptive concurrency limit, reporting its outcome
+    (latency, 429s with their Retry-After, server errors) back to the limiter.
+    """
+    with _openai_concurrency.slot() as started_at:
+        try:
+            response = client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=inputs,
+                dimensions=EMBEDDING_DIMENSIONALITY,
+            )
+        except RateLimitError as e:
+            _openai_concurrency.record_failure(
+                started_at, _retry_after_sec(e) or OPENAI_DEFAULT_RETRY_AFTER_SEC
+            )
+            raise
+        except (InternalServerError, APIConnectionError):
+            _openai_concurrency.record_failure(started_at)
+            raise
+        _openai_concurrency.record_success(started_at)
+        return response
+
+
+def _embed_packed_batch(
+    client: OpenAI, batch: list[tuple[str, str]], results: dict
+) -> None:
+    """
+    Embed one packed batch with a single multi-input request, storing each vector (or the
+    exception for that input) in `results` keyed by video ID.
+    A rejected request (400) is bisected so that a bad input only fails itself; a
+    rate-limited one stores EmbeddingRateLimitedError, and a 5xx or connection error
+    EmbeddingRetryableError, so callers can requeue it.
+    """
+    try:
+        response = _create_embeddings(client, [text for _, text in batch])
+        for data in response.data:
+            video_id = batch[data.index][0]
+            if len(data.embedding) != EMBEDDING_DIMENSIONALITY:
+                logger.warning(
+                    f"Expected {EMBEDDING_DIMENSIONALITY} dimensions for video {video_id}, got {len(data.embedding)}"
+                )
+            results[video_id] = data.embedding
+
+    except RateLimitError as e:
+        retry_after = _retry_after_sec(e) or OPENAI_DEFAULT_RETRY_AFTER_SEC
+        logger.warning(
+            f"Embedding batch of {len(batch)} rate limited; retry after {retry_after:.0f}s"
+        )
+        for video_id, _ in batch:
+            results[video_id] = EmbeddingRateLimitedError(
+                f"Rate limited: {e}", retry_after
+            )
+
+    except (InternalServerError, APIConnectionError) as e:
+        # The client's own retries are off, so these are requeued instead
+        logger.warning(
+            f"Embedding batch of {len(batch)} hit a transient API error; retry after "
+            f"{OPENAI_TRANSIENT_RETRY_AFTER_SEC:.0f}s: {e}"
+        )
+        for video_id, _ in batch:
+            results[video_id] = EmbeddingRetryableError(
+                f"Transient API error: {e}", OPENAI_TRANSIENT_RETRY_AFTER_SEC
+            )
+
+    except BadRequestError as e:
+        if len(batch) == 1:
+            logger.error(f"OpenAI rejected input for video {batch[0][0]}: {e}")
+            results[batch[0][0]] = ValueError(f"Embedding generation failed: {e}")
+            return
+        # Isolate the offending input(s) by splitting the batch
+        middle = len(batch) // 2
+        _embed_packed_batch(client, batch[:middle], results)
+        _embed_packed_batch(client, batch[middle:], results)
+
+    except Exception as e:
+        logger.error(f"Error generating embeddings for batch of {len(batch)}: {e}")
+        if isinstance(e, AuthenticationError):
+            _openai_api_key_cache.invalidate()
+        for video_id, _ in batch:
+            results[video_id] = ValueError(f"Embedding generation failed: {e}")
+
+
+def _generate_embeddings_batch(
+    client: OpenAI, items: list[tuple[str, str]]
+) -> dict[str, list | np.ndarray | Exception]:
+    """
+    Generate embeddings for many (video_id, text) pairs using packed multi-input requests.
+    Texts are looked up in the content-hash cache first, and identical texts (e.g. the
+    "Private video" placeholders) are sent to the API once.
+    Returns a dict mapping each video ID to its embedding vector, or to the exception
+    that prevented it from being embedded.
+    """
+    text_hashes = {video_id: _embedding_text_hash(text) for video_id, text in items}
+    cached = _embedding_content_cache.get_many(set(text_hashes.values()))
+
+    # One API input per distinct uncached text, keyed by its hash
+    uncached = {}
+    for video_id, text in items:
+        text_hash = text_hashes[video_id]
+        if text_hash not in cached:
+            uncached.setdefault(text_hash, text)
+
+    embedded = {}
+    if uncached:
+        # 429s, 5xx and connection errors go to the concurrency limiter and the
+        # caller's requeue instead of the client's own blind retries
+        client = client.with_options(max_retries=0)
+        batches = _pack_embedding_batches(list(uncached.items()))
+        logger.info(
+            f"Embedding {len(uncached)} distinct texts "
+            f"(~{sum(map(_estimate_token_count, uncached.values()))} tokens) in "
+            f"{len(batches)} packed requests ({len(items) - len(uncached)} of "
+            f"{len(items)} served by cache or duplicates)"
+        )
+        # Batches run in parallel up to the adaptive concurrency limit
+        with ThreadPoolExecutor(
+            max_workers=min(len(batches), OPENAI_CONCURRENCY_MAX)
+        ) as executor:
+            list(
+                executor.map(
+                    lambda batch: _embed_packed_batch(client, batch, embedded), batches
+                )
+            )
+        _embedding_content_cache.put_many(
+            {
+                text_hash: vector
+                for text_hash, vector in embedded.items()
+                if not isinstance(vector, Exception)
+            }
+        )
+
+    results = {}
+    for video_id, _ in items:
+        text_hash = text_hashes[video_id]
+        if text_hash in cached:
+            results[video_id] = cached[text_hash]
+        else:
+            # Any input the API silently dropped counts as failed
+            results[video_id] = embedded.get(
+                text_hash, ValueError("Embedding missing from API response")
+            )
+    return results
+
+
+def _embedding_text_hash(text: str) -> str:
+    """Content hash of an embedding input, scoped to the model and dimensionality."""
+    key = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONALITY}:{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class EmbeddingContentCache:
+    """
+    Embeddings keyed by the hash of their input text: an in-instance LRU of float32
+    arrays in front of the persistent /embeddingCache/{hash} collection (float32 blobs).
+    Identical texts across videos and users are embedded once.
+    """
+
+    def __init__(self, max_entries: int):
+        self._memory = _LruCache(max_entries)
+
+    def get_many(self, text_hashes: set[str]) -> dict[str, np.ndarray]:
+        found = {}
+        for text_hash in text_hashes:
+            vector = self._memory.get(text_hash)
+            if vector is not None:
+                found[text_hash] = vector
+
+        missing = [text_hash for text_hash in text_hashes if text_hash not in found]
+        if missing:
+            try:
+                db = _get_firestore_client()
+                cache_refs = [
+                    db.collection("embeddingCache").document(text_hash)
+                    for text_hash in missing
+                ]
+                for doc in db.get_all(cache_refs, field_paths=["embedding"]):
+                    if not doc.exists:
+                        continue
+                    vector = decode_embedding(doc.get("embedding"))
+                    self._memory.put(doc.id, vector)
+                    found[doc.id] = vector
+            except Exception as e:
+                # The cache only saves API calls; a failed lookup just embeds again
+                logger.warning(f"Embedding cache lookup failed: {e}")
+        return found
+
+    def put_many(self, vectors: dict[str, list | np.ndarray]) -> None:
+        if not vectors:
+            return
+        for text_hash, vector in vectors.items():
+            self._memory.put(text_hash, np.asarray(vector, dtype=np.float32))
+        try:
+            db = _get_firestore_client()
+            writer = FirestoreWriteEngine(db)
+            created_at = datetime.now(timezone.utc)
+            for text_hash, vector in vectors.items():
+                writer.set(
+                    db.collection("embeddingCache").document(text_hash),
+                    {
+                        "embedding": encode_embedding(vector, "float32"),
+                        "model": EMBEDDING_MODEL,
+                        "createdAt": created_at,
+                    },
+                )
+            writer.commit()
+        except Exception as e:
+            logger.warning(f"Failed to persist {len(vectors)} cached embeddings: {e}")
+
+
+def _has_valid_embedding(video_data: dict) -> bool:
+    """
+    Check if a video document has a complete, valid embedding vector.
+
+    Uses the small 'embedding_dim' field when present, so callers can read the document
+    without the vector. Documents embedded before 'embedding_dim' existed fall back to
+    checking that:
+    - 'embedding' field exists
     - It's a list/array
     - It has the correct dimensionality
     """
+    if "embedding_dim" in video_data:
+        return (
+            video_data.get("embedding_status") == "complete"
+            and video_data["embedding_dim"] == EMBEDDING_DIMENSIONALITY
+        )
+
     embedding = video_data.get("embedding")
 
     if not embedding:
         return False
 
-    if not isinstance(embedding, list):
+    if not isinstance(embedding, (list, Vector, bytes)):
         return False
 
-    if len(embedding) != EMBEDDING_DIMENSIONALITY:
+    if _embedding_length(embedding) != EMBEDDING_DIMENSIONALITY:
         return False
 
     return True
 
 
+def encode_embedding(
+    values, storage_format: str = EMBEDDING_STORAGE_FORMAT
+) -> bytes | Vector:
+    """
+    Encode an embedding for the 'embedding' field: a packed little-endian float32 blob,
+    or a native Firestore Vector, depending on storage_format.
+    """
+    if storage_format == "float32":
+        return np.asarray(values, dtype="<f4").tobytes()
+    if storage_format == "vector":
+        return Vector(values)
+    raise ValueError(f"Unknown embedding storage format: {storage_format}")
+
+
+def decode_embedding(value) -> np.ndarray:
+    """
+    Decode a stored embedding (float32 blob, Vector, or legacy list of doubles) into a
+    float32 NumPy array. Blobs are wrapped in place with np.frombuffer, without creating
+    a Python float per element.
+    """
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype="<f4")
+    if isinstance(value, Vector):
+        return np.asarray(list(value), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def decode_embedding_matrix(values: list) -> np.ndarray:
+    """
+    Decode many stored embeddings into one contiguous (n, dim) float32 matrix. Blobs
+    are joined and wrapped with a single np.frombuffer call.
+    """
+    if not values:
+        return np.empty((0, EMBEDDING_DIMENSIONALITY), dtype=np.float32)
+    if all(isinstance(value, bytes) for value in values):
+        return np.frombuffer(b"".join(values), dtype="<f4").reshape(len(values), -1)
+    return np.stack([decode_embedding(value) for value in values])
+
+
+def _embedding_length(value) -> int:
+    if isinstance(value, bytes):
+        return len(value) // 4
+    return len(value)
+
+
 def _update_embedding_status(video_id: str, status: str, error: str = None) -> None:
     """Update the embedding status for a video document."""
     try:
-        db = firestore.Client()
+        db = _get_firestore_client()
         video_ref = db.collection("videos").document(video_id)
 
         update_data = {
@@ -1448,34 +4494,1264 @@ def _update_embedding_status(video_id: str, status: str, error: str = None) -> N
         )
 
 
+def _has_stale_retry_marker(video_data: dict) -> bool:
+    """Whether a video is held by a retry job that should have finished by now."""
+    marked_at = video_data.get("embedding_retry_marked_at")
+    return (
+        isinstance(marked_at, datetime)
+        and datetime.now(timezone.utc) - marked_at > EMBEDDING_RETRY_MARKER_TTL
+    )
+
+
+def _find_failed_liked_video_ids(db: firestore.Client, user_id: str) -> list[str]:
+    """
+    Return the IDs of the user's liked videos whose embedding failed, using a
+    name-only listing of likedVideos and status-only batched reads of /videos.
+    Videos left pending by a retry job that never finished count as failed.
+    """
+    liked_videos_ref = (
+        db.collection("users").document(user_id).collection("likedVideos")
+    )
+    video_ids = [doc.id for doc in liked_videos_ref.select([]).get()]
+
+    failed_ids = []
+    for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        video_refs = [
+            db.collection("videos").document(vid)
+            for vid in video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+        ]
+        for video_doc in db.get_all(
+            video_refs,
+            field_paths=["embedding_status", "embedding_retry_marked_at"],
+        ):
+            if not video_doc.exists:
+                continue
+            video_data = video_doc.to_dict()
+            if video_data.get(
+                "embedding_status"
+            ) == "failed" or _has_stale_retry_marker(video_data):
+                failed_ids.append(video_doc.id)
+    return failed_ids
+
+
+def _reset_failed_embeddings(
+    db: firestore.Client, video_ids: list[str], job_id: str
+) -> None:
+    """
+    Mark failed videos pending again with chunked batch writes. The retry job ID tells
+    create_video_embedding to leave them to the job instead of embedding one by one;
+    the marker's timestamp lets release_stale_embedding_retries reclaim them if the job
+    never finishes.
+    """
+    writer = FirestoreWriteEngine(db)
+    reset_timestamp = datetime.now(timezone.utc)
+    for video_id in video_ids:
+        writer.update(
+            db.collection("videos").document(video_id),
+            {
+                "embedding_status": "pending",
+                "embedding_error": firestore.DELETE_FIELD,
+                "embedding_updated_at": reset_timestamp,
+                "embedding_retry_job_id": job_id,
+                "embedding_retry_marked_at": reset_timestamp,
+            },
+        )
+    writer.commit()
+
+
+def _run_embedding_retry_job(
+    db: firestore.Client, job_ref: firestore.DocumentReference, video_ids: list[str]
+) -> dict:
+    """
+    Embed the videos of a retry job in packed batches of EMBEDDING_BACKFILL_BATCH_SIZE,
+    writing results back in chunked batches and recording progress on the job document.
+    Returns the final job counts.
+    """
+    succeeded = 0
+    failed = 0
+    job_ref.update({"status": "running", "startedAt": datetime.now(timezone.utc)})
+    try:
+        openai_client = _get_openai_client()
+        for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+            chunk_ids = video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+            chunk_succeeded, chunk_failed = _run_embedding_retry_chunk(
+                db, openai_client, chunk_ids
+            )
+            succeeded += chunk_succeeded
+            failed += chunk_failed
+            job_ref.update({"succeeded": succeeded, "failed": failed})
+    except Exception as e:
+        logger.error(f"Embedding retry job {job_ref.id} failed: {str(e)}")
+        _release_retry_job_videos(db, video_ids, job_ref.id, str(e))
+        job_ref.update({"status": "failed", "error": str(e)})
+        raise
+
+    job_ref.update({"status": "completed", "completedAt": datetime.now(timezone.utc)})
+    logger.info(
+        f"Embedding retry job {job_ref.id}: {succeeded} succeeded, {failed} failed"
+    )
+    return {"succeeded": succeeded, "failed": failed}
+
+
+def _run_embedding_retry_chunk(
+    db: firestore.Client, openai_client: OpenAI, chunk_ids: list[str]
+) -> tuple[int, int]:
+    """
+    Embed one chunk of a retry job and write the results. Videos that hit a rate limit or
+    transient API error are handed to the backfill queue: they keep the job ID, so
+    create_video_embedding still leaves them alone, but lose the marker's timestamp, so
+    the stale-marker sweeps don't mistake them for videos of an abandoned job while
+    they wait. Returns (succeeded, failed).
+    """
+    succeeded = 0
+    failed = 0
+    video_refs = [db.collection("videos").document(vid) for vid in chunk_ids]
+    video_docs = db.get_all(
+        video_refs, field_paths=["title", "description", "channelTitle"]
+    )
+
+    items = []
+    missing_text_ids = []
+    for video_doc in video_docs:
+        if not video_doc.exists:
+            continue
+        video_data = video_doc.to_dict()
+        combined_text = _prepare_embedding_text(
+            video_data.get("title", "").strip(),
+            video_data.get("description", "").strip(),
+            video_data.get("channelTitle", "").strip(),
+        )
+        if combined_text:
+            items.append((video_doc.id, combined_text))
+        else:
+            missing_text_ids.append(video_doc.id)
+
+    texts = dict(items)
+    results = _generate_embeddings_batch(openai_client, items) if items else {}
+    results.update(
+        {video_id: ValueError("No text content") for video_id in missing_text_ids}
+    )
+
+    deferred = {
+        video_id: result
+        for video_id, result in results.items()
+        if isinstance(result, EmbeddingRetryableError)
+    }
+    if deferred:
+        _defer_retryable_embeddings(
+            db,
+            list(deferred),
+            max(result.retry_after_sec for result in deferred.values()),
+        )
+
+    writer = FirestoreWriteEngine(db)
+    batch_timestamp = datetime.now(timezone.utc)
+    for video_id, result in results.items():
+        video_ref = db.collection("videos").document(video_id)
+        if video_id in deferred:
+            writer.update(
+                video_ref, {"embedding_retry_marked_at": firestore.DELETE_FIELD}
+            )
+            continue
+        if isinstance(result, Exception):
+            writer.update(
+                video_ref,
+                {
+                    "embedding_status": "failed",
+                    "embedding_error": str(result),
+                    "embedding_updated_at": batch_timestamp,
+                    "embedding_retry_job_id": firestore.DELETE_FIELD,
+                    "embedding_retry_marked_at": firestore.DELETE_FIELD,
+                },
+            )
+            failed += 1
+        else:
+            writer.update(
+                video_ref,
+                {
+                    "embedding": encode_embedding(result),
+                    "embedding_dim": len(result),
+                    "embedding_text_hash": _embedding_text_hash(texts[video_id]),
+                    "embedding_token_count": _estimate_token_count(texts[video_id]),
+                    "embedding_status": "complete",
+                    "embedding_generated_at": batch_timestamp,
+                    "embedding_retry_job_id": firestore.DELETE_FIELD,
+                    "embedding_retry_marked_at": firestore.DELETE_FIELD,
+                },
+            )
+            succeeded += 1
+    writer.commit()
+    return succeeded, failed
+
+
+def _release_retry_job_videos(
+    db: firestore.Client, video_ids: list[str], job_id: str, error: str
+) -> None:
+    """
+    Mark videos still held by an aborted retry job as failed again, so they are neither
+    stuck as pending nor skipped by create_video_embedding. Videos the job already
+    deferred to the backfill queue (no marker timestamp) are left to the queue.
+    """
+    writer = FirestoreWriteEngine(db)
+    for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        video_refs = [
+            db.collection("videos").document(vid)
+            for vid in video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+        ]
+        for video_doc in db.get_all(
+            video_refs,
+            field_paths=["embedding_retry_job_id", "embedding_retry_marked_at"],
+        ):
+            if not video_doc.exists:
+                continue
+            video_data = video_doc.to_dict()
+            if (
+                video_data.get("embedding_retry_job_id") == job_id
+                and "embedding_retry_marked_at" in video_data
+            ):
+                writer.update(
+                    video_doc.reference,
+                    {
+                        "embedding_status": "failed",
+                        "embedding_error": error,
+                        "embedding_updated_at": datetime.now(timezone.utc),
+                        "embedding_retry_job_id": firestore.DELETE_FIELD,
+                        "embedding_retry_marked_at": firestore.DELETE_FIELD,
+                    },
+                )
+    writer.commit()
+
+
+def _create_embedding_retry_job(
+    db: firestore.Client, job_ref: firestore.DocumentReference, video_ids: list[str]
+) -> None:
+    """
+    Create a retry job in the "preparing" status, with its video IDs stored in
+    EMBEDDING_BACKFILL_BATCH_SIZE chunks under its chunks subcollection (a single
+    array could exceed Firestore's 1 MiB document limit), then mark its videos.
+    The job exists before any video carries its marker, so a marked video always
+    points at a real job.
+    """
+    job_ref.set(
+        {
+            "status": "preparing",
+            "total": len(video_ids),
+            "succeeded": 0,
+            "failed": 0,
+            "createdAt": datetime.now(timezone.utc),
+        }
+    )
+    writer = FirestoreWriteEngine(db)
+    for start in range(0, len(video_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        writer.set(
+            job_ref.collection("chunks").document(f"{start:08d}"),
+            {"videoIds": video_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]},
+        )
+    writer.commit()
+    _reset_failed_embeddings(db, video_ids, job_ref.id)
+
+
+def _load_embedding_retry_job_video_ids(
+    job_ref: firestore.DocumentReference,
+) -> list[str]:
+    """Read a retry job's video IDs back from its chunks, in order."""
+    video_ids = []
+    for chunk_doc in job_ref.collection("chunks").order_by("__name__").stream():
+        video_ids.extend(chunk_doc.get("videoIds") or [])
+    return video_ids
+
+
 @https_fn.on_call()
 def retry_failed_embeddings(req: https_fn.CallableRequest) -> dict:
+    """
+    Retry every failed embedding among a user's liked videos.
+    Failed videos are found with projected batched reads and reset to pending with
+    batched writes. Up to EMBEDDING_RETRY_INLINE_MAX videos are embedded before
+    returning; larger retries return straight away and run in process_embedding_retry_job,
+    tracked by the returned job ID under /users/{userId}/embeddingRetryJobs.
+    """
     user_id = req.data.get("user_id")
     if not user_id:
         raise https_fn.HttpsError(
             code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
             message="The function must be called with a valid 'user_id'.",
         )
-    db = firestore.Client()
-    # Get all videoIds liked by this user
-    # Using .get() instead of .stream() for better performance when processing all documents
+    try:
+        db = _get_firestore_client()
+        failed_ids = _find_failed_liked_video_ids(db, user_id)
+        if not failed_ids:
+            return {"retried": 0}
+
+        job_ref = (
+            db.collection("users")
+            .document(user_id)
+            .collection("embeddingRetryJobs")
+            .document()
+        )
+        _create_embedding_retry_job(db, job_ref, failed_ids)
+
+        run_inline = len(failed_ids) <= EMBEDDING_RETRY_INLINE_MAX
+        # Queueing the job starts process_embedding_retry_job; inline jobs start as running
+        job_ref.update({"status": "running" if run_inline else "queued"})
+        if not run_inline:
+            return {
+                "retried": len(failed_ids),
+                "job_id": job_ref.id,
+                "status": "queued",
+            }
+
+        counts = _run_embedding_retry_job(db, job_ref, failed_ids)
+    except Exception as e:
+        logger.error(f"Failed to retry embeddings for user {user_id}: {str(e)}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INTERNAL,
+            message=f"Failed to retry embeddings: {str(e)}",
+        )
+    return {
+        "retried": len(failed_ids),
+        "job_id": job_ref.id,
+        "status": "completed",
+        **counts,
+    }
+
+
+@firestore_fn.on_document_updated(
+    document="users/{userId}/embeddingRetryJobs/{jobId}", timeout_sec=540
+)
+def process_embedding_retry_job(
+    event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]],
+) -> None:
+    """Run an embedding retry job once retry_failed_embeddings queues it."""
+    before = event.data.before.to_dict() if event.data.before else None
+    after = event.data.after.to_dict() if event.data.after else None
+    if not after or after.get("status") != "queued":
+        return
+    if before and before.get("status") == "queued":
+        return
+
+    db = _get_firestore_client()
+    job_ref = (
+        db.collection("users")
+        .document(event.params["userId"])
+        .collection("embeddingRetryJobs")
+        .document(event.params["jobId"])
+    )
+    try:
+        _run_embedding_retry_job(
+            db, job_ref, _load_embedding_retry_job_video_ids(job_ref)
+        )
+    except Exception:
+        # Already recorded on the job document and its videos released
+        pass
+
+
+@scheduler_fn.on_schedule(schedule="every 30 minutes", timeout_sec=540)
+def release_stale_embedding_retries(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Mark videos failed again when the retry job holding them died without finishing
+    (their marker is older than EMBEDDING_RETRY_MARKER_TTL), so that
+    create_video_embedding stops skipping them and they can be retried.
+    """
+    db = _get_firestore_client()
+    cutoff = datetime.now(timezone.utc) - EMBEDDING_RETRY_MARKER_TTL
+    stale_query = (
+        db.collection("videos")
+        .where("embedding_retry_marked_at", "<", cutoff)
+        .select(["embedding_retry_job_id"])
+    )
+    writer = FirestoreWriteEngine(db)
+    released_at = datetime.now(timezone.utc)
+    for video_doc in stale_query.stream():
+        writer.update(
+            video_doc.reference,
+            {
+                "embedding_status": "failed",
+                "embedding_error": "Embedding retry job did not finish",
+                "embedding_updated_at": released_at,
+                "embedding_retry_job_id": firestore.DELETE_FIELD,
+                "embedding_retry_marked_at": firestore.DELETE_FIELD,
+            },
+        )
+    released = writer.commit()
+    if released:
+        logger.info(f"Released {released} videos held by stale embedding retry jobs")
+
+
+class _LruCache:
+    """Thread-safe LRU cache with an optional per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl_sec: float | None = None):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl_sec is not None and time.monotonic() - stored_at > self.ttl_sec:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+@dataclass
+class UserEmbeddingIndex:
+    """
+    A user's embedded liked videos as a contiguous matrix of unit-length rows, plus the
+    re-normalized Matryoshka prefixes of those rows (derived when not given).
+    """
+
+    video_ids: list[str]
+    matrix: np.ndarray
+    prefix: np.ndarray | None = None
+
+    def __post_init__(self):
+        if self.prefix is None:
+            self.prefix = _matryoshka_prefix(self.matrix)
+
+    def top_k(self, query_vector: np.ndarray, k: int) -> list[tuple[str, float]]:
+        """
+        Return the k most cosine-similar videos as (video_id, score), best first.
+        Large indexes are scanned on the prefixes, and only the best k *
+        SEARCH_RESCORE_FACTOR candidates are rescored with the full rows (for a
+        memory-mapped snapshot, only those rows are read from disk).
+        """
+        if not self.video_ids:
+            return []
+        k = min(k, len(self.video_ids))
+        candidates = None
+        if self.prefix.shape[1] < self.matrix.shape[1]:
+            shortlist = k * SEARCH_RESCORE_FACTOR
+            if shortlist < len(self.video_ids):
+                coarse_scores = self.prefix @ _matryoshka_prefix(query_vector)
+                candidates = np.sort(
+                    np.argpartition(coarse_scores, -shortlist)[-shortlist:]
+                )
+
+        if candidates is None:
+            candidates = np.arange(len(self.video_ids))
+        scores = self.matrix[candidates] @ query_vector
+        # argpartition finds the top k in O(n); only those k are sorted
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(self.video_ids[candidates[i]], float(scores[i])) for i in top]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _matryoshka_prefix(matrix: np.ndarray) -> np.ndarray:
+    """
+    The leading EMBEDDING_PREFIX_DIMENSIONALITY dimensions of each row, re-normalized.
+    Returns the input itself when it's no longer than the prefix.
+    """
+    if matrix.shape[-1] <= EMBEDDING_PREFIX_DIMENSIONALITY:
+        return matrix
+    return np.ascontiguousarray(
+        _normalize_rows(matrix[..., :EMBEDDING_PREFIX_DIMENSIONALITY]), dtype=np.float32
+    )
+
+
+_query_embedding_cache = _LruCache(SEARCH_QUERY_CACHE_SIZE)
+_user_index_cache = _LruCache(SEARCH_INDEX_CACHE_SIZE, ttl_sec=SEARCH_INDEX_TTL_SEC)
+_embedding_content_cache = EmbeddingContentCache(EMBEDDING_CONTENT_CACHE_SIZE)
+
+
+def _get_query_embedding(query: str) -> np.ndarray:
+    """Embed a search query as a unit vector, reusing cached embeddings of repeat queries."""
+    cache_key = (EMBEDDING_MODEL, " ".join(query.lower().split()))
+    query_vector = _query_embedding_cache.get(cache_key)
+    if query_vector is None:
+        embedding = _generate_embedding(_get_openai_client(), query)
+        query_vector = _normalize_rows(np.asarray(embedding, dtype=np.float32))
+        _query_embedding_cache.put(cache_key, query_vector)
+    return query_vector
+
+
+def _load_user_embedding_index(
+    db: firestore.Client, user_id: str
+) -> UserEmbeddingIndex:
+    """
+    Build the user's embedding index from likedVideos and the videos' stored embeddings,
+    reading only the embedding field. Videos without a valid embedding are left out.
+    """
     liked_videos_ref = (
         db.collection("users").document(user_id).collection("likedVideos")
     )
-    liked_video_docs = liked_videos_ref.get()
-    retried = 0
-    for doc in liked_video_docs:
-        video_id = doc.id
-        video_ref = db.collection("videos").document(video_id)
-        video_doc = video_ref.get()
-        if video_doc.exists and video_doc.get("embedding_status") == "failed":
-            video_ref.update(
-                {
-                    "embedding_status": "pending",
-                    "embedding_error": firestore.DELETE_FIELD,
-                    "embedding_updated_at": datetime.now(timezone.utc),
-                }
+    liked_ids = [doc.id for doc in liked_videos_ref.select([]).get()]
+
+    video_ids = []
+    embeddings = []
+    for start in range(0, len(liked_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        video_refs = [
+            db.collection("videos").document(vid)
+            for vid in liked_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+        ]
+        for video_doc in db.get_all(video_refs, field_paths=["embedding"]):
+            embedding = (
+                (video_doc.to_dict() or {}).get("embedding")
+                if video_doc.exists
+                else None
+            )
+            if embedding and _embedding_length(embedding) == EMBEDDING_DIMENSIONALITY:
+                video_ids.append(video_doc.id)
+                embeddings.append(embedding)
+
+    matrix = _normalize_rows(decode_embedding_matrix(embeddings))
+    logger.info(
+        f"Loaded search index for user {user_id}: {len(video_ids)} of "
+        f"{len(liked_ids)} liked videos embedded"
+    )
+    return UserEmbeddingIndex(video_ids, np.ascontiguousarray(matrix, dtype=np.float32))
+
+
+class LocalSnapshotBackend:
+    """Snapshot backend that keeps snapshots on local disk only (tests, emulator, dev)."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root_dir, "store", key)
+
+    def fetch(
+        self, key: str, dest_path: str, known_generation: str | None
+    ) -> str | None:
+        """Copy `key` to dest_path unless known_generation is current; return its generation."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        generation = str(os.stat(path).st_mtime_ns)
+        if generation != known_generation:
+            with open(path, "rb") as src, open(dest_path, "wb") as dest:
+                dest.write(src.read())
+        return generation
+
+    def put(self, key: str, src_path: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(src_path, "rb") as src, open(path + ".tmp", "wb") as dest:
+            dest.write(src.read())
+        os.replace(path + ".tmp", path)
+
+
+class CloudStorageSnapshotBackend:
+    """Snapshot backend storing snapshots as objects in a Cloud Storage bucket."""
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    def _get_bucket(self) -> storage.Bucket:
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = storage.Client().bucket(self.bucket_name)
+            return self._bucket
+
+    def fetch(
+        self, key: str, dest_path: str, known_generation: str | None
+    ) -> str | None:
+        """Download `key` to dest_path unless known_generation is current; return its generation."""
+        blob = self._get_bucket().get_blob(key)
+        if blob is None:
+            return None
+        generation = str(blob.generation)
+        if generation != known_generation:
+            blob.download_to_filename(dest_path, if_generation_match=blob.generation)
+        return generation
+
+    def put(self, key: str, src_path: str) -> None:
+        self._get_bucket().blob(key).upload_from_filename(src_path)
+
+
+class EmbeddingSnapshotStore:
+    """
+    Per-user embedding matrix snapshots: a float32 .npy matrix of unit rows, the matrix
+    of their Matryoshka prefixes and a JSON ID index, kept in a backend (Cloud Storage
+    or local) and cached on local disk, where they're opened with np.load(mmap_mode="r")
+    so a warm instance starts in milliseconds.
+    Changes since the snapshot are queued as delta documents under
+    /users/{userId}/embeddingSnapshotDeltas and folded in (and the snapshot rewritten)
+    the next time it's loaded.
+    """
+
+    def __init__(self, backend, cache_dir: str):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+
+    def _local_paths(self, user_id: str) -> tuple[str, str, str]:
+        user_dir = os.path.join(self.cache_dir, "users", user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        return (
+            os.path.join(user_dir, "matrix.npy"),
+            os.path.join(user_dir, "prefix.npy"),
+            os.path.join(user_dir, "index.json"),
+        )
+
+    def load(self, user_id: str) -> UserEmbeddingIndex | None:
+        """Open the user's snapshot memory-mapped, refreshing the local copy if it's stale."""
+        matrix_path, prefix_path, index_path = self._local_paths(user_id)
+        with self._lock:
+            known = {}
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    known = json.load(f)
+            index_generation = self.backend.fetch(
+                f"{user_id}/index.json", index_path + ".new", known.get("generation")
+            )
+            if index_generation is None:
+                return None
+            if index_generation != known.get("generation"):
+                with open(index_path + ".new") as f:
+                    fetched = json.load(f)
+                self.backend.fetch(f"{user_id}/matrix.npy", matrix_path + ".new", None)
+                os.replace(matrix_path + ".new", matrix_path)
+                # Snapshots saved before prefixes were stored get them derived on load
+                if self.backend.fetch(
+                    f"{user_id}/prefix.npy", prefix_path + ".new", None
+                ):
+                    os.replace(prefix_path + ".new", prefix_path)
+                elif os.path.exists(prefix_path):
+                    os.remove(prefix_path)
+                fetched["generation"] = index_generation
+                with open(index_path, "w") as f:
+                    json.dump(fetched, f)
+                known = fetched
+        matrix = np.load(matrix_path, mmap_mode="r")
+        if matrix.shape[0] != len(known["videoIds"]):
+            logger.warning(f"Embedding snapshot for user {user_id} is inconsistent")
+            return None
+        prefix = None
+        if os.path.exists(prefix_path):
+            prefix = np.load(prefix_path, mmap_mode="r")
+            expected_shape = (
+                matrix.shape[0],
+                min(matrix.shape[1], EMBEDDING_PREFIX_DIMENSIONALITY),
+            )
+            if prefix.shape != expected_shape:
+                prefix = None
+        return UserEmbeddingIndex(known["videoIds"], matrix, prefix)
+
+    def save(self, user_id: str, index: UserEmbeddingIndex) -> None:
+        """Write the index as the user's snapshot (matrix first, then the ID index)."""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            matrix_tmp = os.path.join(tmp_dir, "matrix.npy")
+            prefix_tmp = os.path.join(tmp_dir, "prefix.npy")
+            index_tmp = os.path.join(tmp_dir, "index.json")
+            np.save(matrix_tmp, np.ascontiguousarray(index.matrix, dtype=np.float32))
+            np.save(prefix_tmp, np.ascontiguousarray(index.prefix, dtype=np.float32))
+            with open(index_tmp, "w") as f:
+                json.dump({"videoIds": index.video_ids}, f)
+            with self._lock:
+                self.backend.put(f"{user_id}/matrix.npy", matrix_tmp)
+                self.backend.put(f"{user_id}/prefix.npy", prefix_tmp)
+                self.backend.put(f"{user_id}/index.json", index_tmp)
+
+
+def _create_embedding_snapshot_store() -> EmbeddingSnapshotStore | None:
+    """
+    The snapshot store for this environment, or None when snapshots are disabled:
+    deployed functions (K_SERVICE set, outside the emulator) need
+    EMBEDDING_SNAPSHOT_BUCKET.
+    """
+    if EMBEDDING_SNAPSHOT_BUCKET:
+        backend = CloudStorageSnapshotBackend(EMBEDDING_SNAPSHOT_BUCKET)
+    elif os.environ.get("FUNCTIONS_EMULATOR") == "true" or not os.environ.get(
+        "K_SERVICE"
+    ):
+        backend = LocalSnapshotBackend(EMBEDDING_SNAPSHOT_CACHE_DIR)
+    else:
+        logger.warning(
+            "EMBEDDING_SNAPSHOT_BUCKET is not set; embedding snapshots are disabled"
+        )
+        return None
+    return EmbeddingSnapshotStore(backend, EMBEDDING_SNAPSHOT_CACHE_DIR)
+
+
+_embedding_snapshot_store = _create_embedding_snapshot_store()
+
+
+def _snapshot_deltas_ref(db: firestore.Client, user_id: str):
+    return (
+        db.collection("users").document(user_id).collection("embeddingSnapshotDeltas")
+    )
+
+
+def _record_snapshot_deltas(
+    db: firestore.Client, user_id: str, operations: dict[str, str]
+) -> None:
+    """Queue per-video snapshot changes ("upsert" or "remove") for a user."""
+    deltas_ref = _snapshot_deltas_ref(db, user_id)
+    writer = FirestoreWriteEngine(db)
+    recorded_at = datetime.now(timezone.utc)
+    for video_id, op in operations.items():
+        writer.set(deltas_ref.document(video_id), {"op": op, "recordedAt": recorded_at})
+    writer.commit()
+
+
+def _record_like_changes_in_snapshot(
+    db: firestore.Client, user_id: str, liked_ids: list[str], unliked_ids: list[str]
+) -> None:
+    """
+    Queue the sync's like/unlike changes for the user's embedding snapshot, if the
+    user has one (users without a snapshot get a full scan on their first load anyway).
+    """
+    if not liked_ids and not unliked_ids:
+        return
+    if not _user_has_embedding_snapshot(db, user_id):
+        return
+    operations = {video_id: "upsert" for video_id in liked_ids}
+    operations.update({video_id: "remove" for video_id in unliked_ids})
+    _record_snapshot_deltas(db, user_id, operations)
+
+
+def _embedding_snapshot_ref(
+    db: firestore.Client, user_id: str
+) -> firestore.DocumentReference:
+    return (
+        db.collection("users")
+        .document(user_id)
+        .collection("embeddingSnapshots")
+        .document("current")
+    )
+
+
+def _user_has_embedding_snapshot(db: firestore.Client, user_id: str) -> bool:
+    return _embedding_snapshot_ref(db, user_id).get(field_paths=["rows"]).exists
+
+
+def _users_with_embedding_snapshots(
+    db: firestore.Client, user_ids: list[str]
+) -> set[str]:
+    """The subset of user_ids that have an embedding snapshot, with batched reads."""
+    users_with_snapshots = set()
+    for start in range(0, len(user_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        snapshot_refs = [
+            _embedding_snapshot_ref(db, user_id)
+            for user_id in user_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+        ]
+        for snapshot_doc in db.get_all(snapshot_refs, field_paths=["rows"]):
+            if snapshot_doc.exists:
+                # .../users/{userId}/embeddingSnapshots/current
+                users_with_snapshots.add(snapshot_doc.reference.parent.parent.id)
+    return users_with_snapshots
+
+
+def _apply_snapshot_deltas(
+    db: firestore.Client, user_id: str, index: UserEmbeddingIndex
+) -> tuple[UserEmbeddingIndex, list]:
+    """
+    Fold queued deltas into a snapshot index: removed and re-embedded videos drop their
+    old rows, upserted videos with a valid embedding are appended.
+    Returns the new index and the consumed delta documents.
+    """
+    delta_docs = list(_snapshot_deltas_ref(db, user_id).stream())
+    if not delta_docs:
+        return index, []
+
+    changed_ids = {doc.id for doc in delta_docs}
+    upsert_ids = [doc.id for doc in delta_docs if doc.get("op") == "upsert"]
+    keep = [i for i, vid in enumerate(index.video_ids) if vid not in changed_ids]
+
+    video_ids = [index.video_ids[i] for i in keep]
+    embeddings = []
+    for start in range(0, len(upsert_ids), EMBEDDING_BACKFILL_BATCH_SIZE):
+        video_refs = [
+            db.collection("videos").document(vid)
+            for vid in upsert_ids[start : start + EMBEDDING_BACKFILL_BATCH_SIZE]
+        ]
+        for video_doc in db.get_all(video_refs, field_paths=["embedding"]):
+            if not video_doc.exists:
+                continue
+            embedding = (video_doc.to_dict() or {}).get("embedding")
+            if embedding and _embedding_length(embedding) == EMBEDDING_DIMENSIONALITY:
+                video_ids.append(video_doc.id)
+                embeddings.append(embedding)
+
+    matrix = np.concatenate(
+        [
+            np.asarray(index.matrix[keep], dtype=np.float32),
+            _normalize_rows(decode_embedding_matrix(embeddings)),
+        ]
+    )
+    return UserEmbeddingIndex(video_ids, matrix), delta_docs
+
+
+def _save_embedding_snapshot(
+    db: firestore.Client, user_id: str, index: UserEmbeddingIndex, consumed_deltas: list
+) -> None:
+    """
+    Store a new snapshot, then delete the deltas it includes in chunked batch writes.
+    Each delete is conditional on the delta being unchanged, so deltas recorded
+    meanwhile survive for the next load; a chunk holding such a delta is retried
+    one delete at a time.
+    """
+    _embedding_snapshot_store.save(user_id, index)
+    _embedding_snapshot_ref(db, user_id).set(
+        {"rows": len(index.video_ids), "updatedAt": datetime.now(timezone.utc)}
+    )
+    for start in range(0, len(consumed_deltas), FIRESTORE_WRITE_CHUNK_SIZE):
+        chunk = consumed_deltas[start : start + FIRESTORE_WRITE_CHUNK_SIZE]
+        batch = db.batch()
+        for delta_doc in chunk:
+            batch.delete(
+                delta_doc.reference,
+                option=db.write_option(last_update_time=delta_doc.update_time),
+            )
+        try:
+            batch.commit()
+            continue
+        except google_exceptions.FailedPrecondition:
+            pass
+        for delta_doc in chunk:
+            try:
+                delta_doc.reference.delete(
+                    option=db.write_option(last_update_time=delta_doc.update_time)
+                )
+            except google_exceptions.FailedPrecondition:
+                pass
+
+
+def _get_user_embedding_index(db: firestore.Client, user_id: str) -> UserEmbeddingIndex:
+    """
+    The user's embedding index, from the in-memory LRU, else the memory-mapped snapshot
+    (with queued deltas folded in), else a full scan of their liked videos. The latter
+    two store a fresh snapshot for the next cold start, when snapshots are enabled.
+    """
+    index = _user_index_cache.get(user_id)
+    if index is not None:
+        return index
+
+    if _embedding_snapshot_store is None:
+        index = _load_user_embedding_index(db, user_id)
+        _user_index_cache.put(user_id, index)
+        return index
+
+    index = None
+    try:
+        index = _embedding_snapshot_store.load(user_id)
+    except Exception as e:
+        logger.warning(f"Failed to load embedding snapshot for user {user_id}: {e}")
+
+    if index is None:
+        # Deltas queued before the scan are reflected in it; read them first so that
+        # any recorded during the scan are kept for the next load
+        consumed_deltas = list(_snapshot_deltas_ref(db, user_id).stream())
+        index = _load_user_embedding_index(db, user_id)
+    else:
+        index, consumed_deltas = _apply_snapshot_deltas(db, user_id, index)
+
+    if consumed_deltas or not _user_has_embedding_snapshot(db, user_id):
+        try:
+            _save_embedding_snapshot(db, user_id, index, consumed_deltas)
+        except Exception as e:
+            # Search still works from the in-memory index; the next load retries
+            logger.warning(f"Failed to save embedding snapshot for user {user_id}: {e}")
+
+    _user_index_cache.put(user_id, index)
+    return index
+
+
+@https_fn.on_call()
+def search_liked_videos(req: https_fn.CallableRequest) -> dict:
+    """
+    Semantic search over a user's liked videos.
+    Embeds the query (repeat queries come from an in-memory LRU), then ranks the user's
+    embedded liked videos by cosine similarity with one NumPy matrix-vector product.
+    The user's embedding matrix is cached per instance for SEARCH_INDEX_TTL_SEC, so warm
+    searches don't touch Firestore except to fetch the top results' metadata.
+
+    Expects: user_id and query in the request data, optionally top_k and refresh
+    (reload the user's embeddings instead of using the cached matrix).
+    Returns: dict with the ranked results (videoId, score, title, channelTitle, thumbnailUrl).
+    """
+    user_id = req.data.get("user_id")
+    query = (req.data.get("query") or "").strip()
+    if not user_id:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message="The function must be called with a valid 'user_id'.",
+        )
+    if not query:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message="The function must be called with a non-empty 'query'.",
+        )
+    try:
+        top_k = int(req.data.get("top_k", SEARCH_DEFAULT_TOP_K))
+    except (TypeError, ValueError):
+        top_k = SEARCH_DEFAULT_TOP_K
+    top_k = max(1, min(top_k, SEARCH_MAX_TOP_K))
+
+    db = _get_firestore_client()
+    if req.data.get("refresh"):
+        _user_index_cache.invalidate(user_id)
+
+    try:
+        query_vector = _get_query_embedding(query)
+    except ValueError as e:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.UNAVAILABLE,
+            message=f"Failed to embed the search query: {str(e)}",
+        )
+    index = _get_user_embedding_index(db, user_id)
+    ranked = index.top_k(query_vector, top_k)
+
+    video_refs = [db.collection("videos").document(vid) for vid, _ in ranked]
+    metadata = {
+        doc.id: doc.to_dict()
+        for doc in db.get_all(
+            video_refs, field_paths=["title", "channelTitle", "thumbnailUrl"]
+        )
+        if doc.exists
+    }
+    results = [
+        {
+            "videoId": video_id,
+            "score": score,
+            "title": metadata.get(video_id, {}).get("title", ""),
+            "channelTitle": metadata.get(video_id, {}).get("channelTitle", ""),
+            "thumbnailUrl": metadata.get(video_id, {}).get("thumbnailUrl", ""),
+        }
+        for video_id, score in ranked
+    ]
+    return {"results": results, "searched_videos": len(index.video_ids)}
+
+
+def _squared_distances(
+    points: np.ndarray, centroids: np.ndarray, centroid_norms: np.ndarray | None = None
+) -> np.ndarray:
+    """
+    Squared Euclidean distances between unit-length points and centroids, computed as
+    1 + |c|^2 - 2 p.c so the work is one BLAS matrix product.
+    """
+    if centroid_norms is None:
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    distances = points @ centroids.T
+    distances *= -2.0
+    distances += 1.0 + centroid_norms
+    np.maximum(distances, 0.0, out=distances)
+    return distances
+
+
+def _assign_clusters(
+    points: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192
+) -> tuple[np.ndarray, np.ndarray]:
+    """Nearest centroid and its squared distance for every point, in bounded-memory chunks."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(points), dtype=np.int32)
+    nearest = np.empty(len(points), dtype=np.float32)
+    for start in range(0, len(points), chunk_size):
+        distances = _squared_distances(
+            points[start : start + chunk_size], centroids, centroid_norms
+        )
+        labels[start : start + chunk_size] = distances.argmin(axis=1)
+        nearest[start : start + chunk_size] = distances.min(axis=1)
+    return labels, nearest
+
+
+def _kmeans_plus_plus(
+    points: np.ndarray, k: int, rng: np.random.Generator
+) -> np.ndarray:
+    """k-means++ seeding: each new centroid is drawn with probability proportional to D^2."""
+    centroids = np.empty((k, points.shape[1]), dtype=np.float32)
+    centroids[0] = points[rng.integers(len(points))]
+    closest = _squared_distances(points, centroids[:1])[:, 0]
+    for i in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            # Fewer distinct points than clusters
+            centroids[i] = points[rng.integers(len(points))]
+            continue
+        centroids[i] = points[rng.choice(len(points), p=closest / total)]
+        np.minimum(
+            closest, _squared_distances(points, centroids[i : i + 1])[:, 0], out=closest
+        )
+    return centroids
+
+
+def minibatch_kmeans(
+    points: np.ndarray,
+    k: int,
+    seed: int = 0,
+    batch_size: int = SHELVES_BATCH_SIZE,
+    max_iter: int = SHELVES_MAX_ITER,
+    tol: float = 1e-4,
+) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Mini-batch k-means (Sculley 2010) with k-means++ seeding on a (n, dim) float32
+    matrix of unit-length rows. Each iteration moves centroids towards one random batch
+    with per-centroid learning rates; stops early once centroids stop moving.
+    Returns (centroids, labels, inertia) with labels from a final full assignment pass.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(points))
+    centroids = _kmeans_plus_plus(points, k, rng)
+    counts = np.zeros(k, dtype=np.float64)
+
+    for _ in range(max_iter):
+        batch = points[rng.integers(len(points), size=min(batch_size, len(points)))]
+        batch_labels = _squared_distances(batch, centroids).argmin(axis=1)
+        previous = centroids.copy()
+
+        batch_counts = np.bincount(batch_labels, minlength=k)
+        batch_sums = np.zeros_like(centroids)
+        np.add.at(batch_sums, batch_labels, batch)
+        updated = batch_counts > 0
+        counts[updated] += batch_counts[updated]
+        # Equivalent to the per-sample 1/count updates, applied per batch
+        learning_rate = (batch_counts[updated] / counts[updated])[:, None]
+        batch_means = batch_sums[updated] / batch_counts[updated][:, None]
+        centroids[updated] += learning_rate * (batch_means - centroids[updated])
+
+        if np.max(np.abs(centroids - previous)) < tol:
+            break
+
+    labels, nearest = _assign_clusters(points, centroids)
+    return centroids, labels, float(nearest.sum())
+
+
+def _simplified_silhouette(
+    points: np.ndarray, centroids: np.ndarray, sample_size: int, seed: int = 0
+) -> float:
+    """
+    Simplified silhouette score on a sample: (b - a) / max(a, b), with a and b the
+    distances to the nearest and second-nearest centroid. O(sample * k), unlike the full
+    silhouette's O(n^2).
+    """
+    if len(centroids) < 2:
+        return -1.0
+    rng = np.random.default_rng(seed)
+    if len(points) > sample_size:
+        points = points[rng.choice(len(points), size=sample_size, replace=False)]
+    distances = np.sqrt(_squared_distances(points, centroids))
+    distances.partition(1, axis=1)
+    a, b = distances[:, 0], distances[:, 1]
+    return float(np.mean((b - a) / np.maximum(np.maximum(a, b), 1e-12)))
+
+
+def _candidate_shelf_counts(n: int) -> list[int]:
+    max_k = min(SHELVES_MAX_K, max(SHELVES_MIN_K, int(np.sqrt(n / 2))))
+    min_k = min(SHELVES_MIN_K, max_k)
+    return sorted(
+        set(
+            np.linspace(min_k, max_k, SHELVES_CANDIDATE_KS).round().astype(int).tolist()
+        )
+    )
+
+
+def _refine_clusters(
+    points: np.ndarray, labels: np.ndarray, iterations: int = SHELVES_REFINE_ITER
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Lloyd iterations (at least one) starting from an existing assignment: centroids are
+    recomputed as the mean of their members and every point is reassigned. Clusters
+    that end up empty are dropped. Returns (centroids, labels).
+    """
+    for _ in range(max(1, iterations)):
+        _, labels = np.unique(labels, return_inverse=True)
+        # Per-cluster sums as one (k, n) @ (n, dim) product
+        membership = np.zeros((len(points), int(labels.max()) + 1), dtype=np.float32)
+        membership[np.arange(len(points)), labels] = 1.0
+        centroids = (membership.T @ points) / membership.sum(axis=0)[:, None]
+        labels, _ = _assign_clusters(points, centroids)
+    used, labels = np.unique(labels, return_inverse=True)
+    return centroids[used], labels
+
+
+def cluster_embeddings(
+    points: np.ndarray,
+    k: int | None = None,
+    seed: int = 0,
+    coarse_points: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Cluster unit-length embeddings into shelves. With k=None, candidate shelf counts are
+    fitted in parallel threads (NumPy's BLAS calls release the GIL, so this uses every
+    core) and the one with the best simplified silhouette wins.
+    When coarse_points (e.g. the Matryoshka prefixes of points) is given, the fitting
+    runs on those and the chosen clustering is refined with a few Lloyd iterations on
+    the full points.
+    Returns (centroids, labels, score).
+    """
+    if coarse_points is not None and coarse_points.shape[1] < points.shape[1]:
+        _, coarse_labels, _ = cluster_embeddings(coarse_points, k, seed)
+        centroids, labels = _refine_clusters(points, coarse_labels)
+        return (
+            centroids,
+            labels,
+            _simplified_silhouette(points, centroids, SHELVES_SCORE_SAMPLE_SIZE, seed),
+        )
+
+    if k is not None:
+        centroids, labels, _ = minibatch_kmeans(points, k, seed=seed)
+        return (
+            centroids,
+            labels,
+            _simplified_silhouette(points, centroids, SHELVES_SCORE_SAMPLE_SIZE, seed),
+        )
+
+    def fit(candidate_k):
+        centroids, labels, _ = minibatch_kmeans(points, candidate_k, seed=seed)
+        score = _simplified_silhouette(
+            points, centroids, SHELVES_SCORE_SAMPLE_SIZE, seed
+        )
+        return score, candidate_k, centroids, labels
+
+    candidate_ks = _candidate_shelf_counts(len(points))
+    with ThreadPoolExecutor(
+        max_workers=min(len(candidate_ks), os.cpu_count() or 1)
+    ) as executor:
+        fits = list(executor.map(fit, candidate_ks))
+    score, best_k, centroids, labels = max(fits, key=lambda result: result[0])
+    logger.info(
+        "Shelf count scores: "
+        + ", ".join(f"k={fit_k}: {fit_score:.3f}" for fit_score, fit_k, _, _ in fits)
+    )
+    return centroids, labels, score
+
+
+def _write_smart_shelves(
+    db: firestore.Client,
+    user_id: str,
+    index: UserEmbeddingIndex,
+    centroids: np.ndarray,
+    labels: np.ndarray,
+) -> list[dict]:
+    """
+    Write one /users/{userId}/smartShelves/{shelfId} document per non-empty cluster
+    (centroid, size and the videos closest to the centroid), tag each liked video with
+    its shelfId, and delete shelves left over from a previous run with more clusters.
+    Tags are merged in, so a video unliked since the index was loaded doesn't fail its
+    write chunk; the next sync removes the leftover tag.
+    """
+    user_ref = db.collection("users").document(user_id)
+    shelves_ref = user_ref.collection("smartShelves")
+    generated_at = datetime.now(timezone.utc)
+    writer = FirestoreWriteEngine(db)
+
+    shelves = []
+    for cluster in range(len(centroids)):
+        members = np.flatnonzero(labels == cluster)
+        if not len(members):
+            continue
+        shelf_id = f"shelf_{len(shelves)}"
+        centroid = centroids[cluster] / max(
+            float(np.linalg.norm(centroids[cluster])), 1e-12
+        )
+        closeness = index.matrix[members] @ centroid
+        representatives = members[
+            np.argsort(closeness)[::-1][:SHELVES_REPRESENTATIVE_VIDEOS]
+        ]
+        shelf = {
+            "shelfId": shelf_id,
+            "size": int(len(members)),
+            "representativeVideoIds": [index.video_ids[i] for i in representatives],
+        }
+        writer.set(
+            shelves_ref.document(shelf_id),
+            {
+                **shelf,
+                "centroid": encode_embedding(centroid),
+                "generatedAt": generated_at,
+            },
+        )
+        for member in members:
+            writer.set(
+                user_ref.collection("likedVideos").document(index.video_ids[member]),
+                {"shelfId": shelf_id},
+                merge=True,
+            )
+        shelves.append(shelf)
+
+    current_ids = {shelf["shelfId"] for shelf in shelves}
+    for shelf_doc in shelves_ref.select([]).get():
+        if shelf_doc.id not in current_ids:
+            writer.delete(shelf_doc.reference)
+    writer.commit()
+    return shelves
+
+
+@https_fn.on_call(timeout_sec=540, memory=MemoryOption.GB_2, cpu=2)
+def generate_smart_shelves(req: https_fn.CallableRequest) -> dict:
+    """
+    Group a user's liked videos into Smart Shelves with k-means over their embeddings.
+    Takes the embeddings from the same index search uses (the in-memory LRU, else the
+    memory-mapped snapshot plus queued deltas, else a full scan), clusters their Matryoshka
+    prefixes with mini-batch k-means (k-means++ seeding, automatic shelf count unless k
+    is given), refines the clusters at full dimension and writes the shelves and each
+    liked video's shelfId back to Firestore.
+
+    Expects: user_id in the request data, optionally k.
+    Returns: dict with the shelf count, silhouette score and per-shelf summaries.
+    """
+    user_id = req.data.get("user_id")
+    if not user_id:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+            message="The function must be called with a valid 'user_id'.",
+        )
+    requested_k = req.data.get("k")
+    if requested_k is not None:
+        try:
+            requested_k = max(1, int(requested_k))
+        except (TypeError, ValueError):
+            raise https_fn.HttpsError(
+                code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
+                message="'k' must be a positive integer.",
             )
-            retried += 1
-    update_embedding_progress(user_id)
-    return {"retried": retried}
+
+    db = _get_firestore_client()
+    # Clustering reads the matrix but never modifies it, so the shared (possibly
+    # memory-mapped) index serves it as it is
+    index = _get_user_embedding_index(db, user_id)
+    if len(index.video_ids) < SHELVES_MIN_K:
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.FAILED_PRECONDITION,
+            message=f"At least {SHELVES_MIN_K} embedded liked videos are needed to build shelves.",
+        )
+
+    start = time.monotonic()
+    centroids, labels, score = cluster_embeddings(
+        index.matrix, requested_k, coarse_points=index.prefix
+    )
+    logger.info(
+        f"Clustered {len(index.video_ids)} videos into {len(centroids)} shelves for user "
+        f"{user_id} in {time.monotonic() - start:.1f}s (silhouette {score:.3f})"
+    )
+
+    try:
+        shelves = _write_smart_shelves(db, user_id, index, centroids, labels)
+    except Exception as e:
+        logger.error(f"Failed to write smart shelves for user {user_id}: {str(e)}")
+        raise https_fn.HttpsError(
+            code=https_fn.FunctionsErrorCode.INTERNAL,
+            message=f"Failed to write smart shelves: {str(e)}",
+        )
+    return {
+        "shelf_count": len(shelves),
+        "silhouette": score,
+        "clustered_videos": len(index.video_ids),
+        "shelves": shelves,
+    }
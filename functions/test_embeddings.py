@@ -0,0 +1,1359 @@
+import unittest
+from unittest.mock import patch, Mock, AsyncMock, ANY
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# It's crucial to mock these before importing the main module
+# to prevent Firebase Admin SDK from trying to initialize.
+with patch("firebase_admin.initialize_app"):
+    from main import (
+        _SecretCache,
+        _pack_embedding_batches,
+        _prepare_embedding_text,
+        _estimate_token_count,
+        _generate_embeddings_batch,
+        _update_progress_for_all_users,
+        _apply_embedding_status_transition,
+        _increment_embedding_progress,
+        read_embedding_progress,
+        _apply_like_changes_to_progress,
+        update_embedding_progress,
+        _enqueue_embedding_recounts,
+        _liker_ref,
+        _find_failed_liked_video_ids,
+        _run_embedding_retry_job,
+        _create_embedding_retry_job,
+        EMBEDDING_BACKFILL_BATCH_SIZE,
+        _backfill_item_id,
+        InMemoryWorkQueue,
+        drain_work_queue,
+        _has_valid_embedding,
+        encode_embedding,
+        decode_embedding,
+        decode_embedding_matrix,
+        _migrate_video_embeddings,
+        UserEmbeddingIndex,
+        _LruCache,
+        _get_query_embedding,
+        _load_user_embedding_index,
+        minibatch_kmeans,
+        cluster_embeddings,
+        _write_smart_shelves,
+        EmbeddingSnapshotStore,
+        LocalSnapshotBackend,
+        _apply_snapshot_deltas,
+        _save_embedding_snapshot,
+        FIRESTORE_WRITE_CHUNK_SIZE,
+        EMBEDDING_PROGRESS_SHARDS,
+        EmbeddingContentCache,
+        _embedding_text_hash,
+        _AdaptiveConcurrencyLimiter,
+        _AsyncAdaptiveConcurrencyLimiter,
+        EmbeddingRateLimitedError,
+        EmbeddingRetryableError,
+        WorkItemDeferred,
+        AsyncEmbeddingBackfill,
+        drain_work_queue_async,
+        _async_openai_client_in_use,
+    )
+from google.api_core import exceptions as google_exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1.vector import Vector
+import numpy as np
+from openai import (
+    APIConnectionError,
+    BadRequestError,
+    InternalServerError,
+    RateLimitError,
+)
+import httpx
+
+
+class TestEmbeddingPipeline(unittest.TestCase):
+    """
+    Test suite for the video embedding pipeline helpers.
+    """
+
+    def test_secret_cache_reuses_value_until_expiry(self):
+        """
+        Tests that the secret loader is only called again once the TTL has passed.
+        """
+        loader = Mock(side_effect=["key-1", "key-2"])
+        cache = _SecretCache(loader, ttl_sec=0.05, refresh_ahead_sec=0)
+
+        self.assertEqual(cache.get(), "key-1")
+        self.assertEqual(cache.get(), "key-1")
+        self.assertEqual(loader.call_count, 1)
+
+        time.sleep(0.06)
+        self.assertEqual(cache.get(), "key-2")
+        self.assertEqual(loader.call_count, 2)
+
+    def test_secret_cache_refreshes_in_background(self):
+        """
+        Tests that a value close to expiry is still served while a background refresh runs.
+        """
+        loader = Mock(side_effect=["key-1", "key-2"])
+        cache = _SecretCache(loader, ttl_sec=60, refresh_ahead_sec=60)
+
+        self.assertEqual(cache.get(), "key-1")
+        # Inside the refresh-ahead window: stale value returned, refresh kicked off
+        self.assertEqual(cache.get(), "key-1")
+
+        deadline = time.monotonic() + 1
+        while loader.call_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.01)
+        self.assertEqual(cache.get(), "key-2")
+
+    def test_pack_embedding_batches_respects_item_and_token_budgets(self):
+        """
+        Tests that packing starts a new batch when either budget would be exceeded.
+        """
+        items = [(f"video{i}", "x" * 60) for i in range(5)]  # ~10 tokens each
+
+        self.assertEqual(
+            [len(batch) for batch in _pack_embedding_batches(items, 2, 1000)],
+            [2, 2, 1],
+        )
+        self.assertEqual(
+            [len(batch) for batch in _pack_embedding_batches(items, 100, 30)],
+            [3, 2],
+        )
+
+    def test_prepare_embedding_text_strips_boilerplate_and_caps_tokens(self):
+        """
+        Tests that links, promotion lines, chapter timestamps, repeated hashtags and
+        repeated lines are removed, and that long descriptions are cut to the budget.
+        """
+        description = "\n".join(
+            [
+                "Making sourdough at home #baking #bread",
+                "Use code BREAD10 for 10% off flour: https://example.com/shop",
+                "Instagram: https://instagram.com/baker",
+                "0:00 Intro",
+                "(1:23:45) - Shaping the loaf #baking",
+                "Full recipe on the blog https://example.com/recipe",
+                "Making sourdough at home #baking #bread",
+            ]
+        )
+
+        text = _prepare_embedding_text("Sourdough", description, "Baker")
+
+        self.assertEqual(
+            text,
+            "Title: Sourdough | Channel: Baker | Description: Making sourdough at "
+            "home baking bread\nIntro\nShaping the loaf\nFull recipe on the blog",
+        )
+
+        long_text = _prepare_embedding_text(
+            "Title", " ".join(["word"] * 5000), "", token_budget=100
+        )
+        self.assertLessEqual(_estimate_token_count(long_text), 100)
+        self.assertTrue(long_text.startswith("Title: Title | Description: word"))
+        self.assertTrue(long_text.endswith("word"))
+
+    @patch(
+        "main._embedding_content_cache",
+        new_callable=lambda: Mock(get_many=Mock(return_value={})),
+    )
+    def test_generate_embeddings_batch_isolates_bad_input(self, mock_cache):
+        """
+        Tests that a rejected request is split so only the bad input fails.
+        """
+
+        def create(model, input, dimensions):
+            if "bad" in input:
+                raise BadRequestError(
+                    "invalid input", response=Mock(status_code=400), body=None
+                )
+            return Mock(
+                data=[
+                    Mock(index=index, embedding=[float(len(text))] * 1536)
+                    for index, text in enumerate(input)
+                ]
+            )
+
+        client = Mock()
+        client.embeddings.create.side_effect = create
+        client.with_options.return_value = client
+
+        results = _generate_embeddings_batch(
+            client, [("video1", "good"), ("video2", "bad"), ("video3", "fine!")]
+        )
+
+        self.assertEqual(results["video1"][0], 4.0)
+        self.assertEqual(results["video3"][0], 5.0)
+        self.assertIsInstance(results["video2"], ValueError)
+        # The first request carried all three inputs
+        self.assertEqual(
+            client.embeddings.create.call_args_list[0].kwargs["input"],
+            ["good", "bad", "fine!"],
+        )
+        # Only the successful embeddings are cached
+        self.assertEqual(
+            set(mock_cache.put_many.call_args.args[0]),
+            {_embedding_text_hash("good"), _embedding_text_hash("fine!")},
+        )
+
+    @patch("main._get_firestore_client")
+    def test_generate_embeddings_batch_embeds_each_distinct_text_once(
+        self, mock_get_client
+    ):
+        """
+        Tests that identical texts share one API input, that a persisted cache entry
+        skips the API entirely, and that fresh embeddings are written to the cache.
+        """
+        mock_db = mock_get_client.return_value
+        cached_hash = _embedding_text_hash("Title: Cached")
+        mock_db.get_all.return_value = [
+            Mock(
+                id=cached_hash,
+                exists=True,
+                get=Mock(return_value=encode_embedding([0.5, 0.5], "float32")),
+            )
+        ]
+        client = Mock()
+        client.with_options.return_value = client
+        client.embeddings.create.return_value = Mock(
+            data=[Mock(index=0, embedding=[1.0, 0.0])]
+        )
+
+        with patch("main._embedding_content_cache", EmbeddingContentCache(10)), patch(
+            "main.FirestoreWriteEngine"
+        ) as mock_writer:
+            results = _generate_embeddings_batch(
+                client,
+                [
+                    ("video1", "Title: Private video"),
+                    ("video2", "Title: Private video"),
+                    ("video3", "Title: Cached"),
+                ],
+            )
+
+        client.embeddings.create.assert_called_once_with(
+            model=ANY, input=["Title: Private video"], dimensions=1536
+        )
+        self.assertEqual(results["video1"], [1.0, 0.0])
+        self.assertEqual(results["video2"], [1.0, 0.0])
+        self.assertEqual(results["video3"].tolist(), [0.5, 0.5])
+        self.assertEqual(results["video3"].dtype, np.float32)
+        cache_write = mock_writer.return_value.set.call_args
+        self.assertEqual(
+            cache_write.args[0], mock_db.collection.return_value.document.return_value
+        )
+        mock_db.collection.return_value.document.assert_any_call(
+            _embedding_text_hash("Title: Private video")
+        )
+        self.assertEqual(
+            decode_embedding(cache_write.args[1]["embedding"]).tolist(), [1.0, 0.0]
+        )
+
+    @patch("main._increment_embedding_progress")
+    @patch("main._get_firestore_client")
+    def test_progress_fan_out_only_visits_likers(
+        self, mock_get_client, mock_increment_progress
+    ):
+        """
+        Tests that progress updates for a video go only to the users in its likers index,
+        without scanning /users.
+        """
+        mock_db = mock_get_client.return_value
+        likers_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+        likers_ref.stream.return_value = [Mock(id="user1"), Mock(id="user2")]
+
+        _update_progress_for_all_users("video1", {"completed": 1})
+
+        mock_db.collection.assert_called_once_with("videos")
+        mock_db.collection.return_value.document.assert_called_once_with("video1")
+        mock_db.collection.return_value.document.return_value.collection.assert_called_once_with(
+            "likers"
+        )
+        self.assertEqual(
+            [c.args[1:] for c in mock_increment_progress.call_args_list],
+            [("user1", {"completed": 1}), ("user2", {"completed": 1})],
+        )
+
+    @patch("main._record_snapshot_deltas")
+    @patch("main._increment_embedding_progress")
+    @patch("main._get_firestore_client")
+    def test_snapshot_deltas_only_go_to_users_with_snapshots(
+        self, mock_get_client, mock_increment_progress, mock_record_deltas
+    ):
+        """
+        Tests that a transition queues snapshot deltas only for likers that have a
+        snapshot, checked with one batched read.
+        """
+        mock_db = mock_get_client.return_value
+        likers_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+        likers_ref.stream.return_value = [Mock(id="user1"), Mock(id="user2")]
+        snapshot_doc = Mock(exists=True)
+        snapshot_doc.reference.parent.parent.id = "user2"
+        mock_db.get_all.return_value = [Mock(exists=False), snapshot_doc]
+
+        _update_progress_for_all_users("video1", {"completed": 1}, "upsert")
+
+        self.assertEqual(mock_increment_progress.call_count, 2)
+        mock_db.get_all.assert_called_once()
+        mock_record_deltas.assert_called_once_with(
+            mock_db, "user2", {"video1": "upsert"}
+        )
+
+    @patch("main._embedding_snapshot_store")
+    def test_consumed_snapshot_deltas_are_deleted_in_batches(self, mock_store):
+        """
+        Tests that consumed deltas are deleted with conditional batched deletes, falling
+        back to single deletes for a chunk holding a delta changed meanwhile.
+        """
+        mock_db = Mock()
+        deltas = [Mock(update_time=i) for i in range(FIRESTORE_WRITE_CHUNK_SIZE + 1)]
+        first_batch, second_batch = Mock(), Mock()
+        second_batch.commit.side_effect = google_exceptions.FailedPrecondition(
+            "changed"
+        )
+        mock_db.batch.side_effect = [first_batch, second_batch]
+
+        _save_embedding_snapshot(
+            mock_db, "user1", UserEmbeddingIndex(["a"], np.ones((1, 4))), deltas
+        )
+
+        mock_store.save.assert_called_once()
+        self.assertEqual(first_batch.delete.call_count, FIRESTORE_WRITE_CHUNK_SIZE)
+        first_batch.commit.assert_called_once()
+        # Only the chunk that failed its precondition is retried one by one
+        deltas[-1].reference.delete.assert_called_once()
+        deltas[0].reference.delete.assert_not_called()
+
+    @patch("main._update_progress_for_all_users")
+    def test_status_transitions_move_progress_counters(self, mock_fan_out):
+        """
+        Tests that only writes changing the progress bucket produce counter deltas.
+        """
+
+        def event(before_status, after_status):
+            change = Mock()
+            change.before.exists = before_status is not None
+            change.before.to_dict.return_value = {"embedding_status": before_status}
+            change.after.exists = True
+            change.after.to_dict.return_value = {"embedding_status": after_status}
+            return Mock(data=change, params={"videoId": "video1"})
+
+        _apply_embedding_status_transition(event("pending", "complete"))
+        _apply_embedding_status_transition(event("failed", "pending"))
+        _apply_embedding_status_transition(event("pending", "processing"))
+        _apply_embedding_status_transition(event(None, "pending"))
+
+        self.assertEqual(
+            [c.args for c in mock_fan_out.call_args_list],
+            [
+                ("video1", {"completed": 1}, "upsert"),
+                ("video1", {"failed": -1}, None),
+            ],
+        )
+
+    @patch("main.random.randrange", return_value=3)
+    def test_increment_progress_only_increments_one_shard(self, mock_randrange):
+        """
+        Tests that an increment is a single Increment write to one shard, reading nothing.
+        """
+        mock_db = Mock()
+        progress_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value
+        )
+        shards_ref = progress_ref.collection.return_value
+
+        _increment_embedding_progress(mock_db, "user1", {"completed": 1})
+
+        shards_ref.document.assert_called_once_with("3")
+        shard_write = shards_ref.document.return_value.set.call_args
+        self.assertIsInstance(shard_write.args[0]["completed"], firestore.Increment)
+        self.assertTrue(shard_write.kwargs["merge"])
+        shards_ref.stream.assert_not_called()
+        progress_ref.set.assert_not_called()
+
+    def test_read_progress_sums_shards_with_aggregation(self):
+        """
+        Tests that progress is read with one aggregation query over the shards.
+        """
+        mock_db = Mock()
+        shards_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value.collection.return_value
+        )
+        aggregation = shards_ref.sum.return_value.sum.return_value.sum.return_value
+        aggregation.get.return_value = [
+            [
+                Mock(alias="total", value=10),
+                Mock(alias="completed", value=7),
+                Mock(alias="failed", value=1),
+            ]
+        ]
+
+        progress = read_embedding_progress(mock_db, "user1")
+
+        self.assertEqual(
+            progress, {"total": 10, "completed": 7, "failed": 1, "pending": 2}
+        )
+        shards_ref.stream.assert_not_called()
+
+    @patch("main._increment_embedding_progress")
+    def test_like_changes_read_status_as_of_liker_commit(self, mock_increment):
+        """
+        Tests that new likes are counted by their status as of the likers write, so a
+        transition that already saw the liker isn't counted a second time.
+        """
+        mock_db = Mock()
+        commit_time = datetime.now(timezone.utc)
+        mock_db.get_all.return_value = [
+            Mock(
+                exists=True, to_dict=Mock(return_value={"embedding_status": "complete"})
+            )
+        ]
+        liker_ref = _liker_ref(mock_db, "video1", "user1")
+
+        _apply_like_changes_to_progress(
+            mock_db, "user1", ["video1"], [], {liker_ref: commit_time}
+        )
+
+        self.assertEqual(mock_db.get_all.call_args.kwargs["read_time"], commit_time)
+        mock_increment.assert_called_once_with(
+            mock_db, "user1", {"total": 1, "completed": 1, "failed": 0}
+        )
+
+    @patch("main.firestore.transactional", side_effect=lambda fn: fn)
+    @patch("main._get_firestore_client")
+    def test_recount_resets_shards_in_one_transaction(
+        self, mock_get_client, mock_transactional
+    ):
+        """
+        Tests that a recount reads the shards, likes and statuses in its transaction and
+        resets the shards through it, so concurrent increments can't be overwritten.
+        """
+        mock_db = mock_get_client.return_value
+        transaction = mock_db.transaction.return_value
+        liked_videos_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+        liked_videos_ref.get.return_value = [Mock(id="v1"), Mock(id="v2")]
+        statuses = [
+            Mock(
+                exists=True, to_dict=Mock(return_value={"embedding_status": "complete"})
+            ),
+            Mock(
+                exists=True, to_dict=Mock(return_value={"embedding_status": "failed"})
+            ),
+        ]
+        mock_db.get_all.side_effect = lambda refs, **kwargs: (
+            statuses if "field_paths" in kwargs else []
+        )
+
+        update_embedding_progress("user1")
+
+        liked_videos_ref.get.assert_called_once_with(transaction=transaction)
+        for read in mock_db.get_all.call_args_list:
+            self.assertIs(read.kwargs["transaction"], transaction)
+        shard_writes = [write.args[1] for write in transaction.set.call_args_list]
+        self.assertEqual(len(shard_writes), EMBEDDING_PROGRESS_SHARDS)
+        self.assertEqual(shard_writes[0], {"total": 2, "completed": 1, "failed": 1})
+        mock_db.batch.assert_not_called()
+
+    def test_recount_enqueues_one_dated_item_per_user(self):
+        """
+        Tests that the daily recount only lists user IDs and queues one item per user,
+        keyed by the run date so each run's items are new.
+        """
+        mock_db = Mock()
+        users_query = mock_db.collection.return_value.select.return_value
+        users_query.stream.return_value = [Mock(id="u1"), Mock(id="u2")]
+
+        with patch("main.FirestoreWorkQueue") as mock_queue_class:
+            mock_queue_class.return_value.enqueue.side_effect = len
+            enqueued = _enqueue_embedding_recounts(mock_db, "20260101")
+
+        mock_db.collection.return_value.select.assert_called_once_with([])
+        self.assertEqual(enqueued, 2)
+        self.assertEqual(
+            mock_queue_class.return_value.enqueue.call_args_list[0].args[0],
+            {
+                "20260101-u1": {"userId": "u1"},
+                "20260101-u2": {"userId": "u2"},
+            },
+        )
+
+    def test_find_failed_liked_videos_uses_projected_batch_reads(self):
+        """
+        Tests that failed liked videos are found with a name-only likedVideos listing and
+        status-only get_all reads instead of one read per video.
+        """
+        mock_db = Mock()
+        liked_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+        liked_ref.select.return_value.get.return_value = [
+            Mock(id=f"video{i}") for i in range(1, 5)
+        ]
+        now = datetime.now(timezone.utc)
+
+        def video_doc(video_id, status, marked_at=None):
+            video_data = {"embedding_status": status}
+            if marked_at:
+                video_data["embedding_retry_marked_at"] = marked_at
+            return Mock(id=video_id, exists=True, to_dict=Mock(return_value=video_data))
+
+        mock_db.get_all.return_value = [
+            video_doc("video1", "failed"),
+            video_doc("video2", "complete"),
+            # Held by a retry job that died long ago, and by one still running
+            video_doc("video3", "pending", now - timedelta(hours=2)),
+            video_doc("video4", "pending", now),
+        ]
+
+        self.assertEqual(
+            _find_failed_liked_video_ids(mock_db, "user1"), ["video1", "video3"]
+        )
+        liked_ref.select.assert_called_once_with([])
+        mock_db.get_all.assert_called_once_with(
+            ANY, field_paths=["embedding_status", "embedding_retry_marked_at"]
+        )
+
+    @patch("main.FirestoreWriteEngine")
+    def test_retry_job_is_written_before_videos_are_marked(self, mock_writer):
+        """
+        Tests that a retry job exists, with its video IDs in chunk documents rather than
+        one array, before any of its videos is marked.
+        """
+        video_ids = [f"video{i}" for i in range(EMBEDDING_BACKFILL_BATCH_SIZE + 1)]
+        calls = Mock()
+        job_ref = Mock(id="job1")
+        job_ref.set.side_effect = lambda data: calls.job_set(data["status"])
+        mock_writer.return_value.commit.side_effect = calls.commit
+        mock_writer.return_value.update.side_effect = (
+            lambda ref, data: calls.video_update(data["embedding_retry_job_id"])
+        )
+
+        _create_embedding_retry_job(Mock(), job_ref, video_ids)
+
+        self.assertEqual(
+            [c[0] for c in calls.mock_calls[:3]], ["job_set", "commit", "video_update"]
+        )
+        self.assertEqual(calls.mock_calls[0].args, ("preparing",))
+        self.assertEqual(calls.mock_calls[2].args, ("job1",))
+        chunk_writes = [c.args[1] for c in mock_writer.return_value.set.call_args_list]
+        self.assertEqual(
+            [len(chunk["videoIds"]) for chunk in chunk_writes],
+            [EMBEDDING_BACKFILL_BATCH_SIZE, 1],
+        )
+        self.assertNotIn("videoIds", job_ref.set.call_args.args[0])
+        marker_write = mock_writer.return_value.update.call_args.args[1]
+        self.assertIsInstance(marker_write["embedding_retry_marked_at"], datetime)
+
+    @patch("main.FirestoreWriteEngine")
+    @patch("main._get_openai_client")
+    @patch("main._generate_embeddings_batch")
+    def test_retry_job_embeds_in_packed_batches(
+        self, mock_generate, mock_get_client, mock_writer
+    ):
+        """
+        Tests that a retry job embeds its videos with packed requests, clears the retry
+        marker on every result and records the counts on the job document.
+        """
+        mock_db = Mock()
+
+        def video_doc(video_id, title):
+            return Mock(
+                id=video_id, exists=True, to_dict=Mock(return_value={"title": title})
+            )
+
+        mock_db.get_all.return_value = [
+            video_doc("video1", "One"),
+            video_doc("video2", ""),
+        ]
+        mock_generate.return_value = {"video1": [0.1, 0.2]}
+        job_ref = Mock()
+
+        counts = _run_embedding_retry_job(mock_db, job_ref, ["video1", "video2"])
+
+        self.assertEqual(counts, {"succeeded": 1, "failed": 1})
+        mock_generate.assert_called_once_with(
+            mock_get_client.return_value, [("video1", "Title: One")]
+        )
+        updates = [c.args[1] for c in mock_writer.return_value.update.call_args_list]
+        self.assertEqual(
+            sorted(update["embedding_status"] for update in updates),
+            ["complete", "failed"],
+        )
+        self.assertTrue(all("embedding_retry_job_id" in update for update in updates))
+        self.assertEqual(job_ref.update.call_args.args[0]["status"], "completed")
+
+    @patch("main._defer_retryable_embeddings")
+    @patch("main.FirestoreWriteEngine")
+    @patch("main._get_openai_client")
+    @patch("main._generate_embeddings_batch")
+    def test_retry_job_clears_marker_timestamp_of_deferred_videos(
+        self, mock_generate, mock_get_client, mock_writer, mock_defer
+    ):
+        """
+        Tests that videos a retry job defers to the backfill queue keep the job ID but
+        lose the marker timestamp, so the stale-marker sweeps don't reclaim them.
+        """
+        mock_db = Mock()
+        mock_db.get_all.return_value = [
+            Mock(id="video1", exists=True, to_dict=Mock(return_value={"title": "One"}))
+        ]
+        mock_generate.return_value = {
+            "video1": EmbeddingRateLimitedError("Rate limited", 10)
+        }
+
+        counts = _run_embedding_retry_job(mock_db, Mock(), ["video1"])
+
+        self.assertEqual(counts, {"succeeded": 0, "failed": 0})
+        mock_defer.assert_called_once_with(mock_db, ["video1"], 10)
+        update = mock_writer.return_value.update.call_args.args[1]
+        self.assertEqual(update, {"embedding_retry_marked_at": firestore.DELETE_FIELD})
+
+    def test_work_queue_leases_each_item_once_across_workers(self):
+        """
+        Tests that parallel workers drain the queue with every item processed exactly once.
+        """
+        queue = InMemoryWorkQueue()
+        queue.enqueue({f"item{i}": {"n": i} for i in range(50)})
+        processed = []
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(
+                executor.map(
+                    lambda _: drain_work_queue(
+                        queue,
+                        lambda payload: processed.append(payload["n"]),
+                        budget_sec=5,
+                    ),
+                    range(4),
+                )
+            )
+
+        self.assertEqual(sorted(processed), list(range(50)))
+        self.assertEqual(sum(result["completed"] for result in results), 50)
+        self.assertEqual(queue.stats(), {"pending": 0, "done": 50, "dead": 0})
+        # Re-enqueueing a finished item re-arms it; a pending one is left alone
+        self.assertEqual(queue.enqueue({"item0": {"n": 0}}), 1)
+        self.assertEqual(queue.enqueue({"item0": {"n": 0}}), 0)
+        self.assertEqual(queue.stats(), {"pending": 1, "done": 49, "dead": 0})
+
+    def test_backfill_item_ids_follow_chunk_content(self):
+        """
+        Tests that backfill items are keyed by their chunk's video IDs: the same chunk
+        keeps its item, and a chunk shifted by a new video becomes a new item.
+        """
+        chunk = ["a", "b", "c"]
+
+        self.assertEqual(_backfill_item_id(chunk), _backfill_item_id(list(chunk)))
+        self.assertNotEqual(
+            _backfill_item_id(chunk), _backfill_item_id(["a", "a2", "b"])
+        )
+        self.assertNotEqual(_backfill_item_id(["ab"]), _backfill_item_id(["a", "b"]))
+
+    def test_work_queue_redelivers_after_visibility_timeout_and_dead_letters(self):
+        """
+        Tests that an abandoned lease becomes visible again, that a stale lease can't
+        complete the item, and that repeated failures dead-letter it.
+        """
+        now = [0.0]
+        queue = InMemoryWorkQueue(
+            visibility_timeout_sec=10,
+            max_attempts=3,
+            retry_backoff_sec=1,
+            clock=lambda: now[0],
+        )
+        queue.enqueue({"item": {}})
+
+        abandoned = queue.lease()[0]
+        self.assertEqual(queue.lease(), [])
+        now[0] = 11
+        redelivered = queue.lease()[0]
+        self.assertEqual(redelivered.attempts, 2)
+        self.assertFalse(queue.complete(abandoned))
+
+        queue.fail(redelivered, "boom")
+        self.assertEqual(queue.lease(), [])
+        now[0] = 13
+        last_attempt = queue.lease()[0]
+        queue.fail(last_attempt, "boom")
+        now[0] = 100
+        self.assertEqual(queue.lease(), [])
+        self.assertEqual(queue.stats(), {"pending": 0, "done": 0, "dead": 1})
+
+    def test_deferred_work_items_keep_their_attempts(self):
+        """
+        Tests that a handler raising WorkItemDeferred puts the item back after the delay
+        without counting the attempt towards dead-lettering.
+        """
+        now = [0.0]
+        queue = InMemoryWorkQueue(max_attempts=1, clock=lambda: now[0])
+        queue.enqueue({"item": {}})
+
+        def rate_limited(payload):
+            raise WorkItemDeferred(20, "rate limited")
+
+        counts = drain_work_queue(queue, rate_limited, budget_sec=5)
+
+        self.assertEqual(counts, {"completed": 0, "failed": 0, "deferred": 1})
+        self.assertEqual(queue.lease(), [])
+        now[0] = 20
+        self.assertEqual(queue.lease()[0].attempts, 1)
+
+    def test_adaptive_concurrency_limiter_is_aimd(self):
+        """
+        Tests additive increase on fast responses, one multiplicative decrease per window
+        of in-flight failures, the floor and ceiling, and the Retry-After pause.
+        """
+        now = [0.0]
+        limiter = _AdaptiveConcurrencyLimiter(
+            4, 1, 4.5, latency_target_sec=2, clock=lambda: now[0]
+        )
+
+        with limiter.slot() as started_at:
+            now[0] += 1
+            limiter.record_success(started_at)
+        self.assertEqual(limiter.limit, 4.25)
+        for _ in range(4):
+            with limiter.slot() as started_at:
+                limiter.record_success(started_at)
+        self.assertEqual(limiter.limit, 4.5)
+
+        # Three requests in flight hit 429s: the limit halves once
+        with limiter.slot() as first, limiter.slot() as second, limiter.slot() as third:
+            now[0] += 1
+            for started_at in (first, second, third):
+                limiter.record_failure(started_at, retry_after_sec=30)
+        self.assertEqual(limiter.limit, 2.25)
+        self.assertEqual(limiter.in_flight, 0)
+
+        # A slow response counts as congestion; the limit never drops below the floor
+        for _ in range(5):
+            started_at = now[0]
+            now[0] += 3
+            limiter.record_success(started_at)
+        self.assertEqual(limiter.limit, 1)
+
+        # Requests wait out the Retry-After
+        acquired = []
+        thread = threading.Thread(
+            target=lambda: acquired.append(limiter.slot().__enter__())
+        )
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(acquired, [])
+        now[0] += 30
+        with limiter._condition:
+            limiter._condition.notify_all()
+        thread.join(1)
+        self.assertEqual(len(acquired), 1)
+
+    def test_async_concurrency_limiter_caps_in_flight_and_pauses(self):
+        """
+        Tests that the async limiter holds requests beyond its limit until a slot frees up,
+        shares the AIMD arithmetic, and makes new requests wait out a Retry-After.
+        """
+        now = [0.0]
+        limiter = _AsyncAdaptiveConcurrencyLimiter(
+            2, 1, 4, latency_target_sec=2, clock=lambda: now[0]
+        )
+
+        async def run():
+            entered = []
+
+            async def request(name, hold):
+                async with limiter.slot() as started_at:
+                    entered.append(name)
+                    await hold.wait()
+                    await limiter.record_success(started_at)
+
+            holds = [asyncio.Event() for _ in range(3)]
+            tasks = [
+                asyncio.create_task(request(name, hold))
+                for name, hold in zip("abc", holds)
+            ]
+            await asyncio.sleep(0.01)
+            self.assertEqual(entered, ["a", "b"])
+            holds[0].set()
+            await asyncio.sleep(0.01)
+            self.assertEqual(entered, ["a", "b", "c"])
+            for hold in holds[1:]:
+                hold.set()
+            await asyncio.gather(*tasks)
+            self.assertGreater(limiter.limit, 2)
+
+            async with limiter.slot() as started_at:
+                await limiter.record_failure(started_at, retry_after_sec=30)
+            self.assertLess(limiter.limit, 2)
+            waiting = asyncio.create_task(request("d", asyncio.Event()))
+            await asyncio.sleep(0.01)
+            self.assertEqual(entered[-1], "c")
+            now[0] += 30
+            async with limiter._condition:
+                limiter._condition.notify_all()
+            await asyncio.sleep(0.01)
+            self.assertEqual(entered[-1], "d")
+            waiting.cancel()
+
+        asyncio.run(run())
+
+    @patch("main._async_openai_client_uses", new_callable=dict)
+    @patch("main._async_openai_client_lock", new_callable=asyncio.Lock)
+    @patch("main._async_openai_client", None)
+    @patch("main._async_openai_client_key", None)
+    @patch("main.AsyncOpenAI")
+    @patch("main._get_openai_api_key")
+    def test_async_openai_client_is_shared_and_closed_once_idle(
+        self, mock_get_key, mock_async_openai, mock_lock, mock_uses
+    ):
+        """
+        Tests that concurrent backfill runs share one AsyncOpenAI client, and that a
+        client replaced after a key rotation is only closed once the last run using it
+        has finished.
+        """
+        mock_get_key.return_value = "key1"
+        clients = []
+
+        def make_client(api_key, max_retries):
+            client = Mock(api_key=api_key, close=AsyncMock())
+            clients.append(client)
+            return client
+
+        mock_async_openai.side_effect = make_client
+
+        async def run():
+            release = asyncio.Event()
+
+            async def use():
+                async with _async_openai_client_in_use() as client:
+                    await release.wait()
+                    return client
+
+            first_runs = [asyncio.create_task(use()) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            mock_get_key.return_value = "key2"
+            async with _async_openai_client_in_use() as rotated:
+                self.assertEqual(rotated.api_key, "key2")
+            clients[0].close.assert_not_awaited()
+            release.set()
+            first_clients = await asyncio.gather(*first_runs)
+            self.assertEqual(first_clients, [clients[0], clients[0]])
+
+        asyncio.run(run())
+
+        self.assertEqual(len(clients), 2)
+        clients[0].close.assert_awaited_once()
+        clients[1].close.assert_not_awaited()
+
+    @patch(
+        "main._openai_concurrency",
+        new_callable=lambda: _AdaptiveConcurrencyLimiter(4, 1, 8, 10),
+    )
+    @patch("main._embedding_content_cache")
+    def test_generate_embeddings_batch_reports_rate_limits(
+        self, mock_cache, mock_limiter
+    ):
+        """
+        Tests that a 429 is reported as EmbeddingRateLimitedError with its Retry-After
+        instead of a failure, and that it lowers the concurrency limit.
+        """
+        mock_cache.get_many.return_value = {}
+        client = Mock()
+        client.with_options.return_value = client
+
+        def create(model, input, dimensions):
+            if input == ["limited"]:
+                raise RateLimitError(
+                    "slow down",
+                    response=Mock(status_code=429, headers={"retry-after": "7"}),
+                    body=None,
+                )
+            return Mock(data=[Mock(index=0, embedding=[1.0] * 1536)])
+
+        client.embeddings.create.side_effect = create
+
+        # One request per video
+        with patch(
+            "main._pack_embedding_batches",
+            side_effect=lambda items: [[item] for item in items],
+        ):
+            results = _generate_embeddings_batch(
+                client, [("video1", "ok"), ("video2", "limited")]
+            )
+
+        self.assertEqual(results["video1"][0], 1.0)
+        self.assertIsInstance(results["video2"], EmbeddingRateLimitedError)
+        self.assertEqual(results["video2"].retry_after_sec, 7)
+        client.with_options.assert_called_once_with(max_retries=0)
+        self.assertLess(mock_limiter.limit, 4)
+
+    @patch("main._embedding_content_cache")
+    def test_generate_embeddings_batch_requeues_transient_errors(self, mock_cache):
+        """
+        Tests that with the client's retries off, a 5xx or connection error is reported
+        as retryable rather than as a permanent failure.
+        """
+        mock_cache.get_many.return_value = {}
+        client = Mock()
+        client.with_options.return_value = client
+        request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+
+        def create(model, input, dimensions):
+            if input == ["server"]:
+                raise InternalServerError(
+                    "oops", response=httpx.Response(500, request=request), body=None
+                )
+            raise APIConnectionError(request=request)
+
+        client.embeddings.create.side_effect = create
+
+        with patch(
+            "main._pack_embedding_batches",
+            side_effect=lambda items: [[item] for item in items],
+        ):
+            results = _generate_embeddings_batch(
+                client, [("video1", "server"), ("video2", "connection")]
+            )
+
+        for video_id in ("video1", "video2"):
+            self.assertIsInstance(results[video_id], EmbeddingRetryableError)
+            self.assertNotIsInstance(results[video_id], EmbeddingRateLimitedError)
+
+    def _async_db(self, video_docs):
+        """Mock AsyncClient whose get_all yields video_docs and whose batches record updates."""
+        mock_db = Mock()
+
+        async def get_all(refs, field_paths=None):
+            for video_doc in video_docs:
+                yield video_doc
+
+        mock_db.get_all = Mock(side_effect=get_all)
+        mock_db.batch.return_value.commit = AsyncMock()
+        return mock_db
+
+    @patch("main._get_firestore_client")
+    @patch("main._embedding_content_cache")
+    def test_async_backfill_streams_writes_and_defers_rate_limited_videos(
+        self, mock_cache, mock_get_client
+    ):
+        """
+        Tests that the async engine embeds duplicate texts once, decodes base64 vectors,
+        writes each request's results, and defers the item for rate-limited videos
+        instead of marking them failed.
+        """
+        mock_cache.get_many.return_value = {}
+        mock_db = self._async_db(
+            [
+                Mock(id=video_id, exists=True, to_dict=Mock(return_value=data))
+                for video_id, data in [
+                    ("a", {"title": "Same"}),
+                    ("b", {"title": "Same"}),
+                    ("limited", {"title": "Limited"}),
+                ]
+            ]
+        )
+        encoded = base64.b64encode(np.ones(1536, dtype="<f4").tobytes()).decode()
+
+        async def create(model, input, dimensions, encoding_format):
+            self.assertEqual(encoding_format, "base64")
+            if input == ["Title: Limited"]:
+                raise RateLimitError(
+                    "slow down",
+                    response=Mock(status_code=429, headers={"retry-after-ms": "1500"}),
+                    body=None,
+                )
+            return Mock(data=[Mock(index=0, embedding=encoded)])
+
+        openai_client = Mock()
+        openai_client.embeddings.create = AsyncMock(side_effect=create)
+        limiter = _AsyncAdaptiveConcurrencyLimiter(4, 1, 8, 10)
+
+        async def run():
+            engine = AsyncEmbeddingBackfill(openai_client, mock_db, limiter=limiter)
+            with patch(
+                "main._pack_embedding_batches",
+                side_effect=lambda items: [[item] for item in items],
+            ):
+                await engine.backfill(["a", "b", "limited"])
+
+        with self.assertRaises(WorkItemDeferred) as deferred:
+            asyncio.run(run())
+
+        self.assertEqual(deferred.exception.delay_sec, 1.5)
+        self.assertEqual(openai_client.embeddings.create.call_count, 2)
+        self.assertLess(limiter.limit, 4)
+        updates = mock_db.batch.return_value.update.call_args_list
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(
+            all(update.args[1]["embedding_status"] == "complete" for update in updates)
+        )
+        self.assertEqual(decode_embedding(updates[0].args[1]["embedding"])[0], 1.0)
+        mock_cache.put_many.assert_called()
+
+    @patch("main._get_firestore_client")
+    def test_backfill_reads_skip_vectors_except_for_legacy_documents(
+        self, mock_get_client
+    ):
+        """
+        Tests that backfill candidates are read without the embedding vector, and that only
+        completed documents lacking embedding_dim have their vector read and tagged.
+        """
+
+        def video_doc(video_id, data):
+            return Mock(id=video_id, exists=True, to_dict=Mock(return_value=data))
+
+        mock_db = self._async_db(
+            [
+                video_doc("new", {"title": "New"}),
+                video_doc(
+                    "current",
+                    {"embedding_status": "complete", "embedding_dim": 1536},
+                ),
+                video_doc("legacy", {"embedding_status": "complete"}),
+            ]
+        )
+        blocking_db = mock_get_client.return_value
+        blocking_db.get_all.return_value = [
+            video_doc("legacy", {"embedding": [0.0] * 1536})
+        ]
+        engine = AsyncEmbeddingBackfill(Mock(), mock_db)
+
+        candidates = asyncio.run(engine._read_candidates(["new", "current", "legacy"]))
+
+        self.assertNotIn("embedding", mock_db.get_all.call_args.kwargs["field_paths"])
+        legacy_read = blocking_db.get_all.call_args
+        self.assertEqual(legacy_read.kwargs["field_paths"], ["embedding"])
+        self.assertEqual(len(legacy_read.args[0]), 1)
+        self.assertFalse(_has_valid_embedding(candidates["new"]))
+        self.assertTrue(_has_valid_embedding(candidates["current"]))
+        self.assertTrue(_has_valid_embedding(candidates["legacy"]))
+        blocking_db.batch.return_value.update.assert_called_once_with(
+            ANY, {"embedding_dim": 1536}
+        )
+
+    def test_async_work_queue_runs_items_concurrently(self):
+        """
+        Tests that the async drain keeps several items in flight and settles each one.
+        """
+        queue = InMemoryWorkQueue()
+        queue.enqueue({f"item{i}": {"n": i} for i in range(20)})
+        in_flight = [0, 0]
+
+        async def handler(payload):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            await asyncio.sleep(0.01)
+            in_flight[0] -= 1
+            if payload["n"] == 0:
+                raise WorkItemDeferred(60, "rate limited")
+
+        counts = asyncio.run(
+            drain_work_queue_async(queue, handler, budget_sec=5, concurrency=8)
+        )
+
+        self.assertEqual(counts, {"completed": 19, "failed": 0, "deferred": 1})
+        self.assertEqual(in_flight[1], 8)
+
+    def test_async_work_queue_keeps_leasing_while_items_run(self):
+        """
+        Tests that an empty lease doesn't stop the async drain while items are running,
+        so items coming due in the meantime are still picked up.
+        """
+        queue = InMemoryWorkQueue()
+        queue.enqueue({"first": {"n": 0}})
+        processed = []
+
+        async def handler(payload):
+            processed.append(payload["n"])
+            if payload["n"] == 0:
+                # The next lease comes back empty; this item becomes visible after it
+                await asyncio.sleep(0.01)
+                queue.enqueue({"second": {"n": 1}})
+                await asyncio.sleep(0.01)
+
+        counts = asyncio.run(
+            drain_work_queue_async(queue, handler, budget_sec=5, concurrency=8)
+        )
+
+        self.assertEqual(processed, [0, 1])
+        self.assertEqual(counts["completed"], 2)
+
+    def test_embedding_codec_round_trips_every_storage_format(self):
+        """
+        Tests that float32 blobs, Vectors and legacy lists all decode to float32 arrays,
+        and that a blob is half the size of the doubles it replaces.
+        """
+        values = [0.25, -1.5, 3.0]
+
+        blob = encode_embedding(values, "float32")
+        self.assertIsInstance(blob, bytes)
+        self.assertEqual(len(blob), 4 * len(values))
+        self.assertIsInstance(encode_embedding(values, "vector"), Vector)
+
+        for stored in (blob, encode_embedding(values, "vector"), values):
+            decoded = decode_embedding(stored)
+            self.assertEqual(decoded.dtype, np.float32)
+            self.assertEqual(decoded.tolist(), values)
+
+        matrix = decode_embedding_matrix([blob, blob])
+        self.assertEqual(matrix.shape, (2, 3))
+        self.assertTrue(
+            _has_valid_embedding({"embedding": encode_embedding([0.0] * 1536)})
+        )
+
+    @patch("main._get_firestore_client")
+    def test_migration_rewrites_only_legacy_embeddings(self, mock_get_client):
+        """
+        Tests that the migration handler re-encodes list embeddings and leaves documents
+        already in the storage format alone.
+        """
+        mock_db = mock_get_client.return_value
+
+        def video_doc(embedding):
+            return Mock(
+                exists=True, to_dict=Mock(return_value={"embedding": embedding})
+            )
+
+        mock_db.get_all.return_value = [
+            video_doc([0.5, 0.5]),
+            video_doc(encode_embedding([0.5, 0.5])),
+        ]
+
+        self.assertEqual(_migrate_video_embeddings(["video1", "video2"]), 1)
+        update = mock_db.batch.return_value.update.call_args.args[1]
+        self.assertEqual(update["embedding"], encode_embedding([0.5, 0.5]))
+        self.assertEqual(update["embedding_dim"], 2)
+        mock_db.get_all.assert_called_once_with(ANY, field_paths=["embedding"])
+
+    def test_user_embedding_index_ranks_by_cosine_similarity(self):
+        """
+        Tests coarse-to-fine top-k ranking over a 20k-row index (prefix shortlist,
+        full-dimension scores), and that a warm search is fast.
+        """
+        rng = np.random.default_rng(0)
+        matrix = rng.standard_normal((20000, 1536)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        index = UserEmbeddingIndex([f"video{i}" for i in range(20000)], matrix)
+        query = matrix[42] + 0.5 * matrix[7]
+        query /= np.linalg.norm(query)
+
+        start = time.monotonic()
+        ranked = index.top_k(query, 5)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(
+            [video_id for video_id, _ in ranked[:2]], ["video42", "video7"]
+        )
+        self.assertEqual(len(ranked), 5)
+        self.assertAlmostEqual(ranked[0][1], float(matrix[42] @ query), places=5)
+        self.assertEqual(index.prefix.shape, (20000, 256))
+        self.assertLess(elapsed, 0.1)
+
+    @patch("main._query_embedding_cache", _LruCache(2))
+    @patch("main._get_openai_client")
+    @patch("main._generate_embedding", return_value=[3.0, 4.0])
+    def test_query_embeddings_are_cached_and_normalized(
+        self, mock_generate, mock_get_client
+    ):
+        """
+        Tests that repeat queries (ignoring case and spacing) skip the embeddings API.
+        """
+        first = _get_query_embedding("Lo-fi  Beats")
+        second = _get_query_embedding("lo-fi beats")
+
+        self.assertEqual(mock_generate.call_count, 1)
+        np.testing.assert_allclose(first, [0.6, 0.8], rtol=1e-6)
+        self.assertIs(first, second)
+
+    def test_load_user_embedding_index_skips_unembedded_videos(self):
+        """
+        Tests that the index reads only the embedding field and leaves out videos
+        without a valid embedding.
+        """
+        mock_db = Mock()
+        liked_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+        liked_ref.select.return_value.get.return_value = [Mock(id="a"), Mock(id="b")]
+        mock_db.get_all.return_value = [
+            Mock(
+                id="a",
+                exists=True,
+                to_dict=Mock(
+                    return_value={"embedding": encode_embedding([1.0] * 1536)}
+                ),
+            ),
+            Mock(id="b", exists=True, to_dict=Mock(return_value={})),
+        ]
+
+        index = _load_user_embedding_index(mock_db, "user1")
+
+        self.assertEqual(index.video_ids, ["a"])
+        self.assertEqual(index.matrix.shape, (1, 1536))
+        self.assertAlmostEqual(float(np.linalg.norm(index.matrix[0])), 1.0, places=5)
+        mock_db.get_all.assert_called_once_with(ANY, field_paths=["embedding"])
+
+    def _clustered_points(self, clusters, per_cluster, dim=64, noise=0.1):
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+        truth = np.repeat(np.arange(clusters), per_cluster)
+        points = centers[truth] + noise * rng.standard_normal((len(truth), dim)).astype(
+            np.float32
+        )
+        points /= np.linalg.norm(points, axis=1, keepdims=True)
+        return points, truth
+
+    def test_minibatch_kmeans_recovers_separated_clusters(self):
+        """
+        Tests that mini-batch k-means puts each well-separated group in its own cluster.
+        """
+        points, truth = self._clustered_points(clusters=5, per_cluster=400)
+
+        centroids, labels, inertia = minibatch_kmeans(points, 5, batch_size=256)
+
+        self.assertEqual(centroids.shape, (5, 64))
+        # Every true group maps to exactly one cluster, and vice versa
+        pairs = set(zip(truth.tolist(), labels.tolist()))
+        self.assertEqual(len(pairs), 5)
+        self.assertEqual(len({label for _, label in pairs}), 5)
+        self.assertGreater(inertia, 0)
+
+    def test_cluster_embeddings_selects_shelf_count(self):
+        """
+        Tests that automatic k selection prefers the true number of groups.
+        """
+        points, _ = self._clustered_points(clusters=7, per_cluster=300)
+
+        centroids, labels, score = cluster_embeddings(points)
+
+        self.assertEqual(len(centroids), 7)
+        self.assertEqual(len(labels), len(points))
+        self.assertGreater(score, 0.5)
+
+    def test_cluster_embeddings_refines_prefix_clusters_at_full_dimension(self):
+        """
+        Tests that clusters fitted on truncated vectors are refined into full-dimension
+        centroids that keep the true groups apart.
+        """
+        points, truth = self._clustered_points(clusters=7, per_cluster=300)
+        prefixes = points[:, :16] / np.linalg.norm(
+            points[:, :16], axis=1, keepdims=True
+        )
+
+        centroids, labels, score = cluster_embeddings(points, coarse_points=prefixes)
+
+        self.assertEqual(centroids.shape, (7, 64))
+        pairs = set(zip(truth.tolist(), labels.tolist()))
+        self.assertEqual(len(pairs), 7)
+        self.assertGreater(score, 0.5)
+
+    @patch("main.FirestoreWriteEngine")
+    def test_write_smart_shelves_tags_liked_videos(self, mock_writer):
+        """
+        Tests that each non-empty cluster becomes a shelf, each liked video is tagged with
+        its shelf, and stale shelves are deleted.
+        """
+        mock_db = Mock()
+        shelves_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+        stale_shelf = Mock(id="shelf_5")
+        shelves_ref.select.return_value.get.return_value = [stale_shelf]
+        matrix = np.eye(3, dtype=np.float32)
+        index = UserEmbeddingIndex(["a", "b", "c"], matrix)
+        centroids = np.stack([matrix[0], matrix[1], matrix[2]])
+
+        shelves = _write_smart_shelves(
+            mock_db, "user1", index, centroids, np.array([0, 0, 2])
+        )
+
+        self.assertEqual([shelf["size"] for shelf in shelves], [2, 1])
+        self.assertEqual(shelves[0]["representativeVideoIds"][0], "a")
+        tags = [
+            c.args[1]
+            for c in mock_writer.return_value.set.call_args_list
+            if c.kwargs.get("merge")
+        ]
+        mock_writer.return_value.update.assert_not_called()
+        self.assertEqual(
+            tags,
+            [{"shelfId": "shelf_0"}, {"shelfId": "shelf_0"}, {"shelfId": "shelf_1"}],
+        )
+        mock_writer.return_value.delete.assert_called_once_with(stale_shelf.reference)
+
+    def test_snapshot_store_round_trips_memory_mapped(self):
+        """
+        Tests that a saved snapshot loads back memory-mapped, and that a newer snapshot
+        replaces the locally cached copy.
+        """
+        with tempfile.TemporaryDirectory() as store_dir, tempfile.TemporaryDirectory() as cache_dir:
+            store = EmbeddingSnapshotStore(LocalSnapshotBackend(store_dir), cache_dir)
+            self.assertIsNone(store.load("user1"))
+
+            store.save(
+                "user1", UserEmbeddingIndex(["a", "b"], np.eye(2, dtype=np.float32))
+            )
+            loaded = store.load("user1")
+            self.assertIsInstance(loaded.matrix, np.memmap)
+            self.assertEqual(loaded.video_ids, ["a", "b"])
+            np.testing.assert_array_equal(loaded.matrix, np.eye(2))
+            self.assertIsInstance(loaded.prefix, np.memmap)
+
+            time.sleep(0.01)
+            store.save(
+                "user1", UserEmbeddingIndex(["c"], np.ones((1, 2), dtype=np.float32))
+            )
+            self.assertEqual(store.load("user1").video_ids, ["c"])
+
+    @patch("main.EMBEDDING_DIMENSIONALITY", 2)
+    def test_snapshot_deltas_replace_remove_and_append_rows(self):
+        """
+        Tests that queued deltas drop removed videos, replace re-embedded ones and append
+        new ones, reading embeddings only for the upserted videos.
+        """
+        mock_db = Mock()
+        deltas_ref = (
+            mock_db.collection.return_value.document.return_value.collection.return_value
+        )
+
+        def delta(video_id, op):
+            doc = Mock(id=video_id)
+            doc.get.side_effect = {"op": op}.get
+            return doc
+
+        deltas_ref.stream.return_value = [
+            delta("a", "remove"),
+            delta("b", "upsert"),
+            delta("d", "upsert"),
+        ]
+        mock_db.get_all.return_value = [
+            Mock(
+                id="b",
+                exists=True,
+                to_dict=Mock(return_value={"embedding": encode_embedding([0.0, 2.0])}),
+            ),
+            Mock(id="d", exists=True, to_dict=Mock(return_value={})),
+        ]
+        index = UserEmbeddingIndex(
+            ["a", "b", "c"], np.array([[1, 0], [1, 0], [0, 1]], dtype=np.float32)
+        )
+
+        updated, consumed = _apply_snapshot_deltas(mock_db, "user1", index)
+
+        self.assertEqual(updated.video_ids, ["c", "b"])
+        np.testing.assert_array_equal(updated.matrix, [[0, 1], [0, 1]])
+        self.assertEqual(len(consumed), 3)
+        mock_db.get_all.assert_called_once_with(ANY, field_paths=["embedding"])
+
+
+if __name__ == "__main__":
+    unittest.main()
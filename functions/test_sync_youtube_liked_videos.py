@@ -1,19 +1,174 @@
 import unittest
 from unittest.mock import patch, Mock, ANY, call
 from firebase_functions import https_fn
-from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
 from datetime import datetime, timezone
+import time
+import flask
+import numpy as np
+
+
+class _RecordingDict(dict):
+    """
+    Dict that records the path of every key read through get() or [], so tests can
+    check which response fields a parser touches.
+    """
+
+    def __init__(self, data: dict, reads: set, prefix: str = ""):
+        super().__init__(data)
+        self._reads = reads
+        self._prefix = prefix
+
+    def _wrap(self, key, value):
+        path = f"{self._prefix}{key}"
+        self._reads.add(path)
+        if isinstance(value, dict):
+            return _RecordingDict(value, self._reads, f"{path}/")
+        return value
+
+    def __getitem__(self, key):
+        return self._wrap(key, super().__getitem__(key))
+
+    def get(self, key, default=None):
+        return self._wrap(key, super().get(key, default))
+
+
+class _FakeDocument:
+    """Document reference of _FakeFirestore."""
+
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str):
+        return _FakeCollection(self._db, f"{self.path}/{name}")
+
+    def get(self, **kwargs):
+        return _FakeSnapshot(self, self._db.docs.get(self.path))
+
+    def set(self, data: dict, merge: bool = False):
+        self._db.write("set", self, data, merge)
+
+    def update(self, data: dict):
+        self._db.write("update", self, data, False)
+
+    def delete(self):
+        self._db.docs.pop(self.path, None)
+
+
+class _FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        return self._data[field]
+
+
+class _FakeCollection:
+    def __init__(self, db, path: str):
+        self._db = db
+        self.path = path
+
+    def document(self, document_id: str):
+        return _FakeDocument(self._db, f"{self.path}/{document_id}")
+
+    def select(self, field_paths):
+        return self
+
+    def get(self, **kwargs):
+        return [
+            _FakeSnapshot(_FakeDocument(self._db, path), data)
+            for path, data in sorted(self._db.docs.items())
+            if path.rsplit("/", 1)[0] == self.path
+        ]
+
+
+class _FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+        self.commit_time = None
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(("update", ref, data, False))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref, None, False))
+
+    def commit(self):
+        for method, ref, data, merge in self._writes:
+            if method == "delete":
+                ref.delete()
+            else:
+                self._db.write(method, ref, data, merge)
+        self.commit_time = datetime.now(timezone.utc)
+
+
+class _FakeFirestore:
+    """
+    Minimal in-memory Firestore (documents by path, set/merge/update/delete, batches and
+    collection listings), for tests that check what several writers leave behind.
+    """
+
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name: str):
+        return _FakeCollection(self, name)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+    def write(self, method, ref, data, merge):
+        if method == "update" and ref.path not in self.docs:
+            raise google_exceptions.NotFound(f"No document to update: {ref.path}")
+        if method == "set" and not merge:
+            self.docs[ref.path] = dict(data)
+        else:
+            self.docs.setdefault(ref.path, {}).update(data)
+
 
 # It's crucial to mock these before importing the main module
 # to prevent Firebase Admin SDK from trying to initialize.
-with patch.dict("sys.modules", {"firebase_admin": Mock()}):
+# Patching initialize_app (rather than swapping sys.modules) keeps the imported
+# main module registered, so patch("main.<name>") targets the same module.
+with patch("firebase_admin.initialize_app"):
     from main import (
         fetch_liked_video_items,
         fetch_video_details,
         is_private_legacy_video,
         get_existing_video_ids,
         Video,
+        LikedVideoPage,
+        _stream_liked_video_sync,
+        _TokenBucket,
+        YouTubeServiceFactory,
+        FirestoreClientRegistry,
+        FirestoreWriteEngine,
+        FirestoreWriteError,
+        _run_incremental_sync,
+        sync_youtube_liked_videos,
+        _write_smart_shelves,
+        UserEmbeddingIndex,
+        YouTubeEtagCache,
+        _parse_liked_video_item,
+        _parse_video_item,
+        YOUTUBE_PLAYLIST_ITEM_FIELDS,
+        YOUTUBE_VIDEO_ITEM_FIELDS,
+        YOUTUBE_PLAYLIST_PAGE_PROJECTION,
+        YOUTUBE_VIDEOS_PROJECTION,
     )
+from google.api_core import exceptions as google_exceptions
 
 
 class TestYouTubeSyncFunctions(unittest.TestCase):
@@ -21,10 +176,11 @@ class TestYouTubeSyncFunctions(unittest.TestCase):
     Test suite for the scalable YouTube sync functions.
     """
 
-    @patch("google.oauth2.credentials.Credentials")
-    @patch("main.build")
+    @patch("main.Credentials")
+    @patch("main._youtube_service_factory", new_callable=YouTubeServiceFactory)
+    @patch("main.build_from_document")
     def test_fetch_liked_video_items_creates_proper_credentials(
-        self, mock_build, mock_credentials_class
+        self, mock_build, mock_factory, mock_credentials_class
     ):
         """
         Tests that fetch_liked_video_items correctly constructs the Credentials object
@@ -74,9 +230,11 @@ class TestYouTubeSyncFunctions(unittest.TestCase):
             scopes=["https://www.googleapis.com/auth/youtube.readonly"],
         )
 
-        # Verify that 'build' was called with the mock credentials
-        mock_build.assert_called_once_with(
-            "youtube", "v3", credentials=mock_credentials_instance
+        # Verify that the service was built once from the static discovery document
+        # with an HTTP transport authorized by the mock credentials
+        mock_build.assert_called_once_with(ANY, http=ANY)
+        self.assertIs(
+            mock_build.call_args.kwargs["http"].credentials, mock_credentials_instance
         )
 
         # Verify the API call was made with correct parameters (playlist endpoint)
@@ -85,6 +243,7 @@ class TestYouTubeSyncFunctions(unittest.TestCase):
             part="snippet",
             maxResults=50,
             pageToken=None,
+            fields=YOUTUBE_PLAYLIST_PAGE_PROJECTION,
         )
 
         # Verify result structure includes videoId, likedAt, and title
@@ -112,8 +271,9 @@ class TestYouTubeSyncFunctions(unittest.TestCase):
         self.assertFalse(is_private_legacy_video("Private Video"))  # Case sensitive
         self.assertFalse(is_private_legacy_video("private video"))  # Case sensitive
 
+    @patch("main._firestore_registry", new_callable=FirestoreClientRegistry)
     @patch("google.cloud.firestore.Client")
-    def test_get_existing_video_ids(self, mock_firestore_client):
+    def test_get_existing_video_ids(self, mock_firestore_client, mock_registry):
         """
         Tests the function that checks which video IDs already exist in Firestore.
         Tests the new optimized implementation using get_all().
@@ -163,11 +323,14 @@ class TestYouTubeSyncFunctions(unittest.TestCase):
         ]
         mock_collection.document.assert_has_calls(expected_calls, any_order=True)
         # Verify get_all was called with the document references
-        mock_db.get_all.assert_called_once_with(mock_doc_refs)
+        mock_db.get_all.assert_called_once_with(mock_doc_refs, field_paths=[])
 
-    @patch("google.oauth2.credentials.Credentials")
-    @patch("main.build")
-    def test_fetch_video_details(self, mock_build, mock_credentials_class):
+    @patch("main.Credentials")
+    @patch("main._youtube_service_factory", new_callable=YouTubeServiceFactory)
+    @patch("main.build_from_document")
+    def test_fetch_video_details(
+        self, mock_build, mock_factory, mock_credentials_class
+    ):
         """
         Tests that fetch_video_details correctly fetches metadata for specific video IDs.
         """
@@ -217,9 +380,512 @@ class TestYouTubeSyncFunctions(unittest.TestCase):
 
         # Verify API call used the correct parameters
         mock_youtube_service.videos.return_value.list.assert_called_with(
-            part="id,snippet", id="video1"
+            part="id,snippet", id="video1", fields=YOUTUBE_VIDEOS_PROJECTION
+        )
+
+    @patch("main.fetch_video_details")
+    @patch("main.get_existing_video_ids")
+    @patch("main.iter_liked_video_pages")
+    def test_stream_liked_video_sync_processes_each_page(
+        self, mock_iter_pages, mock_get_existing, mock_fetch_details
+    ):
+        """
+        Tests that the streaming sync checks, looks up and writes each page on its own
+        and merges the per-page results in playlist order.
+        """
+        liked_at = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        mock_iter_pages.return_value = iter(
+            [
+                LikedVideoPage(
+                    items=[
+                        {"videoId": "video1", "likedAt": liked_at, "title": "One"},
+                        {"videoId": "video2", "likedAt": liked_at, "title": "Two"},
+                    ],
+                    total_results=3,
+                    next_page_token="page2",
+                ),
+                LikedVideoPage(
+                    items=[
+                        {
+                            "videoId": "video3",
+                            "likedAt": liked_at,
+                            "title": "Private video",
+                        }
+                    ],
+                    total_results=3,
+                ),
+            ]
+        )
+        mock_get_existing.side_effect = lambda ids: {"video2"} & set(ids)
+        mock_fetch_details.side_effect = lambda token, ids: [
+            Video(
+                videoId=video_id,
+                title="Fetched",
+                description="",
+                thumbnailUrl="",
+                channelTitle="Channel",
+                publishedAt=liked_at,
+            )
+            for video_id in ids
+            if video_id == "video1"
+        ]
+        mock_db = Mock()
+        mock_sync_job_ref = Mock()
+
+        # Act
+        items, videos, existing_ids, placeholders, total = _stream_liked_video_sync(
+            mock_db, "test-token", mock_sync_job_ref
         )
 
+        # Assert
+        self.assertEqual(
+            [item["videoId"] for item in items], ["video1", "video2", "video3"]
+        )
+        self.assertEqual([video.videoId for video in videos], ["video1", "video3"])
+        self.assertEqual(existing_ids, {"video2"})
+        self.assertEqual(placeholders, 1)
+        self.assertEqual(total, 3)
+        mock_fetch_details.assert_has_calls(
+            [
+                call("test-token", ["video1"]),
+                call("test-token", ["video3"]),
+            ],
+            any_order=True,
+        )
+        # One staged write per page that produced new videos
+        self.assertEqual(mock_db.batch.return_value.commit.call_count, 2)
+        mock_sync_job_ref.update.assert_any_call({"totalCount": 3})
+
+    @patch("main._youtube_rate_limiter", _TokenBucket(rate=1000))
+    @patch("main.Credentials")
+    @patch("main._youtube_service_factory", new_callable=YouTubeServiceFactory)
+    @patch("main.build_from_document")
+    def test_fetch_video_details_concurrent_preserves_input_order(
+        self, mock_build, mock_factory, mock_credentials_class
+    ):
+        """
+        Tests that concurrent videos.list batches are returned in input order.
+        """
+
+        # Arrange: the API echoes back each requested ID, in reverse order
+        def list_videos(part, id, fields):
+            request = Mock()
+            request.execute.return_value = {
+                "items": [
+                    {"id": video_id, "snippet": {"title": video_id}}
+                    for video_id in reversed(id.split(","))
+                ]
+            }
+            return request
+
+        mock_build.return_value.videos.return_value.list.side_effect = list_videos
+        video_ids = [f"video{i}" for i in range(120)]
+
+        # Act
+        result = fetch_video_details("test-token", video_ids, max_in_flight=3)
+
+        # Assert
+        self.assertEqual([video.videoId for video in result], video_ids)
+        self.assertEqual(mock_build.return_value.videos.return_value.list.call_count, 3)
+
+    def test_etag_cache_reuses_cached_page_on_304(self):
+        """
+        Tests that a 304 Not Modified reply is answered from the ETag cache, that the
+        request carries the cached ETag in If-None-Match, and that only the requested
+        page's entry is read.
+        """
+        # Arrange: a cached first page, and an API that replies 304
+        mock_db = Mock()
+        etag_cache = YouTubeEtagCache(mock_db, "user1")
+        cached_response = {
+            "etag": "etag-1",
+            "items": [{"contentDetails": {"videoId": "video1"}}],
+        }
+        cached_doc = Mock(exists=True)
+        cached_doc.to_dict.return_value = {
+            "kind": "playlistPage",
+            "etag": "etag-1",
+            "payload": cached_response,
+        }
+        etag_collection = etag_cache.collection
+        etag_collection.document.return_value.get.return_value = cached_doc
+        request = Mock(headers={})
+        request.execute.side_effect = HttpError(Mock(status=304), b"")
+        key = YouTubeEtagCache.playlist_page_key(None)
+
+        # Act
+        result = etag_cache.execute(request, key, "playlistPage")
+        etag_cache.execute(request, key, "playlistPage")
+
+        # Assert
+        self.assertEqual(result, cached_response)
+        self.assertEqual(request.headers["If-None-Match"], "etag-1")
+        self.assertEqual(etag_cache.hits, 2)
+        # The entry is read once, by key, without scanning the collection
+        etag_collection.document.assert_called_once_with(key)
+        etag_collection.where.assert_not_called()
+        # Nothing changed, so nothing needs writing back
+        etag_cache.flush()
+        mock_db.batch.assert_not_called()
+
+    def test_parsers_only_read_projected_fields(self):
+        """
+        Tests that the playlistItems and videos.list parsers read no leaf field outside
+        the fields= projection sent to the API.
+        """
+        cases = [
+            (
+                _parse_liked_video_item,
+                YOUTUBE_PLAYLIST_ITEM_FIELDS,
+                YOUTUBE_PLAYLIST_PAGE_PROJECTION,
+                {
+                    "snippet": {
+                        "title": "Liked",
+                        "publishedAt": "2024-01-01T00:00:00Z",
+                        "resourceId": {"videoId": "video1"},
+                    }
+                },
+            ),
+            (
+                _parse_video_item,
+                YOUTUBE_VIDEO_ITEM_FIELDS,
+                YOUTUBE_VIDEOS_PROJECTION,
+                {
+                    "id": "video1",
+                    "snippet": {
+                        "title": "Video",
+                        "description": "Description",
+                        "channelTitle": "Channel",
+                        "publishedAt": "2024-01-01T00:00:00Z",
+                        "thumbnails": {"default": {"url": "https://example.com"}},
+                    },
+                },
+            ),
+        ]
+        for parser, item_fields, projection, item in cases:
+            with self.subTest(parser=parser.__name__):
+                reads = set()
+                parser(_RecordingDict(item, reads))
+                # Intermediate objects (e.g. "snippet") are fine as long as every read
+                # falls inside one of the projected paths
+                for path in reads:
+                    self.assertTrue(
+                        any(
+                            field == path or field.startswith(f"{path}/")
+                            for field in item_fields
+                        ),
+                        f"{parser.__name__} reads {path} outside the projection",
+                    )
+                self.assertIn(f"items({','.join(item_fields)})", projection)
+
+    def test_token_bucket_limits_rate(self):
+        """
+        Tests that the token bucket blocks once its burst capacity is used up.
+        """
+        bucket = _TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(4):
+            bucket.acquire()
+        # Two tokens are available immediately, the next two take 1/20 s each
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    @patch("main._youtube_rate_limiter", _TokenBucket(rate=1000))
+    @patch("main.Credentials")
+    @patch("main._youtube_service_factory", new_callable=YouTubeServiceFactory)
+    @patch("main.build_from_document")
+    def test_fetch_video_details_batch_http_maps_auth_errors(
+        self, mock_build, mock_factory, mock_credentials_class
+    ):
+        """
+        Tests that multiplexed videos.list calls go out in one batch HTTP request and
+        that a 401 sub-request error surfaces as UNAUTHENTICATED.
+        """
+        mock_youtube_service = mock_build.return_value
+        added_requests = []
+
+        def new_batch_http_request(callback):
+            batch_request = Mock()
+            batch_request.add.side_effect = lambda request, request_id: (
+                added_requests.append(request_id)
+            )
+
+            def execute():
+                callback("1", {"items": [{"id": "video0", "snippet": {}}]}, None)
+                callback("2", None, HttpError(Mock(status=401), b""))
+
+            batch_request.execute.side_effect = execute
+            return batch_request
+
+        mock_youtube_service.new_batch_http_request.side_effect = new_batch_http_request
+        video_ids = [f"video{i}" for i in range(60)]
+
+        # Act & Assert
+        with self.assertRaises(https_fn.HttpsError) as context:
+            fetch_video_details("test-token", video_ids, use_batch_http=True)
+        self.assertEqual(
+            context.exception.code, https_fn.FunctionsErrorCode.UNAUTHENTICATED
+        )
+        self.assertEqual(added_requests, ["1", "2"])
+        mock_youtube_service.new_batch_http_request.assert_called_once()
+
+    @patch("main.get_static_doc")
+    @patch("main.Credentials")
+    @patch("main.build_from_document")
+    def test_youtube_service_factory_reuses_services(
+        self, mock_build, mock_credentials_class, mock_get_static_doc
+    ):
+        """
+        Tests that the service factory parses the discovery document once and reuses
+        a released service, swapping in the new access token.
+        """
+        mock_get_static_doc.return_value = '{"name": "youtube"}'
+        factory = YouTubeServiceFactory()
+
+        with factory.lease("token-1") as first_service:
+            pass
+        with factory.lease("token-2") as second_service:
+            self.assertEqual(mock_credentials_class.return_value.token, "token-2")
+
+        self.assertIs(first_service, second_service)
+        mock_build.assert_called_once_with({"name": "youtube"}, http=ANY)
+        mock_get_static_doc.assert_called_once_with("youtube", "v3")
+
+    @patch("google.cloud.firestore.Client")
+    def test_firestore_client_registry_shares_and_reconnects(
+        self, mock_firestore_client
+    ):
+        """
+        Tests that the registry hands out one shared client and recreates it
+        when a health check fails.
+        """
+        first_client, second_client = Mock(), Mock()
+        mock_firestore_client.side_effect = [first_client, second_client]
+        registry = FirestoreClientRegistry(health_check_interval_sec=0)
+
+        self.assertIs(registry.get(), first_client)
+
+        # The next get() runs a health check, which fails on the first client
+        first_client.collection.return_value.document.return_value.get.side_effect = (
+            Exception("channel closed")
+        )
+        self.assertIs(registry.get(), second_client)
+        self.assertEqual(mock_firestore_client.call_count, 2)
+
+    @patch("main.time.sleep")
+    def test_write_engine_chunks_groups_and_retries(self, mock_sleep):
+        """
+        Tests that the write engine splits writes into chunks without breaking groups,
+        retries a chunk on transient errors and reports per-chunk progress.
+        """
+        committed_chunks = []
+        attempts = {"count": 0}
+
+        def new_batch():
+            batch = Mock()
+            writes = []
+            batch.set.side_effect = lambda ref, data, merge=False: writes.append(ref)
+            batch.delete.side_effect = lambda ref: writes.append(ref)
+
+            def commit():
+                attempts["count"] += 1
+                if attempts["count"] == 1:
+                    raise google_exceptions.ServiceUnavailable("try again")
+                committed_chunks.append(list(writes))
+
+            batch.commit.side_effect = commit
+            return batch
+
+        mock_db = Mock()
+        mock_db.batch.side_effect = new_batch
+        progress = []
+        engine = FirestoreWriteEngine(
+            mock_db,
+            chunk_size=3,
+            max_in_flight=1,
+            progress_callback=lambda done, total, ops: progress.append(
+                (done, total, ops)
+            ),
+        )
+
+        engine.set("a", {})
+        engine.set("b", {})
+        with engine.group():
+            engine.set("c", {})
+            engine.delete("d")
+        engine.set("e", {})
+
+        # Act
+        written = engine.commit()
+
+        # Assert: the group is not split across chunks; first chunk retried once
+        self.assertEqual(written, 5)
+        self.assertEqual(committed_chunks, [["a", "b"], ["c", "d", "e"]])
+        self.assertEqual(attempts["count"], 3)
+        self.assertEqual(progress, [(1, 2, 2), (2, 2, 5)])
+
+    def test_write_engine_raises_after_permanent_failure(self):
+        """
+        Tests that a chunk failing with a non-transient error surfaces as FirestoreWriteError.
+        """
+        mock_db = Mock()
+        mock_db.batch.return_value.commit.side_effect = (
+            google_exceptions.InvalidArgument("bad write")
+        )
+        engine = FirestoreWriteEngine(mock_db)
+        engine.set("a", {})
+
+        with self.assertRaises(FirestoreWriteError) as context:
+            engine.commit()
+        self.assertEqual(context.exception.failed_chunks, 1)
+        mock_db.batch.return_value.commit.assert_called_once()
+
+    def _liked_pages(self, pages_fetched):
+        """Newest-first playlist of video5..video1 in pages of two, recording each fetch."""
+        items = [
+            {
+                "videoId": f"video{i}",
+                "likedAt": datetime(2023, 1, i, tzinfo=timezone.utc),
+                "title": f"Video {i}",
+            }
+            for i in range(5, 0, -1)
+        ]
+        for start in range(0, len(items), 2):
+            pages_fetched.append(start // 2 + 1)
+            yield LikedVideoPage(items=items[start : start + 2], total_results=5)
+
+    @patch("main._record_like_changes_in_snapshot")
+    @patch("main._apply_like_changes_to_progress")
+    @patch("main.FirestoreWriteEngine")
+    @patch("main.fetch_video_details", return_value=[])
+    @patch("main.get_existing_video_ids", return_value=set())
+    @patch("main.iter_liked_video_pages")
+    def test_incremental_sync_stops_at_watermark(
+        self,
+        mock_iter_pages,
+        mock_get_existing,
+        mock_fetch_details,
+        mock_writer,
+        mock_apply_like_changes,
+        mock_record_snapshot_changes,
+    ):
+        """
+        Tests that the incremental sync stops paging once it reaches the watermark
+        and only stores the likes newer than it.
+        """
+        pages_fetched = []
+        mock_iter_pages.return_value = self._liked_pages(pages_fetched)
+        previous_job_data = {
+            "watermark": {
+                "videoId": "video3",
+                "likedAt": datetime(2023, 1, 3, tzinfo=timezone.utc),
+            },
+            "likedCount": 3,
+        }
+        mock_sync_job_ref = Mock()
+
+        mock_db = Mock()
+        result = _run_incremental_sync(
+            mock_db, "test-token", "user1", mock_sync_job_ref, previous_job_data
+        )
+
+        self.assertEqual(pages_fetched, [1, 2])
+        self.assertEqual(result["newly_liked"], 2)
+        mock_get_existing.assert_called_once_with(["video5", "video4"])
+        final_update = mock_sync_job_ref.update.call_args_list[-1].args[0]
+        self.assertEqual(final_update["watermark"]["videoId"], "video5")
+        self.assertEqual(final_update["likedCount"], 5)
+        mock_writer.return_value.commit.assert_called_once()
+        mock_apply_like_changes.assert_called_once_with(
+            mock_db,
+            "user1",
+            ["video5", "video4"],
+            [],
+            mock_writer.return_value.commit_times,
+        )
+        mock_record_snapshot_changes.assert_called_once_with(
+            mock_db, "user1", ["video5", "video4"], []
+        )
+
+    @patch("main.FirestoreWriteEngine")
+    @patch("main.iter_liked_video_pages")
+    def test_incremental_sync_falls_back_on_count_mismatch(
+        self, mock_iter_pages, mock_writer
+    ):
+        """
+        Tests that a disagreeing playlist total aborts the incremental sync without writes.
+        """
+        mock_iter_pages.return_value = self._liked_pages([])
+        previous_job_data = {
+            "watermark": {
+                "videoId": "video3",
+                "likedAt": datetime(2023, 1, 3, tzinfo=timezone.utc),
+            },
+            "likedCount": 4,  # one like was removed since the last sync
+        }
+
+        result = _run_incremental_sync(
+            Mock(), "test-token", "user1", Mock(), previous_job_data
+        )
+
+        self.assertIsNone(result)
+        mock_writer.assert_not_called()
+
+    @patch("main._record_like_changes_in_snapshot")
+    @patch("main._apply_like_changes_to_progress")
+    @patch("main.get_existing_video_ids", side_effect=set)
+    @patch("main.iter_liked_video_pages")
+    @patch("main._get_firestore_client")
+    def test_full_sync_keeps_smart_shelf_assignments(
+        self,
+        mock_get_client,
+        mock_iter_pages,
+        mock_get_existing,
+        mock_apply_like_changes,
+        mock_record_snapshot_changes,
+    ):
+        """
+        Tests that a full sync run after generate_smart_shelves tagged the liked videos
+        leaves their shelfId in place, and that a tag merged onto a video unliked in the
+        meantime is cleaned up instead of breaking the sync.
+        """
+        db = _FakeFirestore()
+        mock_get_client.return_value = db
+        liked_at = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        liked_ref = db.collection("users").document("user1").collection("likedVideos")
+        for video_id in ("video1", "video2"):
+            liked_ref.document(video_id).set({"likedAt": liked_at})
+            db.collection("videos").document(video_id).set({"title": video_id})
+
+        # video3 was unliked after the index was loaded, so its tag lands on no like
+        index = UserEmbeddingIndex(
+            ["video1", "video2", "video3"], np.eye(3, dtype=np.float32)
+        )
+        _write_smart_shelves(db, "user1", index, np.eye(3)[:2], np.array([0, 1, 1]))
+        mock_iter_pages.return_value = [
+            LikedVideoPage(
+                items=[
+                    {"videoId": video_id, "likedAt": liked_at, "title": video_id}
+                    for video_id in ("video1", "video2")
+                ],
+                total_results=2,
+            )
+        ]
+
+        app = flask.Flask(__name__)
+        with app.test_request_context(
+            "/",
+            method="POST",
+            json={"data": {"access_token": "test-token", "user_id": "user1"}},
+        ):
+            response = sync_youtube_liked_videos(flask.request)
+
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        liked = {doc.id: doc.to_dict() for doc in liked_ref.get()}
+        self.assertEqual(set(liked), {"video1", "video2"})
+        self.assertEqual(liked["video1"]["shelfId"], "shelf_0")
+        self.assertEqual(liked["video2"]["shelfId"], "shelf_1")
+        self.assertIn("syncedAt", liked["video1"])
+
 
 if __name__ == "__main__":
     unittest.main()